@@ -1,7 +1,9 @@
 import os
+from functools import wraps
 from typing import Any, Callable, Union
 
 import click
+from click.globals import pop_context, push_context
 
 from r2k.constants import CONFIG_ENV_VAR, DEFAULT_CONFIG_PATH
 
@@ -98,3 +100,25 @@ def is_verbose() -> bool:
 def no_ansi() -> bool:
     """Return True if --no-ansi was passed to the top-level click command"""
     return get_global_context().params.get("no_ansi", False)
+
+
+def in_current_context(f: Callable) -> Callable:
+    """
+    Wrap `f` so that it runs under the currently active click context
+
+    Click keeps its context stack in a thread local, so without this worker threads would fall back to the dummy
+    context (and e.g. ignore the --verbose and --no-ansi flags)
+    """
+    ctx = click.get_current_context(silent=True)
+
+    @wraps(f)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not ctx:
+            return f(*args, **kwargs)
+        push_context(ctx)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            pop_context()
+
+    return wrapper
@@ -6,7 +6,6 @@ import click
 
 from r2k.cli import cli_utils, logger
 from r2k.config import Config
-from r2k.constants import Parser
 
 from .prompts import Prompt
 
@@ -30,9 +29,7 @@ def get_new_config() -> Config:
     password = Prompt.get("password")
     kindle_address = Prompt.get("kindle_address")
     parser = Prompt.get("parser")
-    return Config(
-        feeds={}, send_from=send_from, kindle_address=kindle_address, password=password, parser=Parser(parser)
-    )
+    return Config(feeds={}, send_from=send_from, kindle_address=kindle_address, password=password, parser=parser)
 
 
 def validate_config_overwrite(path: str, force: bool) -> None:
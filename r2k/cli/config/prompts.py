@@ -10,14 +10,22 @@ class Prompt:
     send_from = dict(text="Please provide your gmail email address")
     password = dict(text="Please provide your gmail app password", hide_input=True)
     kindle_address = dict(text="Please provide your free kindle address (e.g. my_kindle@kindle.com)")
-    parser = dict(
-        text="Please choose the parser you're going to use",
-        default=Parser.READABILITY.value,
-        type=click.Choice(Parser.__values__),
-    )
+
+    @staticmethod
+    def parser() -> dict:
+        """A method and not a dict, so that the available parsers are only looked up when needed"""
+        from r2k.ebook import parser_registry
+
+        return dict(
+            text="Please choose the parser you're going to use",
+            default=Parser.READABILITY.value,
+            type=click.Choice([Parser.PUSH_TO_KINDLE.value] + parser_registry.get_parser_names()),
+        )
 
     @classmethod
     def get(cls, key: str) -> str:
         """Get a config value (using click's prompt)"""
         kwargs = getattr(cls, key, dict(text=f"Please provide a new value for {key}"))
+        if callable(kwargs):
+            kwargs = kwargs()
         return logger.prompt(**kwargs)
@@ -1,14 +1,26 @@
 import sys
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import List
 
 import click
 import feedparser
-import requests
+import urllib3
 from bs4 import BeautifulSoup
 from pick import pick
+from requests import RequestException
 
+from r2k import http_client
 from r2k.cli import cli_utils, logger
 from r2k.config import config
+from r2k.constants import DEFAULT_FETCH_JOBS
+
+# How much of a candidate's body to read before deciding whether it's worth parsing it as a feed
+SNIFF_SIZE = 2048
+# Matched against the Content-Type header. Not just "xml", as that also matches XHTML pages (application/xhtml+xml)
+FEED_CONTENT_TYPES = ("rss+xml", "atom+xml", "rdf+xml", "application/xml", "text/xml")
+FEED_MARKERS = (b"<rss", b"<feed", b"<rdf:rdf")
 
 
 @click.command("add")
@@ -63,12 +75,20 @@ def get_feeds_from_url(url: str) -> list:
     html = get_html(url)
     possible_feeds = get_feeds_from_links(html) + get_feeds_from_atags(url, html)
 
-    return [url for url in set(possible_feeds) if is_rss_feed(url)]
+    return verify_feed_candidates(sorted(set(possible_feeds)))
+
+
+def verify_feed_candidates(urls: List[str]) -> List[str]:
+    """Check all the candidate URLs concurrently, and return the ones that are proper RSS feeds (in the same order)"""
+    logger.debug(f"Verifying {len(urls)} possible feeds...")
+    with ThreadPoolExecutor(max_workers=DEFAULT_FETCH_JOBS, thread_name_prefix="r2k-verify") as executor:
+        results = executor.map(cli_utils.in_current_context(is_rss_feed), urls)
+        return [url for url, is_feed in zip(urls, results) if is_feed]
 
 
 def get_html(url: str) -> BeautifulSoup:
     """Parse the URL with bs4"""
-    raw = requests.get(url).text
+    raw = http_client.get(url).text
     return BeautifulSoup(raw, features="lxml")
 
 
@@ -105,6 +125,35 @@ def get_feeds_from_atags(url: str, html: BeautifulSoup) -> list:
 
 
 def is_rss_feed(url: str) -> bool:
-    """Test whether the URL is a proper RSS feed"""
-    f = feedparser.parse(url)
+    """
+    Test whether the URL is a proper RSS feed
+
+    Only the headers and the first few bytes of the body are downloaded at first. The rest of the body is downloaded
+    and fully parsed only if those look like a feed
+    """
+    try:
+        with http_client.get(url, stream=True) as response:
+            if not response.ok:
+                return False
+            response.raw.decode_content = True
+            head = response.raw.read(SNIFF_SIZE)
+            if not is_likely_feed(response.headers.get("Content-Type", ""), head):
+                logger.debug(f"{url} doesn't look like a feed")
+                return False
+            body = head + response.raw.read()
+    except (RequestException, urllib3.exceptions.HTTPError) as e:
+        # The body is read from the raw urllib3 response, so its errors (e.g. a read timeout) aren't wrapped by requests
+        logger.debug(f"Could not fetch {url}: {e}")
+        return False
+
+    f = feedparser.parse(BytesIO(body), response_headers=dict(response.headers))
     return len(f.entries) > 0
+
+
+def is_likely_feed(content_type: str, head: bytes) -> bool:
+    """Cheaply guess whether a response is a feed, based on its content type and the beginning of its body"""
+    content_type = content_type.lower()
+    if any(feed_type in content_type for feed_type in FEED_CONTENT_TYPES):
+        return True
+    head = head.lower()
+    return any(marker in head for marker in FEED_MARKERS)
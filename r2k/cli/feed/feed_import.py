@@ -1,12 +1,17 @@
 import sys
-from typing import Optional
-from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
 
 import click
+import feedparser
 import yaml
+from lxml import etree
+from requests import RequestException
 
 from r2k.cli import cli_utils, logger
 from r2k.config import config
+from r2k.constants import DEFAULT_FETCH_JOBS
+from r2k.feeds import fetch_feed
 from r2k.unicode import strip_common_unicode_chars
 
 
@@ -14,10 +19,27 @@ from r2k.unicode import strip_common_unicode_chars
 @cli_utils.config_path_option()
 @click.argument("opml-path", required=True, type=click.types.Path(exists=True))
 @cli_utils.force_option("If set will update existing feeds")
-def feed_import(opml_path: str, force: bool) -> None:
+@click.option(
+    "--verify",
+    is_flag=True,
+    default=False,
+    help="If set, all the feeds will be fetched before importing, and only working ones will be imported",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_FETCH_JOBS,
+    show_default=True,
+    help="Number of feeds to verify concurrently (only relevant with --verify)",
+)
+def feed_import(opml_path: str, force: bool, verify: bool, jobs: int) -> None:
     """Import feeds from an OPML file."""
     feeds = convert_opml_to_dict(opml_path)
 
+    if verify:
+        feeds = verify_feeds(feeds, jobs)
+
     validate_conflicts(feeds, force)
 
     config.feeds.update(feeds)
@@ -43,11 +65,53 @@ def validate_conflicts(feeds: dict, force: bool) -> None:
             sys.exit(1)
 
 
+def verify_feeds(feeds: dict, jobs: int) -> dict:
+    """
+    Fetch all the feeds concurrently and return only the working ones
+
+    Dead feeds are reported and dropped, and redirected feeds are reported and stored with their final URL. The HTTP
+    validators of each feed are kept as well, so that the first `kindle send` can already use a conditional GET
+    """
+    logger.info(f"Verifying {len(feeds)} feeds...")
+    titles = list(feeds)
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="r2k-verify") as executor:
+        results = executor.map(cli_utils.in_current_context(probe_feed), [feeds[title]["url"] for title in titles])
+
+        verified = {}
+        for title, result in zip(titles, results):
+            url = feeds[title]["url"]
+            if result is None:
+                logger.warning(f"`{title}` ({url}) is not reachable or is not a proper feed. Skipping it")
+                continue
+
+            verified_feed = {"url": result.href}
+            if result.href != url:
+                logger.info(f"`{title}` was redirected: {url} -> {result.href}")
+            for validator in ("etag", "modified"):
+                if result.get(validator):
+                    verified_feed[validator] = result[validator]
+            verified[title] = verified_feed
+
+    logger.info(f"{len(verified)} out of {len(feeds)} feeds are working")
+    return verified
+
+
+def probe_feed(url: str) -> Optional[feedparser.FeedParserDict]:
+    """Fetch and parse a feed, and return the result if it's a working feed (or None otherwise)"""
+    try:
+        result = fetch_feed(url)
+    except RequestException as e:
+        logger.debug(f"Could not fetch {url}: {e}")
+        return None
+    if result.status >= 400 or not result.entries:
+        return None
+    return result
+
+
 def convert_opml_to_dict(path: str) -> dict:
     """Convert an OPML file to a dictionary, for easier storing in the configuration YAML"""
-    tree = parse_ompl(path)
     feeds = {}
-    for node in tree.findall(".//outline"):
+    for node in iter_outlines(path):
         if title := get_title(node):
             if url := get_url(node, title):
                 if is_rss(node, title):
@@ -55,7 +119,7 @@ def convert_opml_to_dict(path: str) -> dict:
     return feeds
 
 
-def get_title(node: ElementTree.Element) -> Optional[str]:
+def get_title(node: etree._Element) -> Optional[str]:
     """Retrieve the feed's title from the XML element"""
     # The `title` and `text` are usually identical
     title = node.attrib.get("title", node.attrib.get("text"))
@@ -66,7 +130,7 @@ def get_title(node: ElementTree.Element) -> Optional[str]:
     return title
 
 
-def get_url(node: ElementTree.Element, title: str) -> Optional[str]:
+def get_url(node: etree._Element, title: str) -> Optional[str]:
     """Retrieve the feed's URL from the XML element"""
     url = node.attrib.get("xmlUrl")
     if not url:
@@ -74,7 +138,7 @@ def get_url(node: ElementTree.Element, title: str) -> Optional[str]:
     return url
 
 
-def is_rss(node: ElementTree.Element, title: str) -> bool:
+def is_rss(node: etree._Element, title: str) -> bool:
     """Return true if the element is indeed an RSS feed"""
     rss_type = node.attrib.get("type")
     if rss_type != "rss":
@@ -83,11 +147,21 @@ def is_rss(node: ElementTree.Element, title: str) -> bool:
     return True
 
 
-def parse_ompl(path: str) -> ElementTree.ElementTree:
-    """Parse the OPML file and error out if it's in the wrong format"""
-    with open(path) as f:
+def iter_outlines(path: str) -> Iterator[etree._Element]:
+    """
+    Incrementally parse the OPML file and yield its <outline> elements one by one
+
+    Error out if the file is in the wrong format
+    """
+    with open(path, "rb") as f:
         try:
-            return ElementTree.parse(f)
-        except ElementTree.ParseError:
+            for _, node in etree.iterparse(f, events=("end",), tag="outline"):
+                yield node
+                # Outlines can be nested (e.g. in categories), but once we're done with one, we don't need its data.
+                # The outlines before it are done as well, so they're removed, for the tree not to grow with the file
+                node.clear()
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+        except etree.XMLSyntaxError:
             logger.error(f"Could not parse `{path}`.\nIt's probably not a proper OPML file.")
             sys.exit(1)
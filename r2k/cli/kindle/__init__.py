@@ -1,6 +1,7 @@
 import click
 
 from .kindle_send import kindle_send
+from .kindle_serve import kindle_serve
 
 
 @click.group()
@@ -10,3 +11,4 @@ def kindle() -> None:
 
 
 kindle.add_command(kindle_send)
+kindle.add_command(kindle_serve)
@@ -1,18 +1,36 @@
+from __future__ import annotations
+
 import os
 import sys
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Set
 
 import arrow
 import click
 
+from r2k import scheduler
 from r2k.cli import cli_utils, logger
 from r2k.config import config
-from r2k.constants import ARTICLE_EBOOK_LIMIT, Parser
+from r2k.constants import DEFAULT_FETCH_JOBS, Parser
 from r2k.dates import get_pretty_date_str, now
-from r2k.ebook.epub_builder import create_epub
+from r2k.ebook import epub_builder, mercury_container, parser_registry
+from r2k.ebook.article_cache import article_cache
+from r2k.ebook.image_store import image_store
 from r2k.ebook.single_article import SingleArticle
-from r2k.email_sender import send_epub, send_urls
+from r2k.email_sender import get_max_attachment_size, send_epub, send_urls
 from r2k.feeds import Article, Feed
+from r2k.host_health import host_health
+from r2k.http_client import DownloadError
+from r2k.seen_index import seen_index
+
+no_cache_option = click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Parse all the articles and download all the images from scratch, without using (or updating) the caches, "
+    "and retry failed URLs and hosts that are down",
+)
 
 
 @click.command("send")
@@ -27,9 +45,27 @@ from r2k.feeds import Article, Feed
 @click.option(
     "-u", "--url", type=str, required=False, help="URL of an article to send to the Kindle",
 )
-def kindle_send(feed_title: str, url: str) -> None:
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_FETCH_JOBS,
+    show_default=True,
+    help="Number of feeds to fetch concurrently when sending updates for all feeds",
+)
+@click.option(
+    "--ignore-schedule",
+    is_flag=True,
+    default=False,
+    help="Check all the feeds, even those that aren't due to be checked yet according to their polling schedule",
+)
+@no_cache_option
+def kindle_send(feed_title: str, url: str, jobs: int, ignore_schedule: bool, no_cache: bool) -> None:
     """Send updates from one or all feeds (or a single article)."""
     validate_parser()
+    article_cache.enabled = not no_cache
+    image_store.enabled = not no_cache
+    host_health.enabled = not no_cache
     logger.info(f"[Parsing articles with the `{config.parser}` parser]\n")
     if feed_title:
         send_articles_for_feed(feed_title)
@@ -37,49 +73,201 @@ def kindle_send(feed_title: str, url: str) -> None:
         send_article_from_url(url)
     else:
         logger.notice("Sending articles from all feeds...\n")
-        for feed_title in config.feeds:
-            send_articles_for_feed(feed_title)
+        send_articles_for_all_feeds(jobs, ignore_schedule)
+
+    if not url:
+        prune_seen_index()
+    prune_caches()
+    mercury_container.stop_idle_containers()
+
+
+@dataclass
+class FeedUpdate:
+    """The result of fetching a single feed and diffing it against the last update"""
+
+    title: str
+    feed: Optional[Feed] = None
+    validators: Dict[str, str] = field(default_factory=dict)
+    # Whether the whole feed was parsed (as opposed to streamed up to the first read entry)
+    full_parse: bool = True
+    # None means the unread articles couldn't be found automatically, and the user needs to be asked
+    unread_articles: Optional[List[Article]] = None
+    error: Optional[Exception] = None
 
 
 def validate_parser() -> None:
-    """Run various validations for the different parsers"""
-    parser = Parser(config.parser)
-    if parser == Parser.MERCURY:
-        try:
-            import docker  # noqa
-        except ModuleNotFoundError:
-            logger.error(
-                "The `docker` module is not installed, but is required to use the `mercury` parser\n"
-                "Consider either switching to a different parser (by running `r2k config set -k parser --force`)\n"
-                "Or install the optional `docker` library by running `pip install 'r2k[docker]'`"
-            )
-            sys.exit(1)
+    """Make sure the configured parser exists, and that everything it requires is installed"""
+    if config.parser == Parser.PUSH_TO_KINDLE:
+        return
+    try:
+        parser_class = parser_registry.get_parser_class()
+    except (ValueError, ImportError) as e:
+        logger.error(f"Could not load the `{config.parser}` parser: {e}")
+        sys.exit(1)
+
+    if missing_requirements := parser_class.get_missing_requirements():
+        logger.error(missing_requirements)
+        sys.exit(1)
+
+
+def prune_seen_index() -> None:
+    """Remove old entries from the seen index"""
+    pruned = seen_index.prune(config.seen_index_max_age_days)
+    logger.debug(f"Pruned {pruned} old entries from the seen index")
+
+
+def prune_caches() -> None:
+    """Evict old entries from the on-disk caches, and save the health of the hosts (without the expired entries)"""
+    evicted = article_cache.evict(config.article_cache_max_age_days, config.article_cache_max_size_mb)
+    logger.debug(f"Evicted {evicted} entries from the article cache")
+    evicted = image_store.evict(config.image_cache_max_size_mb)
+    logger.debug(f"Evicted {evicted} images from the image cache")
+    host_health.save()
 
 
 def send_article_from_url(url: str) -> None:
     """Convert a single article using the parser, and send it to kindle as an Ebook"""
     logger.notice("Parsing article...")
-    article = SingleArticle(url)
+    try:
+        article = SingleArticle(url)
+    except DownloadError as e:
+        logger.error(f"Failed to download {url}: {e.reason}")
+        sys.exit(1)
     send_updates([article], article.title)
 
 
 def send_articles_for_feed(feed_title: str) -> None:
     """Find all the new/unread articles for a certain feed and send them to the user's kindle"""
-    logger.notice(f"\nNow working on `{feed_title}`...")
-
     local_feed = get_local_feed(feed_title)
-    unread_articles = get_unread_articles_for_feed(local_feed, feed_title)
-    send_updates(unread_articles, feed_title)
+    feed_update = fetch_feed_update(feed_title, local_feed)
+    send_feed_update(feed_update, local_feed)
 
-    local_feed["updated"] = arrow.utcnow()
-    config.save()
 
+def send_articles_for_all_feeds(jobs: int, ignore_schedule: bool = False, interactive: bool = True) -> None:
+    """
+    Fetch all the feeds (that are due) concurrently, and send the unread articles from each one
+
+    Sending is done one feed at a time, in the order the feeds appear in the config, while the rest of the feeds are
+    still being fetched in the background. When not `interactive`, feeds that require asking the user are skipped
+    """
+    feed_titles = get_due_feed_titles(ignore_schedule)
+    for feed_update in fetch_feed_updates(feed_titles, jobs):
+        send_feed_update(feed_update, config.feeds[feed_update.title], interactive)
+
+
+def get_due_feed_titles(ignore_schedule: bool) -> List[str]:
+    """Return the titles of all the feeds that are due to be checked according to their polling schedule"""
+    if ignore_schedule:
+        return list(config.feeds)
+
+    current_time = now()
+    feed_titles = [title for title, local_feed in config.feeds.items() if scheduler.is_due(local_feed, current_time)]
+    if skipped := len(config.feeds) - len(feed_titles):
+        logger.info(f"Skipping {skipped} feeds that aren't due yet (pass --ignore-schedule to check them anyway)")
+    return feed_titles
+
+
+def fetch_feed_updates(feed_titles: List[str], jobs: int) -> Iterator[FeedUpdate]:
+    """Fetch and diff the feeds in a thread pool, and yield the results in the same order as `feed_titles`"""
+    fetch = cli_utils.in_current_context(fetch_feed_update)
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="r2k-fetch") as executor:
+        futures = [executor.submit(fetch, feed_title, config.feeds[feed_title]) for feed_title in feed_titles]
+        for future in futures:
+            yield future.result()
+
+
+def fetch_feed_update(feed_title: str, local_feed: dict) -> FeedUpdate:
+    """
+    Fetch a single feed and find its unread articles
+
+    Safe to run in a worker thread: nothing here writes to the config or asks the user anything, and any error is
+    captured in the result instead of being raised, so that a single broken feed doesn't stop the whole run
+    """
+    try:
+        seen_keys = seen_index.get_seen_keys(feed_title)
+        last_updated = local_feed.get("updated")
+        stop_at = get_stop_condition(local_feed, seen_keys)
+        # Validators are only relevant once the feed was read at least once (they can also come from `feed import`).
+        # Otherwise a 304 would prevent asking the user about the last article they've read
+        was_read = bool(seen_keys or last_updated)
+        rss_feed = Feed(
+            local_feed["url"],
+            feed_title,
+            etag=local_feed.get("etag") if was_read else None,
+            modified=local_feed.get("modified") if was_read else None,
+            stop_at=stop_at,
+        )
+        feed_update = FeedUpdate(
+            feed_title, feed=rss_feed, validators=rss_feed.get_validators(), full_parse=stop_at is None
+        )
+        if rss_feed.not_modified:
+            logger.debug(f"`{feed_title}` wasn't modified since the last fetch")
+            feed_update.unread_articles = []
+        elif was_read:
+            feed_update.unread_articles = rss_feed.get_unread_articles(last_updated, seen_keys)
+        return feed_update
+    except Exception as e:
+        return FeedUpdate(feed_title, error=e)
+
+
+def get_stop_condition(local_feed: dict, seen_keys: Set[str]) -> Optional[Callable[[Article], bool]]:
+    """
+    Return a function that tells whether an article was already read, to stop streaming the feed at
+
+    Streaming only makes sense for feeds that were already read before, and that list their newest entries first
+    """
+    if not local_feed.get("newest_first"):
+        return None
+    if seen_keys:
+        return lambda article: article.get_key() in seen_keys
+    if last_updated := local_feed.get("updated"):
+        return lambda article: article.get_parsed_date() <= last_updated
+    return None
+
+
+def send_feed_update(feed_update: FeedUpdate, local_feed: dict, interactive: bool = True) -> None:
+    """Send the unread articles of an already fetched feed, and mark the feed as updated once they were sent"""
+    logger.notice(f"\nNow working on `{feed_update.title}`...")
+    if feed_update.error or not feed_update.feed:
+        logger.error(f"Failed to fetch `{feed_update.title}`. Skipping it")
+        logger.debug(f"Error info:\n{feed_update.error}")
+        return
+
+    unread_articles = feed_update.unread_articles
+    if unread_articles is None:
+        # First time we're seeing this feed, so the user needs to choose the last article they've read
+        if not interactive:
+            logger.warning(
+                f"`{feed_update.title}` was never sent before, so the last article you've read in it is unknown. "
+                f"Run `r2k kindle send -f '{feed_update.title}'` once to choose it. Skipping it"
+            )
+            return
+        unread_articles = feed_update.feed.get_unread_articles(None)
+    sent_articles = send_updates(unread_articles, feed_update.title)
+    if unread_articles and not sent_articles:
+        # Leave the feed as it is, so that the same articles are sent on the next run
+        return
+
+    # Everything that is currently in the feed was either sent just now, or had already been read before, apart from
+    # the articles that couldn't be sent, which are left out of the seen index so that they're sent on the next run
+    unsent_keys = {article.get_key() for article in unread_articles} - {article.get_key() for article in sent_articles}
+    if feed_update.feed.not_modified:
+        seen_index.touch_feed(feed_update.title)
+    else:
+        seen_keys = [key for key in feed_update.feed.get_entry_keys() if key not in unsent_keys]
+        seen_index.mark_seen(feed_update.title, seen_keys)
 
-def get_unread_articles_for_feed(local_feed: dict, feed_title: str) -> List[Article]:
-    """Find the all new articles for a certain feed"""
-    rss_feed = Feed(local_feed["url"], feed_title)
-    last_updated = local_feed.get("updated")
-    return rss_feed.get_unread_articles(last_updated)
+    local_feed["updated"] = arrow.utcnow()
+    local_feed.update(feed_update.validators)
+    if feed_update.full_parse and feed_update.feed.entries:
+        local_feed["newest_first"] = feed_update.feed.is_newest_first()
+    if unsent_keys:
+        # Articles that weren't sent may be older than ones that were, so the next fetch downloads and parses the whole
+        # feed, instead of getting a 304 or stopping at the first entry that was seen
+        for key in ("etag", "modified", "newest_first"):
+            local_feed.pop(key, None)
+    scheduler.schedule_next_check(local_feed, feed_update.feed, len(unread_articles), feed_update.full_parse)
+    config.save()
 
 
 def get_local_feed(feed_title: str) -> dict:
@@ -91,55 +279,77 @@ def get_local_feed(feed_title: str) -> dict:
     return feed
 
 
-def send_updates(unread_articles: List[Article], feed_title: str) -> None:
-    """Iterate over `unread_articles`, and send each one to the kindle"""
+def send_updates(unread_articles: List[Article], feed_title: str) -> List[Article]:
+    """Iterate over `unread_articles`, and send each one to the kindle. Return the articles that were sent"""
     if unread_articles:
-        if Parser(config.parser) == Parser.PUSH_TO_KINDLE:
-            successful_count = send_urls([(article.title, article.link) for article in unread_articles])
+        if config.parser == Parser.PUSH_TO_KINDLE:
+            results = send_urls([(article.title, article.link) for article in unread_articles])
+            sent_articles = [article for article, sent in zip(unread_articles, results) if sent]
         else:
-            successful_count = send_epub_books(unread_articles, feed_title)
+            sent_articles = send_epub_books(unread_articles, feed_title)
 
-        if successful_count:
-            logger.notice(f"Successfully sent {successful_count} articles from the `{feed_title}` feed!")
+        if sent_articles:
+            logger.notice(f"Successfully sent {len(sent_articles)} articles from the `{feed_title}` feed!")
         else:
             logger.error(f"Failed to send any articles to `{feed_title}`. See errors above")
+        return sent_articles
     else:
         logger.info(f"No new content for `{feed_title}`")
+        return []
 
 
-def send_epub_books(unread_articles: List[Article], feed_title: str) -> int:
+def send_epub_books(unread_articles: List[Article], feed_title: str) -> List[Article]:
     """
-    Chunk the list of unread articles into chunks of max size ARTICLE_EBOOK_LIMIT
+    Parse all the unread articles, send them in as few EPUB books as possible, and return the articles that were sent
 
-    This is in order to avoid creating too large of an EPUB and exceeding GMAIL's 25MB attachment size limit
+    The articles are packed into books by their size (including their images), so that each book fits in an email
+    without exceeding GMAIL's 25MB attachment size limit (see `max_attachment_size_mb`)
     """
-    successful_count = 0
-    for i in range(0, len(unread_articles), ARTICLE_EBOOK_LIMIT):
-        successful_count += send_epub_book(unread_articles[i : i + ARTICLE_EBOOK_LIMIT], feed_title)
-    return successful_count
+    articles = epub_builder.prepare_articles(unread_articles)
+    max_size = get_max_attachment_size()
+    sent_keys: Set[str] = set()
+    for book in epub_builder.pack_articles(articles, max_size):
+        sent_keys.update(article.key for article in send_epub_book(book, feed_title, max_size))
+    return [article for article in unread_articles if article.get_key() in sent_keys]
 
 
-def send_epub_book(unread_articles: List[Article], feed_title: str) -> int:
-    """Create an EPUB book from all the unread articles and send it via email"""
-    date_range = get_unread_articles_date_range(unread_articles)
+def send_epub_book(
+    articles: List[epub_builder.EPUBArticle], feed_title: str, max_size: int
+) -> List[epub_builder.EPUBArticle]:
+    """
+    Create an EPUB book from the (already parsed) articles, send it via email, and return the articles that were sent
+
+    The size of a book is only estimated when packing the articles, so a book that turns out to be too large after
+    all is split in two. A single article that's too large on its own is skipped
+    """
+    date_range = get_unread_articles_date_range([article.parsed_date for article in articles])
     title = f"{feed_title} [{date_range}]"
-    epub_book = create_epub(unread_articles, title)
+    epub_book = epub_builder.create_epub(articles, title)
     try:
+        if (size := os.path.getsize(epub_book)) > max_size:
+            if len(articles) == 1:
+                logger.error(f"`{articles[0].title}` is too large to send ({size // 1024}KB). Skipping it")
+                return []
+            logger.debug(f"`{title}` is too large to send ({size // 1024}KB). Splitting it in two")
+            middle = len(articles) // 2
+            return send_epub_book(articles[:middle], feed_title, max_size) + send_epub_book(
+                articles[middle:], feed_title, max_size
+            )
         success = send_epub(title, epub_book)
     finally:
         os.remove(epub_book)
-    return len(unread_articles) if success else 0
+    return articles if success else []
 
 
-def get_unread_articles_date_range(unread_articles: List[Article]) -> str:
+def get_unread_articles_date_range(dates: List[arrow.Arrow]) -> str:
     """Return a nicely formatted string with the range of dates for the article list"""
-    if len(unread_articles) == 1:
-        date = unread_articles[0].get_parsed_date()
+    if len(dates) == 1:
+        date = dates[0]
         show_year = date.year != now().year
         return get_pretty_date_str(date, show_year=show_year)
     else:
-        first_date = unread_articles[0].get_parsed_date()
-        last_date = unread_articles[-1].get_parsed_date()
+        first_date = dates[0]
+        last_date = dates[-1]
         show_year = not (first_date.year == last_date.year == now().year)
         first_date_str = get_pretty_date_str(first_date, show_year=show_year)
         last_date_str = get_pretty_date_str(last_date, show_year=show_year)
@@ -0,0 +1,204 @@
+import os
+import queue
+import signal
+import socketserver
+import threading
+from contextlib import ExitStack
+from typing import Any, Optional
+
+import click
+import orjson as json
+
+from r2k.cli import cli_utils, logger
+from r2k.config import config
+from r2k.constants import DEFAULT_FETCH_JOBS, DEFAULT_SOCKET_PATH, Parser
+from r2k.ebook import epub_builder, mercury_container
+from r2k.ebook.article_cache import article_cache
+from r2k.ebook.image_store import image_store
+from r2k.host_health import host_health
+from r2k.unicode import strip_common_unicode_chars
+
+from .kindle_send import (
+    no_cache_option,
+    prune_caches,
+    prune_seen_index,
+    send_article_from_url,
+    send_articles_for_all_feeds,
+    validate_parser,
+)
+
+RUN = "run"
+SEND = "send"
+STOP = "stop"
+COMMANDS = (RUN, SEND, STOP)
+
+
+@click.command("serve")
+@cli_utils.config_path_option()
+@click.option(
+    "-i",
+    "--interval",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Minutes between runs. Defaults to the minimal polling interval from the config",
+)
+@click.option(
+    "-s",
+    "--socket",
+    "socket_path",
+    type=str,
+    default=DEFAULT_SOCKET_PATH,
+    show_default=True,
+    help="Path of the local control socket",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_FETCH_JOBS,
+    show_default=True,
+    help="Number of feeds to fetch concurrently",
+)
+@no_cache_option
+def kindle_serve(interval: Optional[int], socket_path: str, jobs: int, no_cache: bool) -> None:
+    """Keep running, and periodically send updates from all feeds."""
+    validate_parser()
+    article_cache.enabled = not no_cache
+    image_store.enabled = not no_cache
+    host_health.enabled = not no_cache
+    interval = interval or config.min_poll_interval_minutes
+    daemon = Daemon(interval * 60, socket_path, jobs)
+    daemon.serve()
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """
+    Handle a single request on the control socket
+
+    Requests are single JSON lines, e.g. `{"command": "run"}` or `{"command": "send", "url": "https://..."}`.
+    Commands are only queued here. They're executed one by one in the daemon's main loop
+    """
+
+    server: "ControlServer"
+
+    def handle(self) -> None:
+        """Validate and queue the command, and reply with the result"""
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request.get("command")
+            if command not in COMMANDS:
+                raise ValueError(f"Command must be one of: {COMMANDS}")
+            if command == SEND and not request.get("url"):
+                raise ValueError("The `send` command requires a `url`")
+        except (ValueError, AttributeError) as e:
+            self.reply({"status": "error", "message": str(e)})
+            return
+
+        self.server.commands.put(request)
+        self.reply({"status": "queued", "command": command})
+
+    def reply(self, response: dict) -> None:
+        """Write a single JSON line back to the client"""
+        self.wfile.write(json.dumps(response) + b"\n")
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    """A local Unix socket server that passes commands to the daemon's main loop through a queue"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, commands: "queue.Queue[dict]") -> None:
+        """Constructor"""
+        self.commands = commands
+        super().__init__(socket_path, ControlHandler)
+
+
+class Daemon:
+    """
+    A long running r2k process
+
+    Everything that is expensive to set up (the parser, e.g. Mercury's container, the pooled HTTP connections,
+    the caches) is created once and kept warm across runs
+    """
+
+    def __init__(self, interval: int, socket_path: str, jobs: int) -> None:
+        """Constructor"""
+        self.interval = interval
+        self.socket_path = socket_path
+        self.jobs = jobs
+        self.commands: "queue.Queue[dict]" = queue.Queue()
+
+    def serve(self) -> None:
+        """Start the control socket, then run until stopped (with a signal, Ctrl-C or the `stop` command)"""
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        # Build the unicode map once, instead of on the first run
+        strip_common_unicode_chars("")
+
+        with ExitStack() as stack:
+            if config.parser != Parser.PUSH_TO_KINDLE:
+                stack.enter_context(epub_builder.shared_parser())
+            server = self.start_control_server()
+            stack.callback(self.stop_control_server, server)
+
+            logger.notice(f"r2k is running. Control socket: {self.socket_path}. Press Ctrl-C to stop")
+            try:
+                self.loop()
+            except KeyboardInterrupt:
+                pass
+        logger.notice("r2k stopped")
+
+    def loop(self) -> None:
+        """Run periodically, and in between execute the commands that come in through the control socket"""
+        self.commands.put({"command": RUN})
+        while True:
+            try:
+                command = self.commands.get(timeout=self.interval)
+            except queue.Empty:
+                command = {"command": RUN}
+
+            if command["command"] == STOP:
+                return
+            self.execute(command)
+
+    def execute(self, command: dict) -> None:
+        """Execute a single command, making sure that no error stops the daemon"""
+        try:
+            config.reload_if_changed()
+            if command["command"] == RUN:
+                logger.notice("Sending articles from all feeds...\n")
+                # There's no one to ask about feeds that were never read before, so they're skipped
+                send_articles_for_all_feeds(self.jobs, interactive=False)
+                prune_seen_index()
+                prune_caches()
+                # While the daemon uses Mercury, its container is held by the shared parser for the daemon's lifetime
+                if config.parser != Parser.MERCURY:
+                    mercury_container.stop_idle_containers()
+            elif command["command"] == SEND:
+                send_article_from_url(command["url"])
+        except (Exception, SystemExit) as e:
+            logger.error(f"Failed to execute `{command['command']}`: {e}")
+
+    def start_control_server(self) -> ControlServer:
+        """Start listening on the control socket in a background thread"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        # Create the socket with owner-only permissions from the start, as anyone who can connect to it can send
+        # articles to the user's Kindle
+        old_umask = os.umask(0o177)
+        try:
+            server = ControlServer(self.socket_path, self.commands)
+        finally:
+            os.umask(old_umask)
+        threading.Thread(target=server.serve_forever, name="r2k-control", daemon=True).start()
+        return server
+
+    def stop_control_server(self, server: ControlServer) -> None:
+        """Stop listening on the control socket and remove it"""
+        server.shutdown()
+        server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def handle_sigterm(self, *_: Any) -> None:
+        """Stop gracefully (after the current command) on SIGTERM"""
+        self.commands.put({"command": STOP})
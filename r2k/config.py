@@ -1,10 +1,47 @@
+import os
 from dataclasses import asdict, dataclass, field, fields
 from typing import Any, List, Optional
 
 import yaml
 
-from .cli import logger
-from .constants import Parser
+from .constants import (
+    DEFAULT_ARTICLE_CACHE_MAX_AGE_DAYS,
+    DEFAULT_ARTICLE_CACHE_MAX_SIZE_MB,
+    DEFAULT_ARTICLE_FETCH_CONCURRENCY,
+    DEFAULT_DOWNLOAD_TIMEOUT,
+    DEFAULT_HOST_COOLDOWN_MINUTES,
+    DEFAULT_HOST_FAILURE_THRESHOLD,
+    DEFAULT_HTTP_CONNECT_TIMEOUT,
+    DEFAULT_HTTP_POOL_HOSTS,
+    DEFAULT_HTTP_POOL_SIZE,
+    DEFAULT_HTTP_READ_TIMEOUT,
+    DEFAULT_IMAGE_CACHE_MAX_SIZE_MB,
+    DEFAULT_IMAGE_CACHE_URL_MAX_AGE_DAYS,
+    DEFAULT_IMAGE_DENY_PATTERNS,
+    DEFAULT_IMAGE_DOWNLOAD_CONCURRENCY,
+    DEFAULT_IMAGE_DOWNLOADS_PER_HOST,
+    DEFAULT_IMAGE_MAX_HEIGHT,
+    DEFAULT_IMAGE_MAX_KB,
+    DEFAULT_IMAGE_MAX_WIDTH,
+    DEFAULT_IMAGE_MIN_SIZE,
+    DEFAULT_IMAGE_PROCESSING_THREADS,
+    DEFAULT_IMAGE_QUALITY,
+    DEFAULT_MAX_ATTACHMENT_SIZE_MB,
+    DEFAULT_MAX_IMAGE_SIZE_MB,
+    DEFAULT_MAX_PAGE_SIZE_MB,
+    DEFAULT_MAX_POLL_INTERVAL_MINUTES,
+    DEFAULT_MERCURY_CONTAINER,
+    DEFAULT_MERCURY_IDLE_TIMEOUT_MINUTES,
+    DEFAULT_MERCURY_REPLICAS,
+    DEFAULT_MERCURY_REQUESTS_PER_ENDPOINT,
+    DEFAULT_MERCURY_STARTUP_TIMEOUT,
+    DEFAULT_MERCURY_TIMEOUT,
+    DEFAULT_MIN_POLL_INTERVAL_MINUTES,
+    DEFAULT_NEGATIVE_CACHE_TTL_HOURS,
+    DEFAULT_PARSE_PROCESSES,
+    DEFAULT_SEEN_INDEX_MAX_AGE_DAYS,
+    Parser,
+)
 
 
 @dataclass
@@ -16,7 +53,48 @@ class Config:
     kindle_address: str
     send_from: str
     send_to: str = field(init=False, default="")
-    parser: Parser = Parser.READABILITY
+    # The name of a parser (see `r2k.ebook.parser_registry`), or `pushtokindle`
+    parser: str = Parser.READABILITY.value
+    http_pool_hosts: int = DEFAULT_HTTP_POOL_HOSTS
+    http_pool_size: int = DEFAULT_HTTP_POOL_SIZE
+    http_connect_timeout: int = DEFAULT_HTTP_CONNECT_TIMEOUT
+    http_read_timeout: int = DEFAULT_HTTP_READ_TIMEOUT
+    host_failure_threshold: int = DEFAULT_HOST_FAILURE_THRESHOLD
+    host_cooldown_minutes: int = DEFAULT_HOST_COOLDOWN_MINUTES
+    negative_cache_ttl_hours: int = DEFAULT_NEGATIVE_CACHE_TTL_HOURS
+    seen_index_max_age_days: int = DEFAULT_SEEN_INDEX_MAX_AGE_DAYS
+    min_poll_interval_minutes: int = DEFAULT_MIN_POLL_INTERVAL_MINUTES
+    max_poll_interval_minutes: int = DEFAULT_MAX_POLL_INTERVAL_MINUTES
+    parse_processes: int = DEFAULT_PARSE_PROCESSES
+    article_fetch_concurrency: int = DEFAULT_ARTICLE_FETCH_CONCURRENCY
+    article_cache_max_age_days: int = DEFAULT_ARTICLE_CACHE_MAX_AGE_DAYS
+    article_cache_max_size_mb: int = DEFAULT_ARTICLE_CACHE_MAX_SIZE_MB
+    image_cache_max_size_mb: int = DEFAULT_IMAGE_CACHE_MAX_SIZE_MB
+    image_cache_url_max_age_days: int = DEFAULT_IMAGE_CACHE_URL_MAX_AGE_DAYS
+    max_page_size_mb: int = DEFAULT_MAX_PAGE_SIZE_MB
+    max_image_size_mb: int = DEFAULT_MAX_IMAGE_SIZE_MB
+    download_timeout: int = DEFAULT_DOWNLOAD_TIMEOUT
+    image_download_concurrency: int = DEFAULT_IMAGE_DOWNLOAD_CONCURRENCY
+    image_downloads_per_host: int = DEFAULT_IMAGE_DOWNLOADS_PER_HOST
+    image_min_size: int = DEFAULT_IMAGE_MIN_SIZE
+    # Comma separated glob patterns, matched against the host (or the host and path) of image URLs
+    image_deny_patterns: str = DEFAULT_IMAGE_DENY_PATTERNS
+    image_max_width: int = DEFAULT_IMAGE_MAX_WIDTH
+    image_max_height: int = DEFAULT_IMAGE_MAX_HEIGHT
+    image_max_kb: int = DEFAULT_IMAGE_MAX_KB
+    image_quality: int = DEFAULT_IMAGE_QUALITY
+    image_grayscale: bool = False
+    image_processing_threads: int = DEFAULT_IMAGE_PROCESSING_THREADS
+    max_attachment_size_mb: int = DEFAULT_MAX_ATTACHMENT_SIZE_MB
+    # Already running Mercury-compatible endpoints, comma separated (e.g. http://localhost:3000/parser).
+    # Docker isn't used if it's set
+    mercury_url: str = ""
+    mercury_container: str = DEFAULT_MERCURY_CONTAINER
+    mercury_idle_timeout_minutes: int = DEFAULT_MERCURY_IDLE_TIMEOUT_MINUTES
+    mercury_startup_timeout: int = DEFAULT_MERCURY_STARTUP_TIMEOUT
+    mercury_replicas: int = DEFAULT_MERCURY_REPLICAS
+    mercury_requests_per_endpoint: int = DEFAULT_MERCURY_REQUESTS_PER_ENDPOINT
+    mercury_timeout: int = DEFAULT_MERCURY_TIMEOUT
 
     # Internal properties not accessible outside the class
     _path: str = field(init=False, repr=False)
@@ -33,15 +111,25 @@ class Config:
 
     def load(self, path: str) -> None:
         """Load configurations from a YAML file"""
-        self._path = path
+        # Imported here, as the CLI imports modules that depend on the config
+        from .cli import logger
 
+        self._path = path
         logger.debug(f"Loading config from {self._path}")
         with open(self._path) as f:
             file_config = yaml.safe_load(f)
 
         self.__dict__.update(file_config)
+        self._set_mtime()
         self.__post_load__()
 
+    def reload_if_changed(self) -> bool:
+        """Reload the config if the file was changed by someone else since it was last loaded or saved"""
+        if self._loaded and os.path.getmtime(self._path) != self.__dict__.get("_mtime"):
+            self.load(self._path)
+            return True
+        return False
+
     def __setattr__(self, key: str, value: Any) -> None:
         """Override in order to allow dumping changes to file"""
         super().__setattr__(key, value)
@@ -60,6 +148,15 @@ class Config:
 
         with open(self._path, "w") as f:
             yaml.safe_dump(self.as_dict(), f, default_flow_style=False)
+        self._set_mtime()
+
+    def _set_mtime(self) -> None:
+        """
+        Remember when the config file was last changed by us
+
+        Not a dataclass field, so it isn't dumped to the file. Set directly in __dict__ to avoid triggering a save
+        """
+        self.__dict__["_mtime"] = os.path.getmtime(self._path)
 
     def as_dict(self) -> dict:
         """Return the underlying dict"""
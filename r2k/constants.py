@@ -9,17 +9,113 @@ HTML_HEADERS = {
 
 DEFAULT_APP_PATH = expanduser("~/.r2k")
 DEFAULT_CONFIG_PATH = join(DEFAULT_APP_PATH, "config.yml")
+DEFAULT_SEEN_INDEX_PATH = join(DEFAULT_APP_PATH, "seen.db")
+DEFAULT_SOCKET_PATH = join(DEFAULT_APP_PATH, "r2k.sock")
+DEFAULT_CACHE_DIR = join(DEFAULT_APP_PATH, "cache")
+DEFAULT_ARTICLE_CACHE_DIR = join(DEFAULT_CACHE_DIR, "articles")
+DEFAULT_IMAGE_CACHE_DIR = join(DEFAULT_CACHE_DIR, "images")
+DEFAULT_MERCURY_STAMP_PATH = join(DEFAULT_APP_PATH, "mercury.last_used")
+DEFAULT_MERCURY_LEASES_DIR = join(DEFAULT_APP_PATH, "mercury.leases")
+DEFAULT_HOST_HEALTH_PATH = join(DEFAULT_APP_PATH, "host_health.json")
 
 PACKAGE_DIR = dirname(__file__)
 TOP_LEVEL_DIR = dirname(PACKAGE_DIR)
 TEMPLATES_DIR = join(TOP_LEVEL_DIR, "templates")
 
-# Number of articles to put in a single EPUB eBook. Otherwise the email size might exceed GMAIL's 25MB limit
-ARTICLE_EBOOK_LIMIT = 20
+# Articles are packed into EPUB eBooks that are at most this size (in MB) once attached to an email (i.e. base64
+# encoded), so that the email doesn't exceed GMAIL's 25MB limit
+DEFAULT_MAX_ATTACHMENT_SIZE_MB = 24
 
+# Defaults for the shared HTTP client: number of hosts to keep connection pools for, connections kept per host,
+# and the (connect, read) timeouts in seconds
+DEFAULT_HTTP_POOL_HOSTS = 32
+DEFAULT_HTTP_POOL_SIZE = 10
+DEFAULT_HTTP_CONNECT_TIMEOUT = 10
+DEFAULT_HTTP_READ_TIMEOUT = 30
 
-class Parser(Enum):
-    """A convenience class to represent the available parsing options"""
+# A host that fails this many times in a row (e.g. it's down, or times out) is skipped for this many minutes, and a
+# URL that fails for good (e.g. a 404, or an image that's too large) is skipped for this many hours
+DEFAULT_HOST_FAILURE_THRESHOLD = 3
+DEFAULT_HOST_COOLDOWN_MINUTES = 30
+DEFAULT_NEGATIVE_CACHE_TTL_HOURS = 24
+
+# Entries that haven't appeared in their feed for this many days are removed from the seen index
+DEFAULT_SEEN_INDEX_MAX_AGE_DAYS = 90
+
+# Bounds (in minutes) for the adaptive polling interval of each feed
+DEFAULT_MIN_POLL_INTERVAL_MINUTES = 15
+DEFAULT_MAX_POLL_INTERVAL_MINUTES = 24 * 60
+
+# Parsed articles are evicted from the article cache after this many days, or when the cache exceeds this size
+DEFAULT_ARTICLE_CACHE_MAX_AGE_DAYS = 7
+DEFAULT_ARTICLE_CACHE_MAX_SIZE_MB = 200
+
+# The least recently used images are evicted from the image cache when it exceeds this size
+DEFAULT_IMAGE_CACHE_MAX_SIZE_MB = 500
+# Image URLs are downloaded again after this many days, in case the image behind them changed
+DEFAULT_IMAGE_CACHE_URL_MAX_AGE_DAYS = 7
+
+# Number of processes used to parse articles in parallel. 0 means one per CPU
+DEFAULT_PARSE_PROCESSES = 0
+
+# Number of article pages downloaded concurrently while building a book
+DEFAULT_ARTICLE_FETCH_CONCURRENCY = 8
+
+# Number of feeds fetched concurrently when sending updates for all the feeds
+DEFAULT_FETCH_JOBS = 8
+
+# Downloads of article pages and images are aborted when they exceed these sizes, or take longer than this (seconds)
+DEFAULT_MAX_PAGE_SIZE_MB = 10
+DEFAULT_MAX_IMAGE_SIZE_MB = 5
+DEFAULT_DOWNLOAD_TIMEOUT = 60
+
+# Number of images downloaded concurrently while building a book, in total and from a single host
+DEFAULT_IMAGE_DOWNLOAD_CONCURRENCY = 16
+DEFAULT_IMAGE_DOWNLOADS_PER_HOST = 4
+
+# Images that are smaller than this (in pixels, in both dimensions) are skipped, as are images whose host (or host
+# and path) match any of these patterns: they're tracking pixels, spacers and share buttons, not content
+DEFAULT_IMAGE_MIN_SIZE = 32
+DEFAULT_IMAGE_DENY_PATTERNS = ",".join(
+    [
+        "feeds.feedburner.com/~ff/*",
+        "feeds.feedburner.com/~r/*",
+        "pixel.wp.com",
+        "stats.wordpress.com",
+        "*.doubleclick.net",
+        "www.google-analytics.com",
+        "www.facebook.com/tr*",
+    ]
+)
+
+# Images are scaled down to fit this resolution (a 6" Kindle Paperwhite's screen), and images larger than this (in KB)
+# are converted to JPEG with this quality. 0 processing threads means one per CPU
+DEFAULT_IMAGE_MAX_WIDTH = 1072
+DEFAULT_IMAGE_MAX_HEIGHT = 1448
+DEFAULT_IMAGE_MAX_KB = 300
+DEFAULT_IMAGE_QUALITY = 80
+DEFAULT_IMAGE_PROCESSING_THREADS = 0
+
+# Name of the mercury-parser-api Docker container (an existing container with this name is reused), the time (in
+# minutes) it's kept running after its last use, and the time (in seconds) to wait for it to be ready
+DEFAULT_MERCURY_CONTAINER = "mercury-parser-api"
+DEFAULT_MERCURY_IDLE_TIMEOUT_MINUTES = 60
+DEFAULT_MERCURY_STARTUP_TIMEOUT = 60
+
+# Number of Mercury containers to run (on consecutive ports starting at 3000), the number of requests sent to each one
+# concurrently, and the time (in seconds) to wait for a single article to be parsed
+DEFAULT_MERCURY_REPLICAS = 1
+DEFAULT_MERCURY_REQUESTS_PER_ENDPOINT = 4
+DEFAULT_MERCURY_TIMEOUT = 60
+
+
+class Parser(str, Enum):
+    """
+    A convenience class to represent the built-in parsing options
+
+    A str enum, so members compare equal to the parser names stored in the config. Parsers from other packages are
+    found through entry points (see `r2k.ebook.parser_registry`)
+    """
 
     PUSH_TO_KINDLE = "pushtokindle"
     MERCURY = "mercury"
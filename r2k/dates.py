@@ -1,15 +1,22 @@
+import calendar
+import time
 from datetime import datetime
-from typing import Union
+from functools import lru_cache
+from typing import Optional, Union
 
 import arrow
 import yaml
 
 DATE_FORMATS = [arrow.FORMAT_RSS, arrow.FORMAT_ATOM, "ddd, DD MMM YYYY HH:mm:ss ZZZ"]
 
+# The number of parsed date strings to keep in memory. Dates repeat a lot (the same entries are parsed for the unread
+# filter, the date range in the EPUB title, etc.), and parsing a string can go through several failing formats
+DATE_CACHE_SIZE = 4096
 
-def get_pretty_date_str(
-    date: Union[str, datetime, arrow.Arrow], show_time: bool = False, show_year: bool = True
-) -> str:
+DateType = Union[str, datetime, arrow.Arrow, time.struct_time]
+
+
+def get_pretty_date_str(date: DateType, show_time: bool = False, show_year: bool = True) -> str:
     """Return a nice representation of a date"""
     date = parse_date(date)
 
@@ -26,31 +33,54 @@ def get_pretty_date_str(
     return date.strftime(template)
 
 
-def parse_date(date: Union[str, datetime, arrow.Arrow]) -> arrow.Arrow:
+def parse_date(date: DateType) -> arrow.Arrow:
     """Return a standardized UTC Arrow object"""
-    _date = None
     if isinstance(date, str):
-        try:
-            _date = arrow.get(date)
-        except arrow.ParserError:
-            pass
-
-        if not _date:
-            parser = arrow.parser.DateTimeParser()
-            for fmt in DATE_FORMATS:
-                try:
-                    _date = parser.parse(date, fmt=fmt)
-                except arrow.ParserError:
-                    continue
-        if not _date:
-            raise arrow.ParserError()
-
+        return _parse_date_str(date)
+    elif isinstance(date, time.struct_time):
+        return parse_struct_time(date)
     elif isinstance(date, datetime):
         _date = arrow.Arrow.fromdatetime(date)
     else:
         _date = date
 
-    return _date.astimezone(tz=arrow.utcnow().tzinfo)
+    return _to_utc(_date)
+
+
+def parse_struct_time(date: time.struct_time) -> arrow.Arrow:
+    """
+    Return a standardized UTC Arrow object from a UTC `struct_time`
+
+    This is the fast path for feed entries, as feedparser already parses the dates it finds into UTC structs
+    """
+    return arrow.Arrow.utcfromtimestamp(calendar.timegm(date))
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date_str(date: str) -> arrow.Arrow:
+    """Parse a string date, trying several known formats. Arrow objects are immutable, so results can be cached"""
+    _date: Optional[Union[datetime, arrow.Arrow]] = None
+    try:
+        _date = arrow.get(date)
+    except arrow.ParserError:
+        pass
+
+    if not _date:
+        parser = arrow.parser.DateTimeParser()
+        for fmt in DATE_FORMATS:
+            try:
+                _date = parser.parse(date, fmt=fmt)
+            except arrow.ParserError:
+                continue
+    if not _date:
+        raise arrow.ParserError()
+
+    return _to_utc(_date)
+
+
+def _to_utc(date: Union[datetime, arrow.Arrow]) -> arrow.Arrow:
+    """Convert a date to UTC"""
+    return arrow.get(date).to("UTC")
 
 
 def now() -> arrow.Arrow:
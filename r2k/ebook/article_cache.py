@@ -0,0 +1,106 @@
+"""
+A persistent, on-disk cache of parsed articles (i.e. the dicts returned by `ParserBase.parse`)
+
+Entries are keyed by the article's URL and the parser's name and version, so reruns (e.g. after a failed email),
+resends and articles that appear in several feeds skip both the download and the extraction
+"""
+import hashlib
+import os
+import time
+from os.path import exists, join
+from tempfile import NamedTemporaryFile
+from typing import List, Optional, Tuple
+
+import orjson as json
+
+from r2k.cli import logger
+from r2k.constants import DEFAULT_ARTICLE_CACHE_DIR
+
+from .base_parser import ParserBase
+
+SECONDS_IN_DAY = 24 * 60 * 60
+BYTES_IN_MB = 1024 * 1024
+
+
+class ArticleCache:
+    """A directory of JSON files, one per parsed article"""
+
+    def __init__(self, path: str) -> None:
+        """Constructor"""
+        self.path = path
+        self.enabled = True
+
+    @staticmethod
+    def get_key(url: str, parser: ParserBase) -> str:
+        """Return the cache key of an article parsed with a specific parser"""
+        raw_key = f"{type(parser).__name__}:{parser.version}:{url}"
+        return hashlib.sha256(raw_key.encode()).hexdigest()
+
+    def get_path(self, url: str, parser: ParserBase) -> str:
+        """Return the path of an article's cache file"""
+        key = self.get_key(url, parser)
+        # Spread the files over subfolders, to keep the folders small
+        return join(self.path, key[:2], f"{key}.json")
+
+    def has(self, url: str, parser: ParserBase) -> bool:
+        """Return True if the article is in the cache"""
+        return self.enabled and exists(self.get_path(url, parser))
+
+    def get(self, url: str, parser: ParserBase) -> Optional[dict]:
+        """Return the cached parsed article, or None if it's not in the cache"""
+        if not self.enabled:
+            return None
+        try:
+            with open(self.get_path(url, parser), "rb") as f:
+                parsed_article = json.loads(f.read())
+        except (OSError, json.JSONDecodeError):
+            return None
+        logger.debug(f"Found {url} in the article cache")
+        return parsed_article
+
+    def set(self, url: str, parser: ParserBase, parsed_article: dict) -> None:
+        """Add a parsed article to the cache"""
+        if not self.enabled:
+            return
+        path = self.get_path(url, parser)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename it, so that concurrent readers never see a partially written file
+        with NamedTemporaryFile("wb", dir=os.path.dirname(path), delete=False) as f:
+            f.write(json.dumps(parsed_article))
+        os.replace(f.name, path)
+
+    def evict(self, max_age_days: int, max_size_mb: int) -> int:
+        """Remove entries older than `max_age_days`, then the oldest ones until the cache fits in `max_size_mb`"""
+        entries = sorted(self.list_entries(), key=lambda entry: entry[1], reverse=True)
+        threshold = time.time() - max_age_days * SECONDS_IN_DAY
+        max_size = max_size_mb * BYTES_IN_MB
+
+        removed = 0
+        total_size = 0
+        for path, mtime, size in entries:
+            total_size += size
+            if mtime < threshold or total_size > max_size:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Already removed by a concurrent run
+                    continue
+                removed += 1
+        return removed
+
+    def list_entries(self) -> List[Tuple[str, float, int]]:
+        """Return the path, modification time and size of every file in the cache"""
+        entries = []
+        for dirname, _, files in os.walk(self.path):
+            for filename in files:
+                path = join(dirname, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Removed since the folder was listed (e.g. evicted by a concurrent run)
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+
+article_cache = ArticleCache(DEFAULT_ARTICLE_CACHE_DIR)
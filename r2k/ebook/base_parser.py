@@ -1,17 +1,44 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from types import TracebackType
 from typing import Optional, Type
 
-from bs4 import BeautifulSoup
+from r2k import http_client
+
+
+@dataclass(frozen=True)
+class ParserCapabilities:
+    """What a parser supports, so that the book builder can pick the fastest way to run it"""
+
+    # Whether the parser can download the page separately from extracting its content (see `fetch` and `extract`).
+    # This allows overlapping the downloads of some articles with the extraction of others
+    splits_fetch: bool = False
+    # Whether a single parser instance can parse several articles at once, from multiple threads
+    thread_safe: bool = False
+    # Whether the parser can be instantiated in worker processes, to parse articles in parallel.
+    # Only true for parsers that don't hold any external resources (e.g. containers) between __enter__ and __exit__
+    process_safe: bool = False
 
 
 class ParserBase(ABC):
     """
     Base class for parsers
+
+    Parsers are found through the `r2k.parsers` entry points (see `parser_registry`)
     """
 
+    capabilities = ParserCapabilities()
+
+    # Bump this whenever a change in the parser changes its output, so that previously cached articles aren't used
+    version: str = "1"
+
+    @classmethod
+    def get_missing_requirements(cls) -> Optional[str]:
+        """Return a description of what's missing in order to use the parser (e.g. an optional package), if anything"""
+        return None
+
     @abstractmethod
     def __enter__(self) -> ParserBase:
         """Context manager __enter__"""
@@ -29,14 +56,23 @@ class ParserBase(ABC):
         """Main function used to parse the article from a URL"""
         pass
 
-    @staticmethod
-    def fix_blockquotes(html: str) -> str:
-        """Mobi doesn't seem to deal well with <p> tags inside <blockquote> tags. So we replace <p> with <div>"""
-        soup = BeautifulSoup(html, "html.parser")
-        for quote in soup.find_all("blockquote"):
-            if not quote.p:
-                continue
-            quote.p.wrap(soup.new_tag("div"))  # Wrap all <p> elements with <div>
-            quote.p.unwrap()  # Unwrap removes the element and replaces it with its content
-
-        return soup.decode()
+    def get_concurrency(self) -> int:
+        """Return the number of articles a thread safe parser can parse concurrently"""
+        from r2k.config import config
+
+        return config.article_fetch_concurrency if self.capabilities.thread_safe else 1
+
+    def fetch(self, url: str) -> str:
+        """Download the page of an article (only used by parsers that set `splits_fetch`)"""
+        from r2k.config import config
+
+        return http_client.download(url, config.max_page_size_mb).text
+
+    def extract(self, url: str, html: str) -> dict:
+        """
+        Extract the article from an already downloaded page
+
+        Parsers that set `splits_fetch` override this. Any other parser can't make use of the page, so the article is
+        parsed from its URL instead (downloading it again)
+        """
+        return self.parse(url)
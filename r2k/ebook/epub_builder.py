@@ -1,23 +1,32 @@
-from os import listdir, makedirs, walk
+from __future__ import annotations
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from os import cpu_count, listdir, makedirs, walk
 from os.path import join
 from shutil import copyfile, rmtree
 from string import Template
 from tempfile import mkdtemp
-from typing import Any, List, Optional, Type
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Set
 from uuid import uuid4
 from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 import arrow
-from bs4 import BeautifulSoup
+import lxml.html
 
-from r2k.cli import logger
+from r2k import http_client
+from r2k.cli import cli_utils, logger
 from r2k.config import config
-from r2k.constants import TEMPLATES_DIR, Parser
+from r2k.constants import TEMPLATES_DIR
 from r2k.feeds import Article
-from r2k.unicode import normalize_str, strip_common_unicode_chars
+from r2k.unicode import normalize_str
 
-from . import images
+from . import html_pipeline, images, parser_registry
+from .article_cache import article_cache
 from .base_parser import ParserBase
+from .pipeline import ArticlePipeline
 
 META_INF = "META-INF"
 OEBPS = "OEBPS"
@@ -26,57 +35,186 @@ IMAGES = "images"
 CONTENT = "content"
 _R2K = "_r2k"
 
+# Estimates (in bytes) of the size a file adds to a ZIP archive on top of its content (its local and central
+# directory headers), and of the size an article's entries in the table of contents and the manifest add to a book
+ZIP_ENTRY_OVERHEAD = 256
+TOC_ENTRIES_SIZE = 512
+
 # The number of elements in toc.ncx that appear before the articles (the initial 1 is because toc starts from 1, not 0)
 NAVPOINT_OFFSET = 1 + 2
 
 EPUB_DIR = join(TEMPLATES_DIR, "epub")
 
+# A parser that is kept open across books (see `shared_parser`)
+_shared_parser: Optional[ParserBase] = None
+
+
+def prepare_articles(raw_articles: List[Article]) -> List[EPUBArticle]:
+    """
+    Parse the articles and download their images, so that they can be packed into books
+
+    :returns the articles that were parsed successfully (in the same order)
+    """
+    return ArticleSet([EPUBArticle(raw_article) for raw_article in raw_articles]).prepare()
+
 
-def create_epub(raw_articles: List[Article], title: str) -> str:
+def pack_articles(articles: List[EPUBArticle], max_size: int) -> List[List[EPUBArticle]]:
     """
-    Create an EPUB book from multiple articles.
+    Split the articles into as few books as possible, each one (estimated to be) at most `max_size` bytes
+
+    The articles keep their order: a book is filled with consecutive articles until the next one doesn't fit. An
+    image that's shared by several articles of the same book is only counted once, as it's only added once. An
+    article that doesn't fit in a book on its own gets a book of its own
+    """
+    books: List[List[EPUBArticle]] = []
+    book: List[EPUBArticle] = []
+    book_images: Set[str] = set()
+    book_size = 0
+    for article in articles:
+        article_size = get_article_size(article, book_images) + TOC_ENTRIES_SIZE
+        if book and get_book_overhead() + book_size + article_size > max_size:
+            books.append(book)
+            book, book_images, book_size = [], set(), 0
+            article_size = get_article_size(article, book_images) + TOC_ENTRIES_SIZE
+        book.append(article)
+        book_images.update(article.image_blobs)
+        book_size += article_size
+    if book:
+        books.append(book)
+    return books
+
+
+def get_article_size(article: EPUBArticle, book_images: Set[str]) -> int:
+    """Estimate the size an article adds to the EPUB archive, not counting the images the book already has"""
+    new_images = [(blob_name, url) for blob_name, url in article.image_blobs.items() if blob_name not in book_images]
+    return (
+        get_compressed_size(article.get_xhtml().encode())
+        + ZIP_ENTRY_OVERHEAD
+        + sum(images.get_image_size(blob_name, url) + ZIP_ENTRY_OVERHEAD for blob_name, url in new_images)
+    )
+
+
+@lru_cache(maxsize=None)
+def get_book_overhead() -> int:
+    """Estimate the size of everything in the EPUB archive that isn't an article (fixed files, templates, etc.)"""
+    overhead = 0
+    for dirname, _, files in walk(EPUB_DIR):
+        for filename in files:
+            with open(join(dirname, filename), "rb") as f:
+                overhead += get_compressed_size(f.read()) + ZIP_ENTRY_OVERHEAD
+    return overhead
+
+
+def get_compressed_size(content: bytes) -> int:
+    """Return the size of content once it's deflated into a ZIP archive (see `EPUB.add_files_to_zip`)"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return len(compressor.compress(content) + compressor.flush())
+
+
+def create_epub(articles: List[EPUBArticle], title: str) -> str:
+    """
+    Create an EPUB book from multiple (already prepared) articles.
 
     :returns temp path to created ebook
     """
     epub_path = mkdtemp()
     logger.debug(f"Creating epub folder in {epub_path}")
 
-    articles = [EPUBArticle(raw_article, epub_path) for raw_article in raw_articles]
     book = EPUB(articles, title, epub_path)
     return book.build()
 
 
+def get_template(template_path: str) -> Template:
+    """
+    Return a Template object from the templates EPUB dir
+    """
+    with open(join(EPUB_DIR, template_path)) as f:
+        return Template(f.read())
+
+
+@contextmanager
+def shared_parser() -> Iterator[ParserBase]:
+    """
+    Keep a single parser open for all the books created inside the context, instead of opening a new one per book
+
+    Useful for long running processes, where e.g. the Mercury parser's container would otherwise be started and
+    removed for every single book
+    """
+    global _shared_parser
+    with parser_registry.get_parser_class()() as parser:
+        _shared_parser = parser
+        try:
+            yield parser
+        finally:
+            _shared_parser = None
+
+
 class EPUBArticle:
     """
     Represents a single article, with rendering and parsing options for transforming it into EPUB content
     """
 
-    def __init__(self, raw_article: Article, epub_path: str):
+    def __init__(self, raw_article: Article):
         """
         Constructor
         """
         self.url = raw_article.link
         self.title = raw_article.title
+        # The key of the article in the seen index, to tell which articles were sent
+        self.key = raw_article.get_key()
         self.id = normalize_str(self.title)
         self.author = raw_article.get("author", "")
         self.date = raw_article.get_str_date()
-        self.images_path = join(epub_path, OEBPS, IMAGES)
+        self.parsed_date = raw_article.get_parsed_date()
+        # The article's page, if it was already downloaded (e.g. a single article, to find its title)
+        self.html: Optional[str] = raw_article.get("html")
 
+        # The processed content of the article. It's kept as a tree until its images are set (see `set_images`), and
+        # is serialized into `content` only once, when it's final (see `get_content`)
+        self._root: Optional[lxml.html.HtmlElement] = None
         self.content: Optional[str] = None
-        self.images: List[str] = []
-
-    def parse(self, parser: ParserBase) -> bool:
+        # The URLs of the article's images (the n-th URL replaces the n-th image placeholder in the content)
+        self.image_urls: List[str] = []
+        # The images of the article in the image store (each one once, with the URL it was downloaded from), which
+        # are added to the book it ends up in
+        self.image_blobs: Dict[str, str] = {}
+        # Why resources of the article (e.g. images) were skipped
+        self.download_errors: List[str] = []
+        # The rendered article.xhtml (see `get_xhtml`)
+        self._xhtml: Optional[str] = None
+
+    def parse(self, parser: ParserBase, html: Optional[str] = None) -> bool:
         """
         Prepare the content of the article for EPUB
 
         Performs these tasks:
-            1. Parse the article with the Mercury parser
-            2. Download all the images mentioned in the article (EPUB format only supports embedded local images)
-            3. Replace all the <img "src"> tags with the local paths of the downloaded images
+            1. Parse the article with the parser (only extract it, if its page was already downloaded to `html`), unless
+               it's already in the article cache
+            2. Clean up its HTML, and find all the images mentioned in it (they're downloaded later on, together with
+               the images of the other articles)
+        Any error is logged, so that a single failed article doesn't affect the rest of the book
         :return: True iff the parsing succeeded
         """
         logger.info(f"Parsing `{self.title}`...")
-        parsed_article = parser.parse(self.url)
+        try:
+            cached_article = article_cache.get(self.url, parser)
+            if cached_article is not None:
+                return self.set_content(cached_article)
+
+            parsed_article = parser.parse(self.url) if html is None else parser.extract(self.url, html)
+            if parsed_article.get("content"):
+                article_cache.set(self.url, parser, parsed_article)
+            return self.set_content(parsed_article)
+        except http_client.DownloadError as e:
+            logger.error(f"Failed to download `{self.title}`: {e.reason}. Skipping it")
+            return False
+        except Exception as e:
+            logger.error(f"Failed to parse `{self.title}`. Skipping it")
+            logger.debug(f"Error info:\n{e}")
+            return False
+
+    def set_content(self, parsed_article: dict) -> bool:
+        """Set the content of the article from the parser's result, and return False if there was no content"""
         raw_content = parsed_article.get("content")
         if not raw_content:
             return False
@@ -85,49 +223,174 @@ class EPUBArticle:
         # their content doesn't include the actual image, so we're adding it here
         if lead_image_url := parsed_article.get("lead_image_url"):
             raw_content = f'<img src="{lead_image_url}"/>\n{raw_content}'
-        clean_html = strip_common_unicode_chars(raw_content)
-        self.content = self.parse_images(clean_html)
+        self._root = html_pipeline.process_html(raw_content, self.get_transforms())
         return True
 
-    def parse_images(self, raw_content: str) -> str:
+    def get_root(self) -> Optional[lxml.html.HtmlElement]:
+        """Return the tree of the article's content (parsed again only if it was serialized, see `__getstate__`)"""
+        if self._root is None and self.content is not None:
+            self._root = html_pipeline.parse(self.content)
+            self.content = None
+        return self._root
+
+    def get_content(self) -> Optional[str]:
+        """Return the final XHTML content of the article"""
+        if self._root is not None:
+            self.content = html_pipeline.serialize(self._root)
+            self._root = None
+        return self.content
+
+    def __getstate__(self) -> dict:
+        """Serialize the content when the article is pickled (e.g. by a worker process), as lxml trees can't be"""
+        self.get_content()
+        return self.__dict__
+
+    def get_transforms(self) -> List[html_pipeline.Transform]:
+        """Return the transforms the article's HTML goes through (in order)"""
+        return [
+            html_pipeline.strip_unrendered,
+            html_pipeline.fix_blockquotes,
+            html_pipeline.normalize_unicode,
+            self.parse_images,
+        ]
+
+    def parse_images(self, root: lxml.html.HtmlElement) -> None:
         """
-        Parse and download images in the article
+        Find the images in the article
 
-        Go over the content of the article and:
-            1. Find all the `img` tags in the HTML
-            2. Download all the images to the `images` folder in the EPUB dir
-            3. Set the relative paths to those images in the HTML content
-            4. Update the `content` attribute with the new HTML content
+        The images of all the articles are downloaded together later on (see `ArticleSet.download_images`), so
+        for now the absolute URLs of the images are collected, and their `src` is set to a placeholder. Images that
+        obviously aren't content (e.g. tracking pixels) are removed right away
         """
-        soup = BeautifulSoup(raw_content, "html.parser")
         logger.debug("Looking for images...")
-        for img in soup.find_all("img"):
-            img_url = images.get_img_url(self.url, img)
+        for img in list(root.iter("img")):
+            img_url = images.get_img_url(self.url, img.get("src"))
             if not img_url:
                 continue
+            if not images.is_wanted_image(img_url, img):
+                img.drop_tree()
+                continue
 
-            image_name = self.download_image(img_url)
-            # Ad the articles live in the `content` folder, we need to go one level up
-            image_path = join("..", IMAGES, image_name)
-            img["src"] = image_path
+            img.set("src", html_pipeline.IMAGE_PLACEHOLDER.format(len(self.image_urls)))
+            self.image_urls.append(img_url)
+
+    def set_images(self, blob_names: Dict[str, str], errors: Dict[str, http_client.DownloadError]) -> None:
+        """Point the article's images to their downloaded files, and drop those that couldn't be downloaded"""
+        image_paths: Dict[int, Optional[str]] = {}
+        for index, url in enumerate(self.image_urls):
+            if url in blob_names:
+                blob_name = blob_names[url]
+                # As the articles live in the `content` folder, we need to go one level up
+                image_paths[index] = join("..", IMAGES, images.get_book_image_name(blob_name))
+                self.image_blobs.setdefault(blob_name, url)
+            else:
+                # EPUB only supports embedded images, so an image that couldn't be downloaded is dropped (images
+                # that were skipped on purpose, e.g. tracking pixels, have no error)
+                image_paths[index] = None
+                if url in errors and url not in self.image_urls[:index]:
+                    self.download_errors.append(f"Image {errors[url]}")
+
+        if (root := self.get_root()) is not None:
+            html_pipeline.set_image_paths(root, image_paths)
+
+    def get_xhtml(self) -> str:
+        """Return the final article.xhtml of the article (rendered once, as it's also used to measure the article)"""
+        if self._xhtml is None:
+            self._xhtml = get_template(join(OEBPS, CONTENT, "article.xhtml")).substitute(**self.get_kwargs())
+        return self._xhtml
 
-        return soup.decode()
+    def get_kwargs(self) -> dict:
+        """
+        Return a dict of the values necessary for rendering an article
+        """
+        return dict(title=self.title, author=self.author, date=self.date, content=self.get_content())
+
+
+class ArticleSet:
+    """
+    All the articles that are sent together (e.g. the unread articles of a feed), before they're packed into books
+
+    The articles are parsed, and their images are downloaded, all at once, so that everything is done as
+    concurrently as the parser allows, no matter how many books the articles end up in
+    """
+
+    def __init__(self, articles: List[EPUBArticle]):
+        """
+        Constructor
+        """
+        self.articles = articles
 
-    def download_image(self, url: str) -> str:
+    def prepare(self) -> List[EPUBArticle]:
         """
-        Download an image from a URL into the images folder
+        Parse the articles and download their images, and return the articles that were parsed successfully
+
+        Any error is logged, and the article (or image) is skipped
         """
-        logger.debug(f"Downloading image {url}...")
-        image_name = images.get_image_filename(url)
-        image_path = join(self.images_path, image_name)
-        images.download_image(url, image_path)
-        return image_name
+        logger.debug("Parsing articles...")
+        with self.open_parser() as parser:
+            results = self.parse_articles(parser)
+        articles = [article for article, success in zip(self.articles, results) if success]
+        self.download_images(articles)
+        self.report_download_errors()
+        return articles
 
-    def get_kwargs(self) -> dict:
+    def download_images(self, articles: List[EPUBArticle]) -> None:
         """
-        Return a dict of the values necessary for rendering an article
+        Download the images of all the (successfully parsed) articles concurrently, and point the articles to them
+
+        Each image is downloaded once, even if it appears in several articles
+        """
+        urls = list(dict.fromkeys(url for article in articles for url in article.image_urls))
+        if not urls:
+            return
+
+        logger.debug(f"Downloading {len(urls)} images...")
+        blob_names, errors = images.download_images(urls)
+        for article in articles:
+            article.set_images(blob_names, errors)
+
+    def report_download_errors(self) -> None:
+        """Warn about the resources that were skipped in each article, and why"""
+        for article in self.articles:
+            if article.download_errors:
+                errors_str = "\n".join(f"  - {error}" for error in article.download_errors)
+                logger.warning(f"Skipped {len(article.download_errors)} resources in `{article.title}`:\n{errors_str}")
+
+    def parse_articles(self, parser: ParserBase) -> List[bool]:
         """
-        return dict(title=self.title, author=self.author, date=self.date, content=self.content)
+        Parse all the articles, and return whether each one was parsed successfully (in the same order)
+
+        The fastest strategy the parser's capabilities allow is used:
+            1. Parsers that split fetching from extracting go through the fetch/extract pipeline: the pages are
+               downloaded concurrently, while the (CPU bound) extraction runs in parallel in worker processes
+            2. Thread safe parsers (e.g. a remote parser service) parse as many articles at once as they support
+            3. Any other parser parses the articles one by one
+        """
+        capabilities = parser.capabilities
+        if capabilities.splits_fetch:
+            return self.parse_articles_in_pipeline(parser)
+
+        concurrency = min(parser.get_concurrency(), len(self.articles)) if capabilities.thread_safe else 1
+        if concurrency <= 1:
+            return [article.parse(parser) for article in self.articles]
+        parse = cli_utils.in_current_context(lambda article: article.parse(parser))
+        with ThreadPoolExecutor(concurrency, thread_name_prefix="r2k-parse") as executor:
+            return list(executor.map(parse, self.articles))
+
+    def parse_articles_in_pipeline(self, parser: ParserBase) -> List[bool]:
+        """Parse the articles in the fetch/extract pipeline"""
+        processes = min(config.parse_processes or cpu_count() or 1, len(self.articles))
+        results = ArticlePipeline(parser, processes).run(self.articles)
+
+        # When extracting in worker processes, the workers parse copies of the articles, so the originals are replaced
+        self.articles = [parsed_article for _, parsed_article in results]
+        return [success for success, _ in results]
+
+    def open_parser(self) -> ContextManager[ParserBase]:
+        """Return the shared parser if there is one, or a new parser otherwise (both as context managers)"""
+        if _shared_parser:
+            return nullcontext(_shared_parser)
+        return parser_registry.get_parser_class()()
 
 
 class EPUB:
@@ -228,39 +491,14 @@ class EPUB:
 
     def render_articles(self) -> None:
         """
-        Go over all the articles and write their formatted content to disk
-
-        For each article:
-            1. Parse its content (also downloads images)
-            2. If the parse did not succeed do nothing
-            3. If the article was parsed successfully, use the `article.xhtml` template to create the final article
+        Write the formatted content of all the articles to disk, and add their images to the book
         """
         logger.debug("Rendering articles...")
-        parser_cls = self._get_parser_class()
-        with parser_cls() as parser:
-            for article in self.articles:
-                if not article.parse(parser):
-                    continue
-                kwargs = dict(title=article.title, author=article.author, date=article.date, content=article.content)
-                article_path = join(OEBPS, CONTENT, f"{article.id}.xhtml")
-                article_html = self.render_template(join(OEBPS, CONTENT, "article.xhtml"), **kwargs)
-                self.write_file(article_html, article_path)
-
-    @staticmethod
-    def _get_parser_class() -> Type[ParserBase]:
-        """Importing the classes here to avoid issues with optional packages (e.g. docker)"""
-        parser_type = Parser(config.parser)
-
-        if parser_type == Parser.MERCURY:
-            from .mercury_parser import MercuryParser
-
-            return MercuryParser
-        elif parser_type == Parser.READABILITY:
-            from .readability_parser import ReadabilityParser
-
-            return ReadabilityParser
-        else:
-            raise ValueError(f"Parser must be one of: {Parser.__values__}")
+        images_path = join(self._dst_path, OEBPS, IMAGES)
+        for article in self.articles:
+            self.write_file(article.get_xhtml(), join(OEBPS, CONTENT, f"{article.id}.xhtml"))
+            for blob_name, url in article.image_blobs.items():
+                images.add_image_to_book(blob_name, url, images_path)
 
     def render_opf(self) -> None:
         """
@@ -292,7 +530,7 @@ class EPUB:
         logger.debug("Generating manifest images...")
         manifest_image_template = Template('<item id="${id}" href="images/${id}" media-type="image/${ext}"/>')
         manifest_images: List[dict] = [
-            dict(id=image_name, ext=images.get_img_extension(image_name))
+            dict(id=image_name, ext=images.get_media_subtype(image_name))
             for image_name in listdir(join(self._dst_path, OEBPS, IMAGES))
             if image_name != "cover.png"
         ]
@@ -361,7 +599,7 @@ class EPUB:
         Create a navpoint per article for use in the toc.ncx file
         """
         logger.debug("Generating navpoints...")
-        template = self.get_template(join(_R2K, "navpoint.xml"))
+        template = get_template(join(_R2K, "navpoint.xml"))
         navpoints = [
             dict(id=article.id, title=article.title, order=i + NAVPOINT_OFFSET)
             for i, article in enumerate(self.articles)
@@ -382,17 +620,9 @@ class EPUB:
         """
         Return a rendered template
         """
-        template = self.get_template(template_path)
+        template = get_template(template_path)
         return template.substitute(**kwargs)
 
-    @staticmethod
-    def get_template(template_path: str) -> Template:
-        """
-        Return a Template object from the templates EPUB dir
-        """
-        with open(join(EPUB_DIR, template_path)) as f:
-            return Template(f.read())
-
     def write_file(self, content: str, path: str) -> None:
         """
         Write a text file (not a binary one) to the EPUB destination path
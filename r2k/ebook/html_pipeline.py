@@ -0,0 +1,81 @@
+"""
+Single pass processing of an article's HTML content
+
+The content is parsed once into an lxml tree, goes through a list of transforms that modify the tree in place, and is
+serialized once (as XHTML, as required by EPUB), after its images were downloaded and set in the tree
+"""
+from html import escape
+from typing import Callable, Dict, Iterable, Optional
+
+import lxml.html
+from lxml import etree
+
+from r2k.unicode import strip_common_unicode_chars
+
+Transform = Callable[[lxml.html.HtmlElement], None]
+
+# Elements that are never rendered, and are thus removed with all of their content
+UNRENDERED_TAGS = ("script", "style", "noscript")
+# Attributes with human readable text, that should be normalized the same way the text is
+TEXT_ATTRIBUTES = ("alt", "title")
+# Images are downloaded after the article was processed, so their `src` is temporarily set to a numbered placeholder
+IMAGE_PLACEHOLDER = "r2k-image:{}"
+IMAGE_PLACEHOLDER_PREFIX = IMAGE_PLACEHOLDER.format("")
+
+
+def parse(html: str) -> lxml.html.HtmlElement:
+    """Parse an HTML fragment into a tree, under a wrapper <div>"""
+    return lxml.html.fragment_fromstring(html, create_parent="div")
+
+
+def process_html(html: str, transforms: Iterable[Transform]) -> lxml.html.HtmlElement:
+    """Parse an HTML fragment, apply all the transforms to it, and return the resulting tree (see `serialize`)"""
+    root = parse(html)
+    for transform in transforms:
+        transform(root)
+    return root
+
+
+def serialize(root: lxml.html.HtmlElement) -> str:
+    """Serialize the contents of the wrapper element created by `parse` (but not the wrapper itself) as XHTML"""
+    parts = [escape(root.text or "", quote=False)]
+    parts.extend(etree.tostring(child, encoding="unicode", method="xml") for child in root)
+    return "".join(parts)
+
+
+def set_image_paths(root: lxml.html.HtmlElement, image_paths: Dict[int, Optional[str]]) -> None:
+    """Set the `src` of the images with placeholders to their final paths, and remove those without a path"""
+    for img in list(root.iter("img")):
+        src = img.get("src", "")
+        if not src.startswith(IMAGE_PLACEHOLDER_PREFIX):
+            continue
+        if path := image_paths.get(int(src[len(IMAGE_PLACEHOLDER_PREFIX) :])):
+            img.set("src", path)
+        else:
+            img.drop_tree()
+
+
+def fix_blockquotes(root: lxml.html.HtmlElement) -> None:
+    """Mobi doesn't seem to deal well with <p> tags inside <blockquote> tags. So we replace <p> with <div>"""
+    for quote in root.iter("blockquote"):
+        for p in quote.iter("p"):
+            p.tag = "div"
+            p.attrib.clear()
+
+
+def strip_unrendered(root: lxml.html.HtmlElement) -> None:
+    """Remove <script>, <style> and <noscript> elements, which are of no use in an ebook"""
+    for elem in list(root.iter(*UNRENDERED_TAGS)):
+        elem.drop_tree()
+
+
+def normalize_unicode(root: lxml.html.HtmlElement) -> None:
+    """Replace common unicode characters (quotes, dashes) with their ASCII counterparts in all the text"""
+    for elem in root.iter():
+        if elem.text:
+            elem.text = strip_common_unicode_chars(elem.text)
+        if elem.tail:
+            elem.tail = strip_common_unicode_chars(elem.tail)
+        for attribute in TEXT_ATTRIBUTES:
+            if value := elem.get(attribute):
+                elem.set(attribute, strip_common_unicode_chars(value))
@@ -0,0 +1,209 @@
+"""
+Preparing downloaded images for a Kindle
+
+Images are scaled down to fit the device's screen, optionally converted to grayscale, and converted to a format the
+Kindle supports (progressive JPEG, unless they're transparent) if they aren't in one, or are too large. The real format
+of an image is detected from its first bytes, as URLs often have the wrong extension (or none at all).
+
+Resizing and converting requires the optional Pillow package (`pip install 'r2k[images]'`). Without it, images are
+only checked for their real format
+"""
+import struct
+from io import BytesIO
+from os import cpu_count
+from typing import Optional, Tuple
+
+from r2k.cli import logger
+from r2k.config import config
+
+try:
+    from PIL import Image
+except ModuleNotFoundError:
+    Image = None  # type: ignore
+
+# Formats a Kindle can show
+SUPPORTED_FORMATS = {"jpeg", "png", "gif", "bmp", "svg"}
+# Formats that can have transparency, which JPEG doesn't support
+ALPHA_MODES = {"RGBA", "LA", "PA"}
+
+_warned_missing_pillow = False
+
+
+def detect_format(data: bytes) -> Optional[str]:
+    """Return the format of an image (as an extension) according to its first bytes, or None if it's unknown"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+        return "webp"
+    if data.startswith(b"BM"):
+        return "bmp"
+    if data.startswith((b"II*\x00", b"MM\x00*")):
+        return "tiff"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"avif", b"avis"):
+        return "avif"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1"):
+        return "heic"
+    if b"<svg" in data[:1024].lower():
+        return "svg"
+    return None
+
+
+def get_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Return the (width, height) of an image according to its first bytes, or None if they can't be found there
+
+    Only the headers are read, so this works on the beginning of a download, and doesn't require Pillow
+    """
+    try:
+        image_format = detect_format(data)
+        if image_format == "png" and data[12:16] == b"IHDR":
+            return struct.unpack(">II", data[16:24])
+        if image_format == "gif":
+            return struct.unpack("<HH", data[6:10])
+        if image_format == "bmp":
+            # Either the old (12 bytes) or any of the newer info headers
+            if struct.unpack("<I", data[14:18])[0] == 12:
+                return struct.unpack("<HH", data[18:22])
+            width, height = struct.unpack("<ii", data[18:26])
+            return width, abs(height)
+        if image_format == "webp":
+            return get_webp_dimensions(data)
+        if image_format == "jpeg":
+            return get_jpeg_dimensions(data)
+    except struct.error:
+        # Not enough data
+        pass
+    return None
+
+
+def get_webp_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Return the dimensions of a WebP image from its first chunk (lossy, lossless or extended)"""
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = struct.unpack("<I", data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def get_jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Return the dimensions of a JPEG image from its start of frame segment, skipping the segments before it"""
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        # Start of frame markers (apart from DHT, JPG and DAC, which share the range)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        offset += 2 + struct.unpack(">H", data[offset + 2 : offset + 4])[0]
+    return None
+
+
+def get_profile() -> str:
+    """Return a string that identifies the current processing settings (processed images are cached per profile)"""
+    if not Image:
+        return "original"
+    grayscale = "gray" if config.image_grayscale else "color"
+    return (
+        f"{config.image_max_width}x{config.image_max_height}:{grayscale}:{config.image_max_kb}:{config.image_quality}"
+    )
+
+
+def get_worker_count() -> int:
+    """Return the number of images that are processed in parallel"""
+    return config.image_processing_threads or cpu_count() or 1
+
+
+def process_image(data: bytes, ext: str) -> Tuple[bytes, str]:
+    """
+    Prepare an image for the Kindle, and return its (possibly) new content and extension
+
+    The image is left as is if it's already in a supported format, fits the screen and isn't too large
+    """
+    image_format = detect_format(data) or ext
+    if not Image:
+        warn_missing_pillow(image_format)
+        return data, image_format
+    if image_format == "svg":
+        return data, image_format
+
+    try:
+        image: Image.Image = Image.open(BytesIO(data))
+        image.load()
+    except Exception as e:
+        logger.debug(f"Could not open the image. Leaving it as is: {e}")
+        return data, image_format
+
+    supported = image_format in SUPPORTED_FORMATS
+    # Only the first frame of animations is shown anyway, but converting animations that are supported isn't worth it
+    if supported and getattr(image, "is_animated", False):
+        return data, image_format
+
+    changed = False
+    if image.width > config.image_max_width or image.height > config.image_max_height:
+        image.thumbnail((config.image_max_width, config.image_max_height), Image.Resampling.LANCZOS)
+        changed = True
+    if config.image_grayscale and image.mode not in ("L", "LA", "1"):
+        image = image.convert("LA" if has_alpha(image) else "L")
+        changed = True
+    if supported and not changed and len(data) <= config.image_max_kb * 1024:
+        return data, image_format
+
+    processed_data, processed_format = encode(image, image_format)
+    if supported and not changed and len(processed_data) >= len(data):
+        # Converting didn't help
+        return data, image_format
+    return processed_data, processed_format
+
+
+def encode(image: "Image.Image", original_format: str) -> Tuple[bytes, str]:
+    """
+    Encode an image as PNG if it's transparent, or if it was a small enough PNG/GIF (e.g. a drawing or a comic, which
+    JPEG doesn't do well), and as a progressive JPEG otherwise
+    """
+    if has_alpha(image) or original_format in ("png", "gif"):
+        png_data = save(image, "PNG", optimize=True)
+        if has_alpha(image) or len(png_data) <= config.image_max_kb * 1024:
+            return png_data, "png"
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return save(image, "JPEG", quality=config.image_quality, optimize=True, progressive=True), "jpeg"
+
+
+def save(image: "Image.Image", image_format: str, **kwargs: object) -> bytes:
+    """Encode an image in a specific format"""
+    output = BytesIO()
+    image.save(output, image_format, **kwargs)
+    return output.getvalue()
+
+
+def has_alpha(image: "Image.Image") -> bool:
+    """Return True if the image has transparency"""
+    return image.mode in ALPHA_MODES or (image.mode == "P" and "transparency" in image.info)
+
+
+def warn_missing_pillow(image_format: str) -> None:
+    """Warn (once) that an image in an unsupported format can't be converted without Pillow"""
+    global _warned_missing_pillow
+    if image_format in SUPPORTED_FORMATS or _warned_missing_pillow:
+        return
+    _warned_missing_pillow = True
+    logger.warning(
+        f"Found a `{image_format}` image, which Kindle doesn't support. Install the optional Pillow package "
+        "(`pip install 'r2k[images]'`) to have such images converted"
+    )
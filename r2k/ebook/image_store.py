@@ -0,0 +1,127 @@
+"""
+A persistent, content-addressed store of downloaded images, shared across articles, books and runs
+
+Every image is stored once per content (as a "blob" named after the hash of its bytes), and every URL points to the
+blob it was downloaded to. Images that are referenced again (e.g. logos, avatars, or a comic strip that appears in
+several feeds) are taken from the store instead of being downloaded. The image behind a URL may change, so URLs are
+downloaded again once their entry is older than `image_cache_url_max_age_days`. The least recently used blobs are
+evicted once the store exceeds its size limit
+"""
+import hashlib
+import os
+import time
+from os.path import dirname, exists, join
+from tempfile import NamedTemporaryFile
+from typing import Optional
+
+from r2k.constants import DEFAULT_IMAGE_CACHE_DIR
+
+SECONDS_IN_DAY = 24 * 60 * 60
+BYTES_IN_MB = 1024 * 1024
+
+
+class ImageStore:
+    """A directory of image blobs (named `<content hash>.<ext>`), and a directory mapping URLs to blobs"""
+
+    def __init__(self, path: str) -> None:
+        """Constructor"""
+        self.blobs_path = join(path, "blobs")
+        self.urls_path = join(path, "urls")
+        # When disabled, URLs are neither looked up nor recorded, but the blobs are still written, as books are built
+        # from them
+        self.enabled = True
+
+    def get_blob_path(self, blob_name: str) -> str:
+        """Return the path of a blob"""
+        # Spread the files over subfolders, to keep the folders small
+        return join(self.blobs_path, blob_name[:2], blob_name)
+
+    def get_url_path(self, url: str, variant: str) -> str:
+        """Return the path of the file that holds the name of a URL's blob (per variant, e.g. processing settings)"""
+        key = hashlib.sha256(f"{variant}:{url}".encode()).hexdigest()
+        return join(self.urls_path, key[:2], key)
+
+    def get(self, url: str, max_age_days: int, variant: str = "") -> Optional[str]:
+        """Return the name of the blob an image URL was stored in, or None if it's not in the store (or too old)"""
+        if not self.enabled:
+            return None
+        url_path = self.get_url_path(url, variant)
+        try:
+            if os.path.getmtime(url_path) < time.time() - max_age_days * SECONDS_IN_DAY:
+                return None
+            with open(url_path) as f:
+                blob_name = f.read()
+            # Mark the blob as recently used
+            os.utime(self.get_blob_path(blob_name))
+        except OSError:
+            return None
+        return blob_name
+
+    def put(self, url: str, content: bytes, ext: str, variant: str = "") -> str:
+        """Add a downloaded image to the store (unless its content is already there), and return its blob's name"""
+        blob_name = f"{hashlib.sha256(content).hexdigest()}.{ext}"
+        blob_path = self.get_blob_path(blob_name)
+        try:
+            os.utime(blob_path)
+        except FileNotFoundError:
+            write_atomically(blob_path, content)
+        if self.enabled:
+            write_atomically(self.get_url_path(url, variant), blob_name.encode())
+        return blob_name
+
+    def evict(self, max_size_mb: int) -> int:
+        """Remove the least recently used blobs until the store fits in `max_size_mb`, and return how many were"""
+        # Blobs may be removed while the store is walked (e.g. by a concurrent run that evicts them too), in which
+        # case they're skipped
+        blobs = []
+        for dirname_, _, files in os.walk(self.blobs_path):
+            for filename in files:
+                try:
+                    stat = os.stat(join(dirname_, filename))
+                except FileNotFoundError:
+                    continue
+                blobs.append((join(dirname_, filename), stat.st_mtime, stat.st_size))
+
+        removed = 0
+        total_size = 0
+        max_size = max_size_mb * BYTES_IN_MB
+        for path, _, size in sorted(blobs, key=lambda blob: blob[1], reverse=True):
+            total_size += size
+            if total_size > max_size and remove_if_exists(path):
+                removed += 1
+        if removed:
+            self.remove_dangling_urls()
+        return removed
+
+    def remove_dangling_urls(self) -> None:
+        """Remove the URLs that point to blobs that were evicted"""
+        for dirname_, _, files in os.walk(self.urls_path):
+            for filename in files:
+                path = join(dirname_, filename)
+                try:
+                    with open(path) as f:
+                        blob_name = f.read()
+                except FileNotFoundError:
+                    continue
+                if not exists(self.get_blob_path(blob_name)):
+                    remove_if_exists(path)
+
+
+def remove_if_exists(path: str) -> bool:
+    """Remove a file, and return False if it was already removed (e.g. by a concurrent run)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def write_atomically(path: str, content: bytes) -> None:
+    """Write to a temp file and rename it, so that concurrent readers never see a partially written file"""
+    os.makedirs(dirname(path), exist_ok=True)
+    with NamedTemporaryFile("wb", dir=dirname(path), delete=False) as f:
+        f.write(content)
+    os.replace(f.name, path)
+
+
+image_store = ImageStore(DEFAULT_IMAGE_CACHE_DIR)
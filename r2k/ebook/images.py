@@ -1,34 +1,200 @@
-from typing import Optional
-from urllib.parse import unquote, urljoin, urlparse
-from uuid import uuid4
+import threading
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from fnmatch import fnmatch
+from itertools import chain, zip_longest
+from os.path import exists, getsize, join
+from shutil import copyfile
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
 
+import lxml.html
 import requests
-from bs4.element import Tag
 
-from r2k.constants import HTML_HEADERS
+from r2k import http_client
+from r2k.cli import cli_utils, logger
+from r2k.config import config
 
+from . import image_processing
+from .image_store import image_store
 
-def download_image(url: str, path: str) -> None:
+# Images smaller than this (in bytes) are tracking pixels, no matter what their dimensions are
+TRACKING_PIXEL_MAX_BYTES = 128
+
+
+def get_image(url: str, processor: Optional[Executor] = None) -> str:
+    """
+    Return the name of the image's blob in the image store, downloading and processing it first if it isn't there
+
+    The image is processed in `processor`, if one is given
+    Raises `http_client.DownloadError` if the image is too large or too slow to download
+    """
+    profile = image_processing.get_profile()
+    if blob_name := image_store.get(url, config.image_cache_url_max_age_days, profile):
+        logger.debug(f"Found image {url} in the image cache")
+        return blob_name
+
+    logger.debug(f"Downloading image {url}...")
+    response = http_client.download(url, config.max_image_size_mb, probe=probe_image)
+    ext = get_img_extension(urlparse(url).path)
+    if processor:
+        content, ext = processor.submit(image_processing.process_image, response.content, ext).result()
+    else:
+        content, ext = image_processing.process_image(response.content, ext)
+    return image_store.put(url, content, ext, profile)
+
+
+def probe_image(response: requests.Response, head: bytes) -> None:
     """
-    Download an image from URL to path
+    Abort the download of an image that turns out to be too small to be of any use, according to its first bytes
+
+    The size of the whole image (from Content-Length, or from `head` if that's all of it) catches tracking pixels,
+    and the dimensions in the image's header catch spacers and icons
     """
-    # download the body of response by chunk, not immediately
-    response = requests.get(url, headers=HTML_HEADERS, stream=True)
-    with open(path, "wb") as f:
-        for data in response.iter_content(1024):
-            # write data read to the file
-            f.write(data)
+    content_length = response.headers.get("Content-Length", "")
+    size = int(content_length) if content_length.isdigit() else None
+    if size is None and len(head) < http_client.PROBE_SIZE:
+        size = len(head)
+    if size is not None and size < TRACKING_PIXEL_MAX_BYTES:
+        raise http_client.SkippedDownload(response.url, f"tracking pixel ({size} bytes)")
+
+    if (dimensions := image_processing.get_dimensions(head)) and is_too_small(*dimensions):
+        raise http_client.SkippedDownload(response.url, f"too small ({dimensions[0]}x{dimensions[1]})")
+
 
+def is_too_small(width: int, height: int) -> bool:
+    """Whether an image is too small to be of any use to the reader (e.g. a spacer or a share button icon)"""
+    return max(width, height) < config.image_min_size
 
-def get_image_filename(url: str) -> str:
+
+def get_declared_dimensions(img: lxml.html.HtmlElement) -> Optional[Tuple[int, int]]:
+    """Return the dimensions in the `width` and `height` attributes of an <img> element, if it has both (in pixels)"""
+    width = img.get("width", "").strip().lower()
+    height = img.get("height", "").strip().lower()
+    if width.endswith("px"):
+        width = width[:-2]
+    if height.endswith("px"):
+        height = height[:-2]
+    if width.isdigit() and height.isdigit():
+        return int(width), int(height)
+    return None
+
+
+def is_denied(url: str) -> bool:
+    """Whether an image URL matches any of the deny patterns (matched against its host, or its host and path)"""
+    parsed = urlparse(url)
+    for pattern in config.image_deny_patterns.split(","):
+        pattern = pattern.strip()
+        if pattern and (fnmatch(parsed.netloc, pattern) or fnmatch(parsed.netloc + parsed.path, pattern)):
+            return True
+    return False
+
+
+def is_wanted_image(url: str, img: lxml.html.HtmlElement) -> bool:
     """
-    Get image name from its URL with a unique prefix to avoid collisions
+    Whether an image is worth downloading, judging by its URL and its <img> element alone
+
+    Images from denied hosts, and images that declare they're too small, are dropped without any request. The rest
+    are still checked by `probe_image` before they're downloaded in full
     """
-    image_basename = unquote(url).split("/")[-1]
-    image_basename = image_basename[-150:]
-    prefix = str(uuid4())[:8]
+    if is_denied(url):
+        logger.debug(f"Skipping denied image {url}")
+        return False
+    if (dimensions := get_declared_dimensions(img)) and is_too_small(*dimensions):
+        logger.debug(f"Skipping image {url}, which is too small ({dimensions[0]}x{dimensions[1]})")
+        return False
+    return True
+
+
+def get_book_image_name(blob_name: str) -> str:
+    """Return the name of an image in the book's images folder (the same image always gets the same name)"""
     # We start with img because XML IDs cannot start with numbers
-    return f"img-{prefix}-{image_basename}"
+    return f"img-{blob_name}"
+
+
+def add_image_to_book(blob_name: str, url: str, images_path: str) -> None:
+    """
+    Copy an image from the image store into the book's images folder (unless it's already there)
+
+    The name is derived from the content, so an image that's referenced several times in the book (even through
+    different URLs, or by different articles) is added only once
+    """
+    image_path = join(images_path, get_book_image_name(blob_name))
+    if exists(image_path):
+        return
+    try:
+        copyfile(image_store.get_blob_path(blob_name), image_path)
+    except FileNotFoundError:
+        if blob_path := download_evicted_image(url):
+            copyfile(blob_path, image_path)
+
+
+def get_image_size(blob_name: str, url: str) -> int:
+    """Return the size (in bytes) of an image in the image store (0 if it's dropped from the book)"""
+    try:
+        return getsize(image_store.get_blob_path(blob_name))
+    except FileNotFoundError:
+        blob_path = download_evicted_image(url)
+        return getsize(blob_path) if blob_path else 0
+
+
+def download_evicted_image(url: str) -> Optional[str]:
+    """
+    Download an image again, after its blob was evicted from the image store since (e.g. by a concurrent run)
+
+    :returns the path of its new blob, or None if it couldn't be downloaded (in which case it's dropped from the book)
+    """
+    logger.debug(f"Image {url} was evicted from the image cache. Downloading it again...")
+    try:
+        return image_store.get_blob_path(get_image(url))
+    except Exception as e:
+        logger.warning(f"Image {url} was evicted from the image cache, and couldn't be downloaded again: {e}")
+        return None
+
+
+def download_images(urls: List[str]) -> Tuple[Dict[str, str], Dict[str, http_client.DownloadError]]:
+    """
+    Download images concurrently into the image store (unless they're already there)
+
+    The number of concurrent downloads is bounded both in total and per host, so a single host with many images
+    isn't hammered (and doesn't hold up the images of other hosts)
+    :returns the blob names of the downloaded images, and the errors of those that failed (both by URL). Images that
+        were skipped by the probe are in neither
+    """
+    urls_by_host: Dict[str, List[str]] = defaultdict(list)
+    for url in urls:
+        urls_by_host[urlparse(url).netloc].append(url)
+    host_limits = {host: threading.BoundedSemaphore(config.image_downloads_per_host) for host in urls_by_host}
+
+    def download(url: str) -> Tuple[str, Optional[str], Optional[http_client.DownloadError]]:
+        try:
+            with host_limits[urlparse(url).netloc]:
+                blob_name = get_image(url, processor)
+        except http_client.SkippedDownload as e:
+            logger.debug(f"Skipped image: {e}")
+            return url, None, None
+        except http_client.DownloadError as e:
+            return url, None, e
+        except Exception as e:
+            # Anything else (e.g. a broken image, or a full disk) only drops this image as well
+            logger.debug(f"Failed to download image {url}:\n{e}")
+            return url, None, http_client.DownloadError(url, f"{type(e).__name__}: {e}")
+        return url, blob_name, None
+
+    # Interleave the hosts, so that the workers don't all end up waiting on the limit of a single host
+    interleaved_urls = [url for url in chain(*zip_longest(*urls_by_host.values())) if url]
+    blob_names: Dict[str, str] = {}
+    errors: Dict[str, http_client.DownloadError] = {}
+    # Processing is CPU bound, so it has its own pool, sized by the number of CPUs. It's a pool of threads, as Pillow
+    # releases the GIL while decoding, resizing and encoding, which saves copying the images to and from processes
+    processor = ThreadPoolExecutor(image_processing.get_worker_count(), thread_name_prefix="r2k-image-processing")
+    with processor, ThreadPoolExecutor(config.image_download_concurrency, thread_name_prefix="r2k-image") as executor:
+        for url, blob_name, error in executor.map(cli_utils.in_current_context(download), interleaved_urls):
+            if blob_name:
+                blob_names[url] = blob_name
+            elif error:
+                errors[url] = error
+    return blob_names, errors
 
 
 def is_valid_img_url(url: str) -> bool:
@@ -39,11 +205,10 @@ def is_valid_img_url(url: str) -> bool:
     return bool(parsed.netloc) and bool(parsed.scheme)
 
 
-def get_img_url(url: str, img: Tag) -> Optional[str]:
+def get_img_url(url: str, img_url: Optional[str]) -> Optional[str]:
     """
-    Get an absolute img URL from an img HTML element (with some checks and verifications first)
+    Get an absolute img URL from the `src` of an img HTML element (with some checks and verifications first)
     """
-    img_url = img.attrs.get("src")
     if not img_url:
         # if img does not contain src attribute, just skip
         return None
@@ -63,6 +228,12 @@ def get_img_url(url: str, img: Tag) -> Optional[str]:
     return None
 
 
+def get_media_subtype(path: str) -> str:
+    """Return the subtype of the image's media type (i.e. what comes after `image/`), according to its extension"""
+    ext = get_img_extension(path)
+    return "svg+xml" if ext == "svg" else ext
+
+
 def get_img_extension(path: str) -> str:
     """
     Parse the path and return the image's extension (replacing jpg to jpeg with accordance with EPUB spec)
@@ -0,0 +1,283 @@
+"""
+Lifecycle management of the mercury-parser-api Docker containers
+
+Instead of starting fresh containers for every run and removing them afterwards, healthy running containers are reused
+(whether they were started by r2k or by the user), and containers started by r2k are kept warm between runs. They're
+only stopped once they've been idle for longer than the configured timeout (checked by the following runs).
+Processes that use the containers hold a lease on them, so that they aren't stopped under a long running process.
+Several replicas (on consecutive ports) can be run, so that articles are parsed concurrently.
+Alternatively, already running Mercury-compatible endpoints can be configured, in which case Docker isn't used at all
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import TYPE_CHECKING, List, Optional, Set
+
+from requests.exceptions import RequestException
+
+from r2k import http_client
+from r2k.cli import logger
+from r2k.config import config
+from r2k.constants import DEFAULT_MERCURY_LEASES_DIR, DEFAULT_MERCURY_STAMP_PATH
+
+if TYPE_CHECKING:
+    import docker
+    from docker.models.containers import Container
+
+MERCURY_IMAGE = "wangqiru/mercury-parser-api:latest"
+MERCURY_PORT = 3000
+# Label of the containers started by r2k, so containers supplied by the user are never stopped by r2k
+MANAGED_LABEL = "r2k.managed"
+# Bounds (in seconds) of the delay between readiness checks
+MIN_READINESS_DELAY = 0.25
+MAX_READINESS_DELAY = 2
+# (connect, read) timeouts of a single readiness check
+READINESS_TIMEOUT = (1, 5)
+
+_client: Optional[docker.DockerClient] = None
+
+
+class MercuryUnavailableError(Exception):
+    """Raised when the Mercury parser API didn't become ready in time"""
+
+    def __init__(self, url: str, errors: Set[str]) -> None:
+        """Constructor"""
+        super().__init__(f"Could not connect to the Mercury parser at {url}")
+        self.errors = errors
+
+
+def get_client() -> docker.DockerClient:
+    """Create the Docker client on first use, so endpoints that don't need Docker don't require it"""
+    global _client
+    if not _client:
+        import docker
+
+        _client = docker.from_env()
+    return _client
+
+
+def is_docker_error(error: BaseException) -> bool:
+    """Return True if the error was raised by the Docker client (without requiring the docker module to be installed)"""
+    try:
+        from docker.errors import DockerException
+    except ModuleNotFoundError:
+        return False
+    return isinstance(error, DockerException)
+
+
+def is_ready(url: str) -> bool:
+    """
+    Return True if the Mercury API responds (with any status) on the URL
+
+    The API isn't expected to respond while it starts, so its failures aren't tracked by the host health
+    """
+    try:
+        http_client.get(url, track_health=False, timeout=READINESS_TIMEOUT)
+        return True
+    except RequestException:
+        return False
+
+
+def wait_until_ready(url: str, timeout: float) -> None:
+    """Poll the Mercury API with an exponential backoff until it responds, or until the timeout (in seconds) passes"""
+    errors = set()
+    deadline = time.monotonic() + timeout
+    delay = MIN_READINESS_DELAY
+    logger.debug(f"Validating the Mercury parser at {url} is up...")
+    while True:
+        try:
+            http_client.get(url, track_health=False, timeout=READINESS_TIMEOUT)
+            logger.debug(f"Connected to {url}")
+            return
+        except RequestException as e:
+            errors.add(str(e))
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise MercuryUnavailableError(url, errors)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, MAX_READINESS_DELAY)
+
+
+def get_configured_urls() -> List[str]:
+    """Return the already running Mercury endpoints from the config (comma separated)"""
+    return [url.strip() for url in config.mercury_url.split(",") if url.strip()]
+
+
+def get_replicas() -> List[MercuryContainer]:
+    """
+    Return the configured number of container replicas
+
+    The first one keeps the original name and port, so existing containers (and the user's own) are reused
+    """
+    replicas = max(config.mercury_replicas, 1)
+    names = [config.mercury_container] + [f"{config.mercury_container}-{i}" for i in range(1, replicas)]
+    return [MercuryContainer(name, MERCURY_PORT + i) for i, name in enumerate(names)]
+
+
+class MercuryContainer:
+    """A local mercury-parser-api Docker container, which is reused if it's already running"""
+
+    def __init__(self, name: str, port: int = MERCURY_PORT) -> None:
+        """Constructor"""
+        self.name = name
+        self.port = port
+
+    @property
+    def url(self) -> str:
+        """The parser endpoint of the container"""
+        return f"http://localhost:{self.port}/parser"
+
+    def acquire(self) -> str:
+        """Make sure the container is up, reusing it if it's already running, and return its URL"""
+        container = self.find_container()
+        if container and container.status == "running" and is_ready(self.url):
+            logger.debug(f"Reusing the running `{self.name}` container")
+            return self.url
+
+        if container:
+            self.start_or_remove(container)
+        else:
+            self.run_container()
+        wait_until_ready(self.url, config.mercury_startup_timeout)
+        return self.url
+
+    def find_container(self) -> Optional[Container]:
+        """Return the container with this name, if it exists"""
+        containers = get_client().containers.list(all=True, filters={"name": f"^/{self.name}$"})
+        return containers[0] if containers else None
+
+    def start_or_remove(self, container: Container) -> None:
+        """
+        Start a stopped container. Replace a running container that doesn't respond with a new one
+
+        Only containers started by r2k are replaced. A container of the user's that doesn't respond may still be
+        starting, so it's waited on instead, and it's an error if it never responds
+        """
+        if container.status != "running":
+            logger.debug(f"Starting the existing `{self.name}` container...")
+            container.start()
+            return
+
+        if MANAGED_LABEL not in container.labels:
+            logger.debug(f"The `{self.name}` container doesn't respond yet. Waiting for it...")
+            try:
+                wait_until_ready(self.url, config.mercury_startup_timeout)
+            except MercuryUnavailableError as e:
+                e.errors.add(
+                    f"The `{self.name}` container wasn't started by r2k, so it isn't replaced. "
+                    f"Restart it, or remove it to let r2k start its own"
+                )
+                raise
+            return
+
+        logger.debug(f"The `{self.name}` container doesn't respond. Replacing it...")
+        remove_container(container)
+        self.run_container()
+
+    def run_container(self) -> Container:
+        """Launch a new mercury-parser docker container"""
+        logger.debug(f"Launching a new mercury-parser Docker container on port {self.port}...")
+        return get_client().containers.run(
+            MERCURY_IMAGE,
+            detach=True,
+            ports={f"{MERCURY_PORT}/tcp": self.port},
+            name=self.name,
+            labels={MANAGED_LABEL: "true"},
+        )
+
+
+def remove_container(container: Container) -> None:
+    """Stop and remove a docker container"""
+    logger.debug("Stopping container...")
+    container.stop()
+    logger.debug("Removing container...")
+    container.remove()
+
+
+def touch_stamp() -> None:
+    """Record that the containers were just used"""
+    os.makedirs(os.path.dirname(DEFAULT_MERCURY_STAMP_PATH), exist_ok=True)
+    with open(DEFAULT_MERCURY_STAMP_PATH, "a"):
+        os.utime(DEFAULT_MERCURY_STAMP_PATH)
+
+
+def acquire_lease() -> None:
+    """Record that this process uses the containers, so that other runs don't stop them while it's idle"""
+    os.makedirs(DEFAULT_MERCURY_LEASES_DIR, exist_ok=True)
+    with open(os.path.join(DEFAULT_MERCURY_LEASES_DIR, str(os.getpid())), "w"):
+        pass
+
+
+def release_lease() -> None:
+    """Record that this process doesn't use the containers anymore"""
+    try:
+        os.remove(os.path.join(DEFAULT_MERCURY_LEASES_DIR, str(os.getpid())))
+    except FileNotFoundError:
+        pass
+
+
+def is_leased() -> bool:
+    """Whether any running process uses the containers. The leases of processes that are gone are removed"""
+    try:
+        names = os.listdir(DEFAULT_MERCURY_LEASES_DIR)
+    except FileNotFoundError:
+        return False
+
+    leased = False
+    for name in names:
+        try:
+            os.kill(int(name), 0)
+        except ProcessLookupError:
+            try:
+                os.remove(os.path.join(DEFAULT_MERCURY_LEASES_DIR, name))
+            except FileNotFoundError:
+                pass
+            continue
+        except PermissionError:
+            # The process exists, it just belongs to someone else
+            pass
+        except ValueError:
+            continue
+        leased = True
+    return leased
+
+
+def get_idle_seconds() -> Optional[float]:
+    """Return the time since the containers were last used, or None if they were never used"""
+    try:
+        return time.time() - os.path.getmtime(DEFAULT_MERCURY_STAMP_PATH)
+    except OSError:
+        return None
+
+
+def stop_if_idle() -> int:
+    """Stop and remove the containers r2k started if they've been idle for too long. Return the number of containers"""
+    idle_seconds = get_idle_seconds()
+    # Nothing was ever started (or it was already stopped), so there's no need to talk to Docker
+    if idle_seconds is None or idle_seconds < config.mercury_idle_timeout_minutes * 60:
+        return 0
+
+    # A long running process (e.g. `kindle serve`) keeps its containers, no matter how long ago it last used them
+    if is_leased():
+        logger.debug("The Mercury containers are in use by another r2k process")
+        return 0
+
+    logger.debug(f"The Mercury containers have been idle for {idle_seconds / 60:.0f} minutes")
+    containers = get_client().containers.list(all=True, filters={"label": MANAGED_LABEL})
+    for container in containers:
+        remove_container(container)
+    os.remove(DEFAULT_MERCURY_STAMP_PATH)
+    return len(containers)
+
+
+def stop_idle_containers() -> None:
+    """Stop the Mercury containers if they've been idle for too long (a no-op if Docker isn't used or available)"""
+    try:
+        if stopped := stop_if_idle():
+            logger.debug(f"Stopped {stopped} idle Mercury containers")
+    except Exception as e:
+        if not is_docker_error(e) and not isinstance(e, ModuleNotFoundError):
+            raise
+        logger.debug(f"Could not stop the idle Mercury containers: {e}")
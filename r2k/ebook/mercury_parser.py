@@ -1,78 +1,55 @@
 from __future__ import annotations
 
 import sys
-from time import sleep
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from types import TracebackType
-from typing import Optional, Type
+from typing import List, Optional, Set, Type
 
-import docker
-import requests
-from docker.errors import APIError as DockerAPIError
-from docker.models.containers import Container
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
 
-from r2k.cli import logger
+from r2k import http_client
+from r2k.cli import cli_utils, logger
+from r2k.config import config
 
-from .base_parser import ParserBase
-
-CONTAINER_NAME = "mercury-parser-api"
-MERCURY_PORT = 3000
-BASE_MERCURY_URL = f"http://localhost:{MERCURY_PORT}/parser"
-CONNECTION_ATTEMPTS = 10
+from . import mercury_container
+from .base_parser import ParserBase, ParserCapabilities
+from .mercury_container import MercuryUnavailableError, is_docker_error
 
 
 class MercuryParser(ParserBase):
     """
     Represents the gateway to the Mercury Parser API
 
-    Relies on https://hub.docker.com/r/wangqiru/mercury-parser-api
+    Relies on https://hub.docker.com/r/wangqiru/mercury-parser-api (or on configured Mercury-compatible endpoints).
+    Requests are spread over all the replicas/endpoints round robin, and an endpoint that can't be reached fails over
+    to the next one
     """
 
+    capabilities = ParserCapabilities(thread_safe=True)
+
     def __init__(self) -> None:
         """Constructor"""
-        self.container: Optional[Container] = None
-        self.client: docker.DockerClient = docker.from_env()
-
-    def run_mercury_container(self) -> Container:
-        """Launch a new mercury-parser docker container"""
-        logger.debug("Launching a new mercury-parser Docker container...")
-        self.container = self.client.containers.run(
-            "wangqiru/mercury-parser-api:latest",
-            detach=True,
-            ports={f"{MERCURY_PORT}/tcp": MERCURY_PORT},
-            name=CONTAINER_NAME,
-        )
-        return self.container
-
-    def clean_existing_containers(self) -> None:
-        """Remove any existing mercury parser API containers"""
-        all_containers = self.client.containers.list(all=True, sparse=True)
-        for container in all_containers:
-            if container.attrs["Names"] == [f"/{CONTAINER_NAME}"]:
-                logger.debug("Found an existing container with the same name...")
-                self.remove_container(container)
-
-    def remove_container(self, container: Optional[Container] = None) -> None:
-        """Stop and remove a docker container"""
-        container = container or self.container
-        if container:
-            logger.debug("Stopping container...")
-            container.stop()
-            logger.debug("Removing container...")
-            container.remove()
+        self.endpoints: List[str] = []
+        self._next_endpoint = 0
+        self._lock = threading.Lock()
 
     def __enter__(self) -> MercuryParser:
         """
         Context manager __enter__ for MercuryParser
 
-            1. Clean any existing containers
-            2. Spin a local, dockerized version of the mercury parser API
-            3. Validate it's up
-            4. Return the MercuryParser instance
+            1. Reuse the running mercury parser APIs (or spin local, dockerized versions of them) concurrently
+            2. Validate they're up
+            3. Return the MercuryParser instance
         """
-        self.clean_existing_containers()
-        self.run_mercury_container()
-        self.validate_container_is_up()
+        try:
+            self.endpoints = self.acquire_endpoints()
+        except MercuryUnavailableError as e:
+            logger.error(str(e))
+            if e.errors:
+                errors_str = "\n".join(e.errors)
+                logger.error(f"Error info:\n{errors_str}")
+            sys.exit(1)
         return self
 
     def __exit__(
@@ -81,13 +58,17 @@ class MercuryParser(ParserBase):
         """
         Context manager __exit__ for MercuryParser
 
-            1. Remove the container
+            1. Release the containers (they're kept warm for the next run, until they're idle for too long)
             2. Stop the program for any expected errors
         """
-        self.remove_container()
+        mercury_container.release_lease()
+        if not config.mercury_url:
+            mercury_container.touch_stamp()
+            if config.mercury_idle_timeout_minutes <= 0:
+                mercury_container.stop_idle_containers()
 
         if exc_val:
-            if isinstance(exc_val, (DockerAPIError, ConnectionError)):
+            if isinstance(exc_val, ConnectionError) or is_docker_error(exc_val):
                 logger.error("Could not connect to Docker. Run with -v to get more details")
                 logger.debug(f"Error info:\n{exc_val}")
                 sys.exit(1)
@@ -95,31 +76,67 @@ class MercuryParser(ParserBase):
                 raise exc_val
         return True
 
+    @classmethod
+    def get_missing_requirements(cls) -> Optional[str]:
+        """Docker is needed, unless already running endpoints are used"""
+        if config.mercury_url:
+            return None
+        try:
+            import docker  # noqa
+        except ModuleNotFoundError:
+            return (
+                "The `docker` module is not installed, but is required to use the `mercury` parser\n"
+                "Consider either switching to a different parser (by running `r2k config set -k parser --force`)\n"
+                "Or install the optional `docker` library by running `pip install 'r2k[docker]'`"
+            )
+        return None
+
     @staticmethod
-    def validate_container_is_up() -> None:
-        """Try to connect to the mercury parser service several times. Quit app if not successful"""
-        errors = set()
-        logger.debug(f"Launched container at {BASE_MERCURY_URL}. Validating it's up...")
-        while retries := CONNECTION_ATTEMPTS:
+    def acquire_endpoints() -> List[str]:
+        """Return the URLs of the configured endpoints, or of the local containers (after making sure all are up)"""
+        if urls := mercury_container.get_configured_urls():
+            return MercuryParser.get_ready_urls(urls)
+
+        # Taken before the containers are started, so that a concurrent run doesn't stop them as idle meanwhile
+        mercury_container.acquire_lease()
+        replicas = mercury_container.get_replicas()
+        acquire = cli_utils.in_current_context(lambda replica: replica.acquire())
+        with ThreadPoolExecutor(len(replicas)) as executor:
+            endpoints = list(executor.map(acquire, replicas))
+        mercury_container.touch_stamp()
+        return endpoints
+
+    @staticmethod
+    def get_ready_urls(urls: List[str]) -> List[str]:
+        """Wait for all the configured endpoints concurrently, and return those that are up (at least one has to be)"""
+        wait = cli_utils.in_current_context(mercury_container.wait_until_ready)
+        with ThreadPoolExecutor(len(urls)) as executor:
+            futures = [executor.submit(wait, url, config.mercury_startup_timeout) for url in urls]
+
+        ready_urls = []
+        error: Optional[MercuryUnavailableError] = None
+        for url, future in zip(urls, futures):
             try:
-                requests.get(BASE_MERCURY_URL)
-                logger.debug("Connected!")
-                return
-            except ConnectionError as e:
-                errors.add(e)
-            sleep(1)
-            retries -= 1
-
-        logger.error("Could not connect to the mercury-parser Docker container")
-        if errors:
-            errors_str = "\n".join(str(error) for error in errors)
-            logger.error(f"Error info:{errors_str}")
-        sys.exit(1)
+                future.result()
+                ready_urls.append(url)
+            except MercuryUnavailableError as e:
+                logger.warning(f"{e}. Not using it")
+                error = e
+        if not ready_urls and error:
+            raise error
+        return ready_urls
+
+    def get_concurrency(self) -> int:
+        """Mercury runs in Node, and handles several parallel requests per endpoint well"""
+        return len(self.endpoints) * max(config.mercury_requests_per_endpoint, 1)
 
     def parse(self, url: str) -> dict:
         """
         Parse a single URL with the Mercury Parser and return the result
+
+        Mercury downloads the article itself, so URLs that failed recently (or whose host is down) are skipped here
         """
+        http_client.check_health(url)
         result = self.get_parsed_doc(url)
         if result.get("error"):
             error_msg = result.get("message", "Unknown")
@@ -127,12 +144,31 @@ class MercuryParser(ParserBase):
             return {}
         return result
 
-    @staticmethod
-    def get_parsed_doc(url: str) -> dict:
-        """Make an HTTP call to the mercury API and get the parsed document"""
-        full_url = f"{BASE_MERCURY_URL}?url={url}"
+    def get_endpoints_order(self) -> List[str]:
+        """Return all the endpoints, starting with the next one in the round robin"""
+        with self._lock:
+            start = self._next_endpoint
+            self._next_endpoint = (start + 1) % len(self.endpoints)
+        return self.endpoints[start:] + self.endpoints[:start]
+
+    def get_parsed_doc(self, url: str) -> dict:
+        """
+        Make an HTTP call to the mercury API and get the parsed document, failing over to the other endpoints
+
+        Raises `MercuryUnavailableError` if none of the endpoints could be reached
+        """
         logger.debug("Parsing article with Mercury Parser...")
-        logger.debug(f"Sending request to {full_url}")
-        result = requests.get(full_url).json()
-        logger.debug("Finished parsing")
-        return result
+        timeout = (config.http_connect_timeout, config.mercury_timeout)
+        errors: Set[str] = set()
+        for endpoint in self.get_endpoints_order():
+            logger.debug(f"Sending request for {url} to {endpoint}")
+            try:
+                result = http_client.get(endpoint, track_health=False, params={"url": url}, timeout=timeout).json()
+            except (ConnectionError, Timeout) as e:
+                logger.debug(f"Mercury at {endpoint} failed: {e}")
+                errors.add(f"{endpoint}: {e}")
+                continue
+            logger.debug("Finished parsing")
+            return result
+
+        raise MercuryUnavailableError(", ".join(self.endpoints), errors)
@@ -0,0 +1,66 @@
+"""
+Discovery of the available article parsers
+
+Parsers are registered as `r2k.parsers` entry points (`name = "package.module:ParserClass"`), so parsers from other
+packages can be added without touching r2k. A parser's module is only imported when it's used, as some parsers depend
+on optional packages (e.g. docker). The built-in parsers are also known directly, for when r2k runs without being
+installed (e.g. from a source checkout)
+"""
+from functools import lru_cache
+from importlib import import_module
+from importlib.metadata import EntryPoint, entry_points
+from typing import Dict, Iterable, List, Optional, Type
+
+from r2k.config import config
+from r2k.constants import Parser
+
+from .base_parser import ParserBase
+
+ENTRY_POINT_GROUP = "r2k.parsers"
+
+BUILTIN_PARSERS = {
+    Parser.READABILITY.value: "r2k.ebook.readability_parser:ReadabilityParser",
+    Parser.MERCURY.value: "r2k.ebook.mercury_parser:MercuryParser",
+}
+
+
+@lru_cache(maxsize=None)
+def get_registered_parsers() -> Dict[str, str]:
+    """Return the "module:Class" references of all the parsers, by name"""
+    parsers = dict(BUILTIN_PARSERS)
+    all_entry_points = entry_points()
+    group: Iterable[EntryPoint]
+    if hasattr(all_entry_points, "select"):
+        group = all_entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        # Before Python 3.10 the entry points are grouped in a dict
+        group = all_entry_points.get(ENTRY_POINT_GROUP) or []
+    parsers.update({entry_point.name: entry_point.value for entry_point in group})
+    return parsers
+
+
+def get_parser_names() -> List[str]:
+    """Return the names of all the parsers (not including PushToKindle, which isn't a local parser)"""
+    return list(get_registered_parsers())
+
+
+def get_parser_class(name: Optional[str] = None) -> Type[ParserBase]:
+    """Return the class of a parser (the configured one by default)"""
+    return _import_parser_class(name or get_configured_parser_name())
+
+
+@lru_cache(maxsize=None)
+def _import_parser_class(name: str) -> Type[ParserBase]:
+    """Import the module of a parser, and return the parser's class"""
+    try:
+        reference = get_registered_parsers()[name]
+    except KeyError:
+        raise ValueError(f"Parser must be one of: {get_parser_names()}")
+
+    module_name, _, class_name = reference.partition(":")
+    return getattr(import_module(module_name), class_name)
+
+
+def get_configured_parser_name() -> str:
+    """Return the name of the configured parser"""
+    return Parser(config.parser).value if isinstance(config.parser, Parser) else config.parser
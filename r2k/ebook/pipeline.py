@@ -0,0 +1,138 @@
+"""
+A two stage pipeline for processing the articles of a book
+
+Stage 1 downloads the article pages asynchronously (many downloads in flight at once), and stage 2 extracts the
+content of the downloaded pages (CPU bound, so it runs in worker processes when the parser allows it). The stages are
+joined by a bounded queue, so downloads overlap with extraction, while the number of pages held in memory at any given
+time stays bounded
+"""
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple, Type
+
+from r2k import http_client
+from r2k.cli import cli_utils, logger
+from r2k.config import config
+from r2k.host_health import host_health
+
+from .article_cache import article_cache
+from .base_parser import ParserBase
+
+if TYPE_CHECKING:
+    from .epub_builder import EPUBArticle
+
+ArticleResult = Tuple[bool, "EPUBArticle"]
+
+# The parser of a worker process, when articles are extracted in worker processes
+_worker_parser: Optional[ParserBase] = None
+
+
+def _init_worker(
+    parser_cls: Type[ParserBase], config_dict: dict, article_cache_enabled: bool, host_health_enabled: bool
+) -> None:
+    """
+    Set up a worker process the way the parent process is set up, and create its parser
+
+    Under the spawn and forkserver start methods workers don't inherit the parent's state, so the loaded config and
+    the caches' flags (e.g. --no-cache) are passed explicitly. They're set directly in `__dict__`, so that the worker
+    never saves the config. Process safe parsers have nothing to clean up, so the parser is never exited
+    """
+    global _worker_parser
+    config.__dict__.update({key: value for key, value in config_dict.items() if not key.startswith("_")})
+    article_cache.enabled = article_cache_enabled
+    host_health.enabled = host_health_enabled
+    _worker_parser = parser_cls().__enter__()
+
+
+def _extract_in_worker(article: EPUBArticle, html: Optional[str]) -> ArticleResult:
+    """Extract an article in a worker process, and return it (as the parent process only has the original copy)"""
+    assert _worker_parser
+    return article.parse(_worker_parser, html), article
+
+
+class ArticlePipeline:
+    """Fetch the articles' pages concurrently, and extract their content in parallel as soon as they arrive"""
+
+    def __init__(self, parser: ParserBase, processes: int) -> None:
+        """Constructor"""
+        self.parser = parser
+        self.processes = processes
+        self.fetch_concurrency = config.article_fetch_concurrency
+        # Enough to keep all the extraction workers busy, without piling up downloaded pages in memory
+        self.queue_size = 2 * max(processes, 1)
+
+    def run(self, articles: List[EPUBArticle]) -> List[ArticleResult]:
+        """Process all the articles, and return whether each one succeeded, along with the (parsed) article"""
+        logger.debug(f"Processing {len(articles)} articles ({self.processes} extraction processes)...")
+        with ThreadPoolExecutor(self.fetch_concurrency, thread_name_prefix="r2k-page") as fetch_executor:
+            with self.create_extract_executor() as extract_executor:
+                return asyncio.run(self.process(articles, fetch_executor, extract_executor))
+
+    def create_extract_executor(self) -> Executor:
+        """Extract in worker processes if the parser allows it, or in a single background thread otherwise"""
+        if self.processes > 1 and self.parser.capabilities.process_safe:
+            initargs = (type(self.parser), config.as_dict(), article_cache.enabled, host_health.enabled)
+            return ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=initargs)
+        return ThreadPoolExecutor(1, thread_name_prefix="r2k-extract")
+
+    def extract_locally(self, article: EPUBArticle, html: Optional[str]) -> ArticleResult:
+        """Extract an article with the pipeline's own parser"""
+        return article.parse(self.parser, html), article
+
+    async def process(
+        self, articles: List[EPUBArticle], fetch_executor: Executor, extract_executor: Executor
+    ) -> List[ArticleResult]:
+        """Run both stages of the pipeline until all the articles were processed"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+        results: List[ArticleResult] = [(False, article) for article in articles]
+        fetch = cli_utils.in_current_context(self.parser.fetch)
+        if isinstance(extract_executor, ProcessPoolExecutor):
+            extract = _extract_in_worker
+        else:
+            extract = cli_utils.in_current_context(self.extract_locally)
+
+        async def fetch_stage(index: int, article: EPUBArticle) -> None:
+            if article_cache.has(article.url, self.parser):
+                # Nothing to download. The extraction stage will take the parsed article from the cache
+                await queue.put((index, article, None))
+                return
+            if article.html is not None:
+                # Already downloaded
+                await queue.put((index, article, article.html))
+                return
+
+            # The semaphore is only released after the page was queued, so that blocking on a full queue also stops
+            # new downloads from starting
+            async with semaphore:
+                try:
+                    html = await loop.run_in_executor(fetch_executor, fetch, article.url)
+                except http_client.DownloadError as e:
+                    logger.error(f"Failed to download `{article.title}`: {e.reason}. Skipping it")
+                    return
+                except Exception as e:
+                    logger.error(f"Failed to download `{article.title}`. Skipping it")
+                    logger.debug(f"Error info:\n{e}")
+                    return
+                await queue.put((index, article, html))
+
+        async def extract_stage() -> None:
+            while True:
+                index, article, html = await queue.get()
+                try:
+                    results[index] = await loop.run_in_executor(extract_executor, extract, article, html)
+                except Exception as e:
+                    logger.error(f"Failed to parse `{article.title}`. Skipping it")
+                    logger.debug(f"Error info:\n{e}")
+                finally:
+                    queue.task_done()
+
+        extractors = [asyncio.create_task(extract_stage()) for _ in range(max(self.processes, 1))]
+        await asyncio.gather(*(fetch_stage(index, article) for index, article in enumerate(articles)))
+        await queue.join()
+        for extractor in extractors:
+            extractor.cancel()
+        return results
@@ -4,11 +4,8 @@ from types import TracebackType
 from typing import Optional, Type
 
 from readability import Document
-from requests import get
 
-from r2k.constants import HTML_HEADERS
-
-from .base_parser import ParserBase
+from .base_parser import ParserBase, ParserCapabilities
 
 
 class ReadabilityParser(ParserBase):
@@ -16,6 +13,8 @@ class ReadabilityParser(ParserBase):
     Parser that uses the readability module
     """
 
+    capabilities = ParserCapabilities(splits_fetch=True, process_safe=True)
+
     def __enter__(self) -> ReadabilityParser:
         """Nothing to do here"""
         return self
@@ -28,8 +27,9 @@ class ReadabilityParser(ParserBase):
 
     def parse(self, url: str) -> dict:
         """Download the article and parse it"""
-        r = get(url, headers=HTML_HEADERS)
-        doc = Document(r.text, url=url)
-        html = doc.summary(html_partial=True)
-        clean_html = self.fix_blockquotes(html)
-        return {"content": clean_html}
+        return self.extract(url, self.fetch(url))
+
+    def extract(self, url: str, html: str) -> dict:
+        """Parse an already downloaded article"""
+        doc = Document(html, url=url)
+        return {"content": doc.summary(html_partial=True)}
@@ -1,8 +1,75 @@
+import codecs
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
 import requests
-from bs4 import BeautifulSoup
 
+from r2k import http_client
+from r2k.config import config
+from r2k.constants import Parser
 from r2k.feeds import Article
 
+from . import parser_registry
+
+# The page is scanned in chunks of this size, so that the scan stops shortly after the end of the <head>
+SCAN_CHUNK_SIZE = 4096
+
+
+class HeadParser(HTMLParser):
+    """Read the title and the author from the <head> of a page, without building a tree"""
+
+    def __init__(self) -> None:
+        """Constructor"""
+        super().__init__()
+        self.title: Optional[str] = None
+        self.author: Optional[str] = None
+        # Set once the <head> is over, as the rest of the page doesn't need to be scanned
+        self.done = False
+        self._title_parts: Optional[List[str]] = None
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        """Start collecting the title, or read the author from its <meta>"""
+        if tag == "body":
+            self.done = True
+        elif tag == "title" and self.title is None:
+            self._title_parts = []
+        elif tag == "meta":
+            meta = dict(attrs)
+            content = (meta.get("content") or "").strip()
+            if (meta.get("name") or "").lower() == "author" and content:
+                self.author = content
+
+    def handle_endtag(self, tag: str) -> None:
+        """Finish collecting the title, or stop at the end of the <head>"""
+        if tag == "head":
+            self.done = True
+        elif tag == "title" and self._title_parts is not None:
+            self.title = "".join(self._title_parts).strip()
+            self._title_parts = None
+
+    def handle_data(self, data: str) -> None:
+        """Collect the title's text"""
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def scan_chunk(self, response: requests.Response, chunk: bytes) -> bool:
+        """Feed a chunk of the page as it's downloaded, and return True once the end of the <head> was reached"""
+        if self._decoder is None:
+            try:
+                self._decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+            except LookupError:
+                self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.feed(self._decoder.decode(chunk))
+        return self.done
+
+    def scan(self, html: str) -> None:
+        """Feed the page in chunks, until the end of the <head>"""
+        for start in range(0, len(html), SCAN_CHUNK_SIZE):
+            self.feed(html[start : start + SCAN_CHUNK_SIZE])
+            if self.done:
+                break
+
 
 class SingleArticle(Article):
     """Represents a single (i.e. not part of a feed) article for sending it to kindle"""
@@ -10,23 +77,23 @@ class SingleArticle(Article):
     def __init__(self, url: str) -> None:
         """Constructor"""
         super().__init__({"link": url})
-        reqs = requests.get(self.link)
-        self._soup = BeautifulSoup(reqs.text, "html.parser")
+        head = HeadParser()
+        if keeps_page():
+            # The downloaded page is kept, so that the parser extracts the content from it instead of downloading it
+            # again. Set as items and not attributes, as that's how the EPUB builder reads articles (`get("html")`)
+            self["html"] = http_client.download(self.link, config.max_page_size_mb).text
+            head.scan(self["html"])
+        else:
+            # The parser (or PushToKindle) downloads the page itself, so only the <head> is downloaded here
+            http_client.download(self.link, config.max_page_size_mb, until=head.scan_chunk)
 
-        self.set_title()
-        self.set_author()
+        self["title"] = head.title or self.link.strip()
+        if head.author:
+            self["author"] = head.author
 
-    def set_title(self) -> None:
-        """Set the article's title"""
-        titles = self._soup.find_all("title")
-        if titles:
-            self.title = titles[0].get_text().strip()
-        else:
-            self.title = self.link.strip()
-
-    def set_author(self) -> None:
-        """Set the article's author"""
-        metas = self._soup.find_all("meta")
-        for meta in metas:
-            if meta.attrs.get("name") == "author":
-                self.author = meta.attrs.get("content").strip()
+
+def keeps_page() -> bool:
+    """Whether the configured parser can extract an article from a page that was already downloaded"""
+    if config.parser == Parser.PUSH_TO_KINDLE:
+        return False
+    return parser_registry.get_parser_class().capabilities.splits_fetch
@@ -7,6 +7,11 @@ from r2k.cli import logger
 from .config import config
 from .unicode import strip_common_unicode_chars
 
+BYTES_IN_MB = 1024 * 1024
+
+# Attachments are base64 encoded (4 characters per 3 bytes), in lines of 76 characters that end with CRLF
+BASE64_LINE_LENGTH = 76
+
 
 def build_basic_message(title: str) -> EmailMessage:
     """Create the most basic email message"""
@@ -28,22 +33,22 @@ def send_email_message(server: smtplib.SMTP, msg: EmailMessage) -> bool:
         return False
 
 
-def send_email_messages(msgs: List[EmailMessage]) -> int:
-    """Send an email"""
-    messages_sent = 0
+def send_email_messages(msgs: List[EmailMessage]) -> List[bool]:
+    """Send emails, and return whether each one of them was sent"""
+    results = [False] * len(msgs)
     try:
         logger.debug("Connecting to SMTP...")
         with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
             server.ehlo()
             logger.debug("Logging into the SMTP server...")
             server.login(config.send_from, config.password)
-            for msg in msgs:
+            for i, msg in enumerate(msgs):
                 if send_email_message(server, msg):
-                    messages_sent += 1
+                    results[i] = True
                     logger.debug("Email sent successfully!")
     except smtplib.SMTPException as e:
         logger.error(f"Caught an exception while trying to send an email.\nError: {e}")
-    return messages_sent
+    return results
 
 
 def set_content(msg: EmailMessage, title: str, url: Optional[str], attachment_path: Optional[str]) -> None:
@@ -71,14 +76,20 @@ def create_email_message(title: str, url: Optional[str], attachment_path: Option
     return msg
 
 
-def send_epub(title: str, epub_path: str) -> int:
+def get_max_attachment_size() -> int:
+    """Return the size (in bytes) of the largest file that fits in `max_attachment_size_mb` once it's attached"""
+    max_encoded_size = config.max_attachment_size_mb * BYTES_IN_MB
+    return max_encoded_size * BASE64_LINE_LENGTH // (BASE64_LINE_LENGTH + 2) * 3 // 4
+
+
+def send_epub(title: str, epub_path: str) -> bool:
     """Send an epub book over email"""
     msg = create_email_message(title, None, epub_path)
-    return send_email_messages([msg])
+    return send_email_messages([msg])[0]
 
 
-def send_urls(articles: List[Tuple[str, str]]) -> int:
-    """Send a list of URLs to Kindle (via pushtokindle)"""
+def send_urls(articles: List[Tuple[str, str]]) -> List[bool]:
+    """Send a list of URLs to Kindle (via pushtokindle), and return whether each one of them was sent"""
     msgs = []
     for title, url in articles:
         msgs.append(create_email_message(title, url, None))
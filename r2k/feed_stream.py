@@ -0,0 +1,160 @@
+"""
+Incremental parsing of RSS/Atom feeds
+
+Used instead of feedparser when only the newest entries of a feed are of interest: the feed is read entry by entry
+(newest first), and the download stops as soon as an already read entry is reached. This way memory and CPU scale with
+the number of new entries, instead of with the size of the whole feed
+"""
+import re
+from io import BytesIO
+from typing import Callable, Iterator, List, Optional
+from urllib.parse import urljoin
+
+import feedparser
+from lxml import etree
+from requests import Response
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+RSS1_NS = "{http://purl.org/rss/1.0/}"
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+RDF_NS = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+SY_NS = "{http://purl.org/rss/1.0/modules/syndication/}"
+
+ENTRY_TAGS = ("item", f"{RSS1_NS}item", f"{ATOM_NS}entry")
+# Feed level elements with polling hints, mapped to the keys feedparser uses for them
+HINT_TAGS = {"ttl": "ttl", f"{SY_NS}updatePeriod": "sy_updateperiod", f"{SY_NS}updateFrequency": "sy_updatefrequency"}
+SKIP_HOURS_TAG = "skipHours"
+SKIP_HOURS_RE = re.compile(rb"<skipHours>(.*?)</skipHours>", re.DOTALL)
+HOUR_RE = re.compile(rb"<hour>\s*(\d+)\s*</hour>")
+
+# Read the body in large chunks, as lxml's parser is fed directly from the socket
+READ_SIZE = 64 * 1024
+
+
+class RecordingReader:
+    """A file-like wrapper that keeps a copy of everything that was read, so the body can be reparsed on errors"""
+
+    def __init__(self, raw: Response) -> None:
+        """Constructor"""
+        self._raw = raw.raw
+        self._raw.decode_content = True
+        self.data = bytearray()
+
+    def read(self, size: int = READ_SIZE) -> bytes:
+        """Read from the underlying response and record the result"""
+        chunk = self._raw.read(size)
+        self.data += chunk
+        return chunk
+
+    def read_all(self) -> bytes:
+        """Read whatever is left in the response, and return the full body"""
+        while self.read():
+            pass
+        return bytes(self.data)
+
+
+def parse_until(response: Response, stop_at: Callable[[feedparser.FeedParserDict], bool]) -> feedparser.FeedParserDict:
+    """
+    Parse entries from a streamed feed response until `stop_at` returns True for one of them
+
+    The entry `stop_at` returned True for is included in the result (so it can be refreshed in the seen index), but
+    nothing after it is downloaded. If the feed isn't well-formed XML, fall back to a full feedparser parse.
+    Relative links are resolved against the URL the feed was fetched from (after redirects), like feedparser does
+    """
+    reader = RecordingReader(response)
+    feed_info = feedparser.FeedParserDict()
+    entries = []
+    try:
+        for entry in iter_entries(reader, feed_info, response.url):
+            entries.append(entry)
+            if stop_at(entry):
+                break
+    except etree.XMLSyntaxError:
+        response_headers = {**response.headers, "content-location": response.url}
+        return feedparser.parse(BytesIO(reader.read_all()), response_headers=response_headers)
+    return feedparser.FeedParserDict(feed=feed_info, entries=entries)
+
+
+def iter_entries(
+    source: RecordingReader, feed_info: feedparser.FeedParserDict, base_url: str
+) -> Iterator[feedparser.FeedParserDict]:
+    """
+    Yield the entries of an RSS/Atom feed one by one, in document order
+
+    Any polling hints found along the way (which usually come before the entries) are set in `feed_info`, and
+    relative links are resolved against `base_url` (or the xml:base in effect, if there is one)
+    """
+    tags = ENTRY_TAGS + tuple(HINT_TAGS) + (SKIP_HOURS_TAG,)
+    context = etree.iterparse(source, events=("end",), tag=tags, resolve_entities=False, huge_tree=True)
+    for _, elem in context:
+        if elem.tag in HINT_TAGS:
+            feed_info[HINT_TAGS[elem.tag]] = (elem.text or "").strip()
+            continue
+        if elem.tag == SKIP_HOURS_TAG:
+            feed_info["skip_hours"] = [int(hour) for hour in elem.itertext() if hour.strip().isdigit()]
+            continue
+
+        yield element_to_entry(elem, base_url)
+        # Free everything parsed so far, as we don't need it anymore
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def get_skip_hours(body: bytes) -> List[int]:
+    """
+    Return the hours listed in the feed's <skipHours> element (if any)
+
+    feedparser doesn't support this element, so this is a cheap scan of the raw body for fully parsed feeds
+    """
+    if match := SKIP_HOURS_RE.search(body):
+        return [int(hour) for hour in HOUR_RE.findall(match.group(1))]
+    return []
+
+
+def element_to_entry(elem: etree._Element, base_url: str) -> feedparser.FeedParserDict:
+    """Convert an <item>/<entry> element to a dict with the same keys feedparser would've used"""
+    entry = feedparser.FeedParserDict()
+    ns = ATOM_NS if elem.tag.startswith(ATOM_NS) else (RSS1_NS if elem.tag.startswith(RSS1_NS) else "")
+
+    if title := get_text(elem, f"{ns}title"):
+        entry["title"] = title
+    if link := get_link(elem, ns, base_url):
+        entry["link"] = link
+    if entry_id := get_text(elem, "guid") or get_text(elem, f"{ATOM_NS}id") or elem.get(f"{RDF_NS}about"):
+        entry["id"] = entry_id
+    if published := get_first_text(elem, "pubDate", f"{ATOM_NS}published", f"{DC_NS}date"):
+        entry["published"] = published
+    if updated := get_text(elem, f"{ATOM_NS}updated"):
+        entry["updated"] = updated
+    if author := get_first_text(elem, "author", f"{DC_NS}creator", f"{ATOM_NS}author/{ATOM_NS}name"):
+        entry["author"] = author
+    return entry
+
+
+def get_text(elem: etree._Element, path: str) -> Optional[str]:
+    """Return the stripped text of a child element (if it exists and isn't empty)"""
+    text = elem.findtext(path)
+    return text.strip() if text and text.strip() else None
+
+
+def get_first_text(elem: etree._Element, *paths: str) -> Optional[str]:
+    """Return the text of the first child element (out of `paths`) that has any"""
+    for path in paths:
+        if text := get_text(elem, path):
+            return text
+    return None
+
+
+def get_link(elem: etree._Element, ns: str, base_url: str) -> Optional[str]:
+    """Return the entry's absolute link. In Atom the link is an attribute of the (alternate) <link> element"""
+    for link in elem.iterfind(f"{ns}link"):
+        href = link.get("href") if ns == ATOM_NS else link.text
+        if ns == ATOM_NS and link.get("rel", "alternate") != "alternate":
+            continue
+        if href and href.strip():
+            # `base` is the xml:base in effect for the element, which may itself be relative to the feed's URL
+            return urljoin(urljoin(base_url, link.base or ""), href.strip())
+        if ns != ATOM_NS:
+            break
+    return None
@@ -1,40 +1,121 @@
 # from datetime import datetime, timedelta
-from typing import List, Optional
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Set
 
 import arrow
 import feedparser
 from pick import pick
 
-from .dates import get_pretty_date_str, parse_date
+from . import feed_stream, http_client
+from .dates import DateType, get_pretty_date_str, parse_date
+
+
+def fetch_feed(
+    feed_url: str,
+    etag: Optional[str] = None,
+    modified: Optional[str] = None,
+    stop_at: Optional[Callable[[feedparser.FeedParserDict], bool]] = None,
+) -> feedparser.FeedParserDict:
+    """
+    Download a feed with the shared HTTP client and parse it with feedparser
+
+    `etag` and `modified` are sent as conditional GET validators. On a 304 the body is not parsed at all, and the
+    result has no entries.
+    If `stop_at` is passed, the feed is parsed incrementally (see `feed_stream`) and the download stops at the first
+    entry for which `stop_at` returns True
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+
+    with http_client.get(feed_url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            result = feedparser.FeedParserDict(feed=feedparser.FeedParserDict(), entries=[])
+        elif stop_at and response.ok:
+            result = feed_stream.parse_until(response, stop_at)
+        else:
+            # Relative links are resolved against the URL the feed was actually downloaded from (after redirects)
+            response_headers = {**response.headers, "content-location": response.url}
+            result = feedparser.parse(BytesIO(response.content), response_headers=response_headers)
+            result.feed["skip_hours"] = feed_stream.get_skip_hours(response.content)
+
+    result["status"] = response.status_code
+    result["href"] = response.url
+    result["headers"] = dict(response.headers)
+    if response_etag := response.headers.get("ETag"):
+        result["etag"] = response_etag
+    if response_modified := response.headers.get("Last-Modified"):
+        result["modified"] = response_modified
+    return result
 
 
 class Article(feedparser.FeedParserDict):
     """Represents a single article in a feed"""
 
     def get_parsed_date(self: feedparser.FeedParserDict) -> arrow.Arrow:
-        """Return a datetime object parsed from the string date value"""
-        raw_date = self.get_raw_date()
-        return parse_date(raw_date)
+        """Return a datetime object parsed from the entry's date"""
+        return parse_date(self.get_date())
+
+    def get_date(self: feedparser.FeedParserDict) -> DateType:
+        """
+        Return the entry's date in the cheapest form available
+
+        That's the struct feedparser already parsed the date into, if it did, and the raw string date otherwise
+        """
+        if self.get("published"):
+            return self.get("published_parsed") or self["published"]
+        if self.get("updated"):
+            return self.get("updated_parsed") or self["updated"]
+        return self.get_raw_date()
 
     def get_raw_date(self: feedparser.FeedParserDict) -> str:
         """Return the raw string date as set up in the entry"""
         default = str(arrow.now().shift(days=-30))
         return self.get("published") or self.get("updated") or default
 
+    def get_key(self: feedparser.FeedParserDict) -> str:
+        """Return a key that uniquely identifies the article in its feed (for the seen index)"""
+        return self.get("id") or self.get("link") or self.get("title", "")
+
     def get_str_date(self: feedparser.FeedParserDict) -> str:
         """Return a nicely formatted string from the date in the entry"""
-        raw_date = self.get_raw_date()
-        return get_pretty_date_str(raw_date)
+        return get_pretty_date_str(self.get_date())
 
 
 class Feed(feedparser.FeedParserDict):
     """Represents a single, feedparser-parsed RSS feed"""
 
-    def __init__(self, feed_url: str, feed_title: str):
-        """Constructor"""
-        super().__init__(feedparser.parse(feed_url))
+    def __init__(
+        self,
+        feed_url: str,
+        feed_title: str,
+        etag: Optional[str] = None,
+        modified: Optional[str] = None,
+        stop_at: Optional[Callable[[Article], bool]] = None,
+    ):
+        """
+        Constructor
+
+        `etag` and `modified` are the HTTP validators from the previous fetch of the feed (if any). When passed, the
+        server can reply with a 304, in which case nothing is downloaded or parsed and the feed has no entries.
+        `stop_at` should return True for already read articles. When passed, the feed is streamed, and only the entries
+        up to (and including) the first read one are parsed. Only use this for feeds that list the newest entries first
+        """
+        entry_stop_at = (lambda entry: stop_at(Article(entry))) if stop_at else None
+        super().__init__(fetch_feed(feed_url, etag=etag, modified=modified, stop_at=entry_stop_at))
         self.title = feed_title
 
+    @property
+    def not_modified(self) -> bool:
+        """Return True if the server reported that the feed hasn't changed since the last fetch"""
+        return self.get("status") == 304
+
+    def get_validators(self) -> Dict[str, str]:
+        """Return the HTTP validators (ETag/Last-Modified) to send with the next fetch of the feed"""
+        return {key: self[key] for key in ("etag", "modified") if self.get(key)}
+
     def find_unread_articles_from_user(self) -> List[Article]:
         """Ask the user what was the last article they have already read, and return all the newer ones"""
         last_read_index = self.find_last_read_article()
@@ -51,18 +132,42 @@ class Feed(feedparser.FeedParserDict):
 
     def find_unread_articles_from_date(self, last_updated: arrow.Arrow) -> List[Article]:
         """Find all the new articles since `last_updated`"""
-        # Some fancy walrus operator fun, because why not?
-        return [article for entry in self.entries if (article := Article(entry)).get_parsed_date() > last_updated]
-
-    def get_unread_articles(self, last_updated: Optional[arrow.Arrow]) -> List[Article]:
+        articles = [Article(entry) for entry in self.entries]
+        dates = self.get_entry_dates(articles)
+        return [article for article, date in zip(articles, dates) if date > last_updated]
+
+    def get_entry_dates(self, articles: Optional[List[Article]] = None) -> List[arrow.Arrow]:
+        """Parse the dates of all the entries in the feed (or of `articles`, if they were already created)"""
+        articles = articles if articles is not None else [Article(entry) for entry in self.entries]
+        return [parse_date(article.get_date()) for article in articles]
+
+    def find_unread_articles_from_seen_keys(self, seen_keys: Set[str]) -> List[Article]:
+        """Find all the articles that aren't in the seen index"""
+        return [article for entry in self.entries if (article := Article(entry)).get_key() not in seen_keys]
+
+    def is_newest_first(self) -> bool:
+        """Return True if the entries in the feed are ordered from the newest to the oldest"""
+        dates = self.get_entry_dates()
+        return all(newer >= older for newer, older in zip(dates, dates[1:]))
+
+    def get_entry_keys(self) -> List[str]:
+        """Return the seen index keys of all the entries currently in the feed"""
+        return [Article(entry).get_key() for entry in self.entries]
+
+    def get_unread_articles(
+        self, last_updated: Optional[arrow.Arrow], seen_keys: Optional[Set[str]] = None
+    ) -> List[Article]:
         """
         Return all the new articles
 
-            * either since the last time r2k has ran, or
+            * either those that aren't in the seen index, or
+            * since the last time r2k has ran (for feeds that were tracked before the seen index existed), or
             * if this is the first time r2k is running for this feed, by asking the user which was the last article
             from the feed that they have already read, and only sending them the ones that came after
         """
-        if last_updated:
+        if seen_keys:
+            unread_articles = self.find_unread_articles_from_seen_keys(seen_keys)
+        elif last_updated:
             unread_articles = self.find_unread_articles_from_date(last_updated)
         else:
             unread_articles = self.find_unread_articles_from_user()
@@ -0,0 +1,144 @@
+"""
+The health of the hosts and URLs r2k downloads from, shared by all the network traffic that goes through `http_client`
+(feeds, article pages and images)
+
+Two things are tracked, and persisted across runs:
+    1. Hosts that failed (timed out, refused to connect, returned a server error) several times in a row. Their
+       circuit is opened, and they're skipped for a cool-down period instead of being waited on over and over again.
+       After the cool-down they're tried again, and a single failure opens the circuit again
+    2. URLs that failed in a way that isn't likely to change soon (e.g. a 404, or an image that's too large). They're
+       kept in a negative cache, and skipped until their entry expires
+"""
+import os
+import threading
+import time
+from os.path import dirname
+from tempfile import NamedTemporaryFile
+from typing import Dict, Optional
+
+import orjson as json
+
+from .constants import DEFAULT_HOST_HEALTH_PATH
+
+SECONDS_IN_MINUTE = 60
+SECONDS_IN_HOUR = 60 * 60
+
+
+class HostHealth:
+    """The failures of hosts and URLs, kept in memory and saved to a JSON file between runs"""
+
+    def __init__(self, path: str) -> None:
+        """Constructor"""
+        self._path = path
+        self.enabled = True
+        # Network requests are made from many threads at once, so access to the state is serialized
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Per host: the number of consecutive failures, when the last one was, and until when its circuit is open
+        self._hosts: Dict[str, dict] = {}
+        # Per URL: why it failed, whether it was skipped on purpose (e.g. a tracking pixel), and when the entry expires
+        self._urls: Dict[str, dict] = {}
+
+    def _load(self) -> None:
+        """Lazily read the saved state on first use (must be called with the lock held)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self._path, "rb") as f:
+                state = json.loads(f.read())
+            self._hosts = state.get("hosts", {})
+            self._urls = state.get("urls", {})
+        except (OSError, json.JSONDecodeError, AttributeError):
+            pass
+
+    def is_circuit_open(self, host: str) -> bool:
+        """Return True if the host failed too many times in a row recently, and should be skipped for now"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._load()
+            return self._hosts.get(host, {}).get("open_until", 0) > time.time()
+
+    def record_success(self, host: str) -> None:
+        """Mark the host as healthy (closing its circuit, if it was open)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._load()
+            self._hosts.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        """Count a failure of the host, and open its circuit once it failed `host_failure_threshold` times in a row"""
+        # Imported here, as the CLI (and the config, which depends on it) import the modules that import this one
+        from .cli import logger
+        from .config import config
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self._load()
+            state = self._hosts.setdefault(host, {"failures": 0, "open_until": 0})
+            state["failures"] += 1
+            state["last_failure"] = time.time()
+            if state["failures"] >= config.host_failure_threshold and state["open_until"] <= time.time():
+                state["open_until"] = time.time() + config.host_cooldown_minutes * SECONDS_IN_MINUTE
+                logger.warning(
+                    f"{host} failed {state['failures']} times in a row. "
+                    f"Skipping it for the next {config.host_cooldown_minutes} minutes"
+                )
+
+    def get_failed_url(self, url: str) -> Optional[dict]:
+        """Return the negative cache entry of a URL (with its `reason` and `skipped`), or None if it's not there"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load()
+            entry = self._urls.get(url)
+            if entry and entry["expires"] > time.time():
+                return entry
+            return None
+
+    def add_failed_url(self, url: str, reason: str, skipped: bool = False) -> None:
+        """Add a URL to the negative cache, for `negative_cache_ttl_hours`"""
+        from .config import config
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self._load()
+            expires = time.time() + config.negative_cache_ttl_hours * SECONDS_IN_HOUR
+            self._urls[url] = {"reason": reason, "skipped": skipped, "expires": expires}
+
+    def save(self) -> None:
+        """
+        Write the state to disk, without the entries that already expired
+
+        The failures of a host are forgotten after `negative_cache_ttl_hours` as well, so that a host that failed
+        once in a while, a long time ago, doesn't have its circuit opened by its next failure
+        """
+        from .config import config
+
+        if not self.enabled:
+            return
+        with self._lock:
+            if not self._loaded:
+                # Nothing was downloaded, so nothing changed
+                return
+            now = time.time()
+            self._urls = {url: entry for url, entry in self._urls.items() if entry["expires"] > now}
+            threshold = now - config.negative_cache_ttl_hours * SECONDS_IN_HOUR
+            self._hosts = {
+                host: state
+                for host, state in self._hosts.items()
+                if state["open_until"] > now or state.get("last_failure", 0) > threshold
+            }
+            state = {"hosts": self._hosts, "urls": self._urls}
+            os.makedirs(dirname(self._path), exist_ok=True)
+            # Write to a temp file and rename it, so that a run that's killed halfway doesn't leave a broken file
+            with NamedTemporaryFile("wb", dir=dirname(self._path), delete=False) as f:
+                f.write(json.dumps(state))
+            os.replace(f.name, self._path)
+
+
+host_health = HostHealth(DEFAULT_HOST_HEALTH_PATH)
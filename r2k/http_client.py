@@ -0,0 +1,267 @@
+"""
+A shared HTTP client for all of r2k's network traffic (feeds, article pages, images and the parser APIs)
+
+All requests go through a single `requests.Session`, so keep-alive connections and TLS sessions are pooled per host
+and reused across feeds, articles and images, and the default headers and timeouts are applied in a single place.
+The outcome of every request is reported to `host_health`, so hosts that are down and URLs that keep failing are
+skipped instead of being waited on
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from .constants import HTML_HEADERS
+from .host_health import host_health
+
+# Bodies are read in chunks of this size by `download`
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# The probe of `download` is called once at least this many bytes arrived (enough for e.g. an image's dimensions)
+PROBE_SIZE = 512
+BYTES_IN_MB = 1024 * 1024
+# Client errors that may go away on their own (timeout and rate limiting), so the URL isn't added to the negative cache
+TRANSIENT_CLIENT_ERRORS = {408, 429}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    """Raised when a download fails or is aborted, with a short human readable reason"""
+
+    def __init__(self, url: str, reason: str) -> None:
+        """Constructor"""
+        # Both are passed on, so that the error can be pickled (e.g. when raised in a worker process)
+        super().__init__(url, reason)
+        self.url = url
+        self.reason = reason
+
+    def __str__(self) -> str:
+        """The reason and the URL"""
+        return f"{self.reason} ({self.url})"
+
+
+class SkippedDownload(DownloadError):
+    """Raised when a download is skipped on purpose (e.g. an image that turned out to be a tracking pixel)"""
+
+
+class HostUnavailableError(requests.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit is open (see `host_health`)"""
+
+
+class _HostFailure(Exception):
+    """Wraps a `DownloadError` that was caused by the host (rather than by the URL), until it's reported"""
+
+    def __init__(self, error: DownloadError) -> None:
+        """Constructor"""
+        super().__init__(error)
+        self.error = error
+
+
+def get_session() -> requests.Session:
+    """Return the shared session, creating it on first use"""
+    global _session
+    if not _session:
+        with _session_lock:
+            if not _session:
+                _session = create_session()
+    return _session
+
+
+def create_session() -> requests.Session:
+    """Create a new session with the default headers and a connection pool sized according to the config"""
+    from .config import config
+
+    session = requests.Session()
+    session.headers.update(HTML_HEADERS)
+    adapter = HTTPAdapter(pool_connections=config.http_pool_hosts, pool_maxsize=config.http_pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def reset_session() -> None:
+    """Drop the shared session (and with it all the pooled connections)"""
+    global _session
+    if _session:
+        _session.close()
+    _session = None
+
+
+def get_timeout() -> Tuple[float, float]:
+    """Return the default (connect, read) timeouts in seconds"""
+    from .config import config
+
+    return config.http_connect_timeout, config.http_read_timeout
+
+
+def get(url: str, track_health: bool = True, **kwargs: Any) -> requests.Response:
+    """
+    Send a GET request through the shared session, with the default timeouts unless others were passed
+
+    Unless `track_health` is False (e.g. for local services that are expected to be down while they start), requests
+    to a host whose circuit is open raise `HostUnavailableError` right away, and the outcome is reported otherwise
+    """
+    kwargs.setdefault("timeout", get_timeout())
+    if not track_health:
+        return get_session().get(url, **kwargs)
+
+    host = get_host(url)
+    if host_health.is_circuit_open(host):
+        raise HostUnavailableError(f"{host} is down, skipping it for now")
+    try:
+        response = get_session().get(url, **kwargs)
+    except (requests.ConnectionError, requests.Timeout):
+        host_health.record_failure(host)
+        raise
+    if response.status_code >= 500:
+        host_health.record_failure(host)
+    else:
+        host_health.record_success(host)
+    return response
+
+
+def check_health(url: str) -> None:
+    """
+    Raise a `DownloadError` if the URL failed for good recently, or if its host is down
+
+    The error of the original failure is raised again, so e.g. an image that was skipped on purpose is still skipped
+    silently
+    """
+    if entry := host_health.get_failed_url(url):
+        error_class = SkippedDownload if entry["skipped"] else DownloadError
+        raise error_class(url, f"{entry['reason']}, in a recent attempt")
+    if host_health.is_circuit_open(host := get_host(url)):
+        raise DownloadError(url, f"skipped, as {host} is down")
+
+
+def download(
+    url: str,
+    max_mb: float,
+    probe: Optional[Callable[[requests.Response, bytes], None]] = None,
+    until: Optional[Callable[[requests.Response, bytes], bool]] = None,
+    **kwargs: Any,
+) -> requests.Response:
+    """
+    Download a resource (e.g. a page or an image) with a bounded size and duration, and return the response
+
+    The body is streamed, and the download is aborted as soon as it's known to exceed `max_mb`: up front from the
+    Content-Length header when there is one, or while reading otherwise. Apart from the (connect, read) timeouts, the
+    whole download must finish within the configured download timeout, so a host that trickles data can't stall a run.
+    Any failure is raised as a `DownloadError`. The returned response's content was already read
+
+    `probe` is called with the response and the first `PROBE_SIZE` bytes of the body (or all of it, if it's smaller),
+    and can raise a `DownloadError` to abort the download before the rest of the body is read. `until` is called with
+    the response and every chunk of the body as it arrives, and the download stops (successfully, with the content
+    read so far) once it returns True
+
+    URLs that failed for good recently, and hosts that are down, aren't requested at all (see `host_health`). Failures
+    of the host (connection errors, timeouts and server errors) count towards opening its circuit, while failures of
+    the URL itself (client errors, and resources that are too large or were skipped) add it to the negative cache
+    """
+    check_health(url)
+    host = get_host(url)
+    try:
+        response = _download(url, max_mb, probe, until, **kwargs)
+    except SkippedDownload as e:
+        host_health.add_failed_url(url, e.reason, skipped=True)
+        raise
+    except _HostFailure as e:
+        host_health.record_failure(host)
+        raise e.error
+    except DownloadError as e:
+        host_health.record_success(host)
+        host_health.add_failed_url(url, e.reason)
+        raise
+    host_health.record_success(host)
+    return response
+
+
+def _download(
+    url: str,
+    max_mb: float,
+    probe: Optional[Callable[[requests.Response, bytes], None]],
+    until: Optional[Callable[[requests.Response, bytes], bool]],
+    **kwargs: Any,
+) -> requests.Response:
+    """Download a resource as described in `download`, raising host failures as `_HostFailure`"""
+    from .config import config
+
+    kwargs.setdefault("timeout", get_timeout())
+    max_bytes = int(max_mb * BYTES_IN_MB)
+    deadline = time.monotonic() + config.download_timeout
+    try:
+        with get_session().get(url, stream=True, **kwargs) as response:
+            if not response.ok:
+                error = DownloadError(url, f"HTTP {response.status_code}")
+                if response.status_code >= 500 or response.status_code in TRANSIENT_CLIENT_ERRORS:
+                    raise _HostFailure(error)
+                raise error
+            content_length = response.headers.get("Content-Length", "")
+            if content_length.isdigit() and int(content_length) > max_bytes:
+                raise DownloadError(
+                    url, f"too large ({int(content_length) / BYTES_IN_MB:.1f}MB, the limit is {max_mb}MB)"
+                )
+
+            chunks = []
+            size = 0
+            for chunk in _iter_chunks(response):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise DownloadError(url, f"too large (over the {max_mb}MB limit)")
+                if time.monotonic() > deadline:
+                    raise _HostFailure(
+                        DownloadError(url, f"too slow (not done after {config.download_timeout} seconds)")
+                    )
+                chunks.append(chunk)
+                if probe and size >= PROBE_SIZE:
+                    probe(response, b"".join(chunks))
+                    probe = None
+                if until and until(response, chunk):
+                    break
+            if probe:
+                probe(response, b"".join(chunks))
+            # Setting the content makes `.content` and `.text` (with the usual encoding detection) work as usual
+            response._content = b"".join(chunks)
+            return response
+    except (requests.Timeout, urllib3.exceptions.TimeoutError):
+        raise _HostFailure(DownloadError(url, "timed out"))
+    except (requests.ConnectionError, urllib3.exceptions.HTTPError) as e:
+        # Reading the body straight from urllib3 (see `_iter_chunks`) raises its own errors
+        raise _HostFailure(DownloadError(url, f"failed ({type(e).__name__})"))
+    except requests.RequestException as e:
+        raise DownloadError(url, f"failed ({type(e).__name__})")
+
+
+def get_host(url: str) -> str:
+    """Return the host (and port, if there is one) of a URL"""
+    return urlparse(url).netloc
+
+
+def _iter_chunks(response: requests.Response) -> Iterator[bytes]:
+    """
+    Yield the (decoded) body of a streamed response as it arrives, in chunks of up to `DOWNLOAD_CHUNK_SIZE`
+
+    `iter_content` blocks until a whole chunk arrived, so a host that trickles data would only be stopped once it's
+    done. When urllib3 supports it (2.x), whatever already arrived is returned instead
+    """
+    if not hasattr(response.raw, "read1"):
+        yield from response.iter_content(DOWNLOAD_CHUNK_SIZE)
+        return
+    while chunk := response.raw.read1(DOWNLOAD_CHUNK_SIZE, decode_content=True):
+        yield chunk
+
+
+def _forget_session() -> None:
+    """Make a forked child process start with its own session, as pooled sockets can't be shared with the parent"""
+    global _session
+    _session = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_session)
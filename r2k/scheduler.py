@@ -0,0 +1,131 @@
+"""
+Adaptive per-feed polling schedule
+
+After every fetch, the time of the next check of a feed is set based on:
+    1. How often the feed actually publishes (the median gap between its entries)
+    2. Whether anything new was found (feeds that keep coming back empty are polled less and less often)
+    3. The feed's own hints (`ttl`, `sy:updatePeriod`/`sy:updateFrequency`) and the HTTP caching headers
+    4. The feed's `skipHours`
+
+Feeds that aren't due yet are skipped by `kindle send`
+"""
+import re
+from email.utils import parsedate_to_datetime
+from statistics import median
+from typing import List, Optional
+
+import arrow
+
+from .config import config
+from .dates import now, parse_date
+from .feeds import Feed
+
+SECONDS_IN_MINUTE = 60
+SECONDS_IN_HOUR = 60 * SECONDS_IN_MINUTE
+
+SY_UPDATE_PERIODS = {
+    "hourly": SECONDS_IN_HOUR,
+    "daily": 24 * SECONDS_IN_HOUR,
+    "weekly": 7 * 24 * SECONDS_IN_HOUR,
+    "monthly": 30 * 24 * SECONDS_IN_HOUR,
+    "yearly": 365 * 24 * SECONDS_IN_HOUR,
+}
+
+# How much to stretch the poll interval every time a feed is found to have nothing new
+EMPTY_POLL_BACKOFF = 1.5
+
+MAX_AGE_RE = re.compile(r"max-age\s*=\s*(\d+)")
+
+
+def is_due(local_feed: dict, current_time: Optional[arrow.Arrow] = None) -> bool:
+    """Return True if it's time to check the feed for updates"""
+    next_check = local_feed.get("next_check")
+    return not next_check or parse_date(next_check) <= (current_time or now())
+
+
+def schedule_next_check(local_feed: dict, feed: Feed, new_articles_count: int, full_parse: bool = True) -> None:
+    """
+    Set the time of the next check of the feed (as well as the intervals and hints it was based on) in the feed's dict
+
+    The publishing interval is only measured when the whole feed was parsed, as a streamed feed only has the entries
+    up to the first read one. The feed's own hints are kept from the last time the feed was downloaded, as a feed that
+    wasn't modified (a 304) has none
+    """
+    if full_parse and (publish_interval := get_publish_interval(feed)):
+        local_feed["publish_interval"] = publish_interval
+    if not feed.not_modified:
+        update_feed_hints(local_feed, feed)
+
+    min_interval = config.min_poll_interval_minutes * SECONDS_IN_MINUTE
+    max_interval = config.max_poll_interval_minutes * SECONDS_IN_MINUTE
+    if new_articles_count or "poll_interval" not in local_feed:
+        # Polling twice per publishing interval keeps the average delay at a quarter of it
+        interval = local_feed.get("publish_interval", min_interval) / 2
+    else:
+        interval = local_feed["poll_interval"] * EMPTY_POLL_BACKOFF
+
+    # The feed's and the server's hints are minimums
+    hinted_intervals = [local_feed.get("hinted_interval", 0), get_cache_interval(feed.get("headers", {})) or 0]
+    interval = max([interval] + hinted_intervals)
+    interval = int(min(max(interval, min_interval), max_interval))
+    local_feed["poll_interval"] = interval
+    local_feed["next_check"] = skip_hours(now().shift(seconds=interval), local_feed.get("skip_hours", []))
+
+
+def update_feed_hints(local_feed: dict, feed: Feed) -> None:
+    """Keep the minimum interval the feed asked for, and the hours it asked to skip, in the feed's dict"""
+    hints = feed.get("feed", {})
+    for key, value in (("hinted_interval", get_hinted_interval(hints)), ("skip_hours", hints.get("skip_hours"))):
+        if value:
+            local_feed[key] = value
+        else:
+            local_feed.pop(key, None)
+
+
+def get_publish_interval(feed: Feed) -> Optional[int]:
+    """Return the median number of seconds between consecutive entries in the feed (if there are enough entries)"""
+    dates = sorted(feed.get_entry_dates())
+    gaps = [(newer - older).total_seconds() for older, newer in zip(dates, dates[1:])]
+    gaps = [gap for gap in gaps if gap > 0]
+    return int(median(gaps)) if gaps else None
+
+
+def get_hinted_interval(hints: dict) -> Optional[int]:
+    """Return the minimum interval (in seconds) the feed asked for in its `ttl` and `sy:` elements, if it did"""
+    intervals: List[float] = []
+    if (ttl := str(hints.get("ttl", ""))).isdigit():
+        intervals.append(int(ttl) * SECONDS_IN_MINUTE)
+
+    if period := SY_UPDATE_PERIODS.get(str(hints.get("sy_updateperiod", "")).strip().lower()):
+        frequency = str(hints.get("sy_updatefrequency", "1")).strip()
+        intervals.append(period / int(frequency) if frequency.isdigit() and int(frequency) else period)
+    return int(max(intervals)) if intervals else None
+
+
+def get_cache_interval(headers: dict) -> Optional[float]:
+    """Return the number of seconds the response may be cached for, based on Cache-Control and Expires"""
+    headers = {key.lower(): value for key, value in headers.items()}
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return None
+    if match := MAX_AGE_RE.search(cache_control):
+        return float(match.group(1))
+
+    if expires := headers.get("expires"):
+        try:
+            expires_at = parsedate_to_datetime(expires)
+            sent_at = parsedate_to_datetime(headers["date"]) if "date" in headers else now()
+            return max((expires_at - sent_at).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def skip_hours(next_check: arrow.Arrow, hours: List[int]) -> arrow.Arrow:
+    """Push `next_check` forward to the first (UTC) hour that the feed didn't ask to skip"""
+    hours_to_skip = set(hours)
+    if len(hours_to_skip) >= 24:
+        return next_check
+    while next_check.hour in hours_to_skip:
+        next_check = next_check.shift(hours=1).replace(minute=0, second=0, microsecond=0)
+    return next_check
@@ -0,0 +1,75 @@
+"""
+A persistent index of the articles that were already handled, keyed by the feed's title and the entry's GUID (or link)
+
+The index lives in a local SQLite file, so checking whether an entry is new doesn't require parsing its date, and
+backdated or edited posts are neither missed nor sent twice
+"""
+import sqlite3
+import threading
+import time
+from os import makedirs
+from os.path import dirname
+from typing import Iterable, Optional, Set
+
+from .constants import DEFAULT_SEEN_INDEX_PATH
+
+SECONDS_IN_DAY = 24 * 60 * 60
+
+
+class SeenIndex:
+    """A thin wrapper around the SQLite table of seen entries"""
+
+    def __init__(self, path: str):
+        """Constructor"""
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        # The index is read from the feed fetching threads, so access to the connection is serialized
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Lazily open the DB (and create the table) on first use"""
+        if not self._conn:
+            makedirs(dirname(self._path), exist_ok=True)
+            self._conn = sqlite3.connect(self._path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen ("
+                "feed TEXT NOT NULL, key TEXT NOT NULL, seen_at REAL NOT NULL, PRIMARY KEY (feed, key)"
+                ") WITHOUT ROWID"
+            )
+        return self._conn
+
+    def get_seen_keys(self, feed_title: str) -> Set[str]:
+        """Return the keys of all the entries of a feed that were already seen"""
+        with self._lock:
+            rows = self.conn.execute("SELECT key FROM seen WHERE feed = ?", (feed_title,))
+            return {key for key, in rows}
+
+    def mark_seen(self, feed_title: str, keys: Iterable[str]) -> None:
+        """
+        Add entries to the index
+
+        Entries that are already in the index get their timestamp refreshed, so that entries which are still in the
+        feed are never pruned
+        """
+        seen_at = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO seen (feed, key, seen_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (feed, key) DO UPDATE SET seen_at = excluded.seen_at",
+                [(feed_title, key, seen_at) for key in keys],
+            )
+
+    def touch_feed(self, feed_title: str) -> None:
+        """Refresh the timestamps of all the entries of a feed (e.g. when the feed wasn't modified)"""
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE seen SET seen_at = ? WHERE feed = ?", (time.time(), feed_title))
+
+    def prune(self, max_age_days: int) -> int:
+        """Remove entries that weren't seen in the last `max_age_days` days, and return how many were removed"""
+        threshold = time.time() - max_age_days * SECONDS_IN_DAY
+        with self._lock, self.conn:
+            return self.conn.execute("DELETE FROM seen WHERE seen_at < ?", (threshold,)).rowcount
+
+
+seen_index = SeenIndex(DEFAULT_SEEN_INDEX_PATH)
@@ -1,9 +1,13 @@
 """Adapted from SO: https://stackoverflow.com/a/48946422/978089"""
 import re
+import threading
 import unicodedata
 from typing import Dict, List, Tuple, Union
 
 _common_char_maps: Dict[str, str] = {}
+_common_char_table: Dict[int, str] = {}
+# Building the map takes about a second, so when articles are parsed concurrently it should only be built once
+_common_char_lock = threading.Lock()
 
 
 def _unicode_character_name(char: str) -> Union[str, None]:
@@ -28,25 +32,33 @@ def _get_all_unicode_characters() -> List[Tuple[str, str]]:
 def _get_common_char_map() -> Dict[str, str]:
     """Create a mapping from common unicode characters to their ASCII counterparts"""
     global _common_char_maps
-    if not _common_char_maps:
-        all_unicode_characters = _get_all_unicode_characters()
-        for char, name in all_unicode_characters:
-            if "DOUBLE QUOTATION MARK" in name:
-                _common_char_maps[char] = '"'
-            elif "SINGLE QUOTATION MARK" in name:
-                _common_char_maps[char] = "'"
-            elif "DASH" in name and "DASHED" not in name:
-                _common_char_maps[char] = "-"
+    with _common_char_lock:
+        if not _common_char_maps:
+            char_map = {}
+            all_unicode_characters = _get_all_unicode_characters()
+            for char, name in all_unicode_characters:
+                if "DOUBLE QUOTATION MARK" in name:
+                    char_map[char] = '"'
+                elif "SINGLE QUOTATION MARK" in name:
+                    char_map[char] = "'"
+                elif "DASH" in name and "DASHED" not in name:
+                    char_map[char] = "-"
+            _common_char_maps = char_map
     return _common_char_maps
 
 
+def _get_common_char_table() -> Dict[int, str]:
+    """Return the common char map as a translation table for `str.translate`"""
+    global _common_char_table
+    if not _common_char_table:
+        _common_char_table = str.maketrans(_get_common_char_map())
+    return _common_char_table
+
+
 def strip_common_unicode_chars(string: str) -> str:
     """Replace common unicode characters with comparable ASCII values"""
-    char_map = _get_common_char_map()
-    for char, replacement in char_map.items():
-        if char in string:
-            string = string.replace(char, replacement)
-    return string
+    # A single pass over the string, instead of a pass per character in the map
+    return string.translate(_get_common_char_table())
 
 
 def normalize_str(string: str) -> str:
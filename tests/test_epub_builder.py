@@ -0,0 +1,72 @@
+import pickle
+
+import pytest
+
+from r2k.ebook import epub_builder, images
+from r2k.feeds import Article
+
+# Every article adds its own ZIP entry and its TOC entries on top of its content
+ARTICLE_OVERHEAD = epub_builder.ZIP_ENTRY_OVERHEAD + epub_builder.TOC_ENTRIES_SIZE
+IMAGE_SIZES = {"logo": 1000 - epub_builder.ZIP_ENTRY_OVERHEAD, "photo": 3000 - epub_builder.ZIP_ENTRY_OVERHEAD}
+
+
+class FakeArticle:
+    """An article that takes exactly `size` bytes in the book (not counting its images)"""
+
+    def __init__(self, name, size, image_blobs=()):
+        self.name = name
+        self.xhtml = "x" * (size - ARTICLE_OVERHEAD)
+        self.image_blobs = {blob_name: f"https://example.com/{blob_name}.png" for blob_name in image_blobs}
+
+    def get_xhtml(self):
+        return self.xhtml
+
+
+@pytest.fixture(autouse=True)
+def sizes(monkeypatch):
+    """Make the sizes predictable: no compression, no book overhead, and fixed image sizes"""
+    monkeypatch.setattr(epub_builder, "get_compressed_size", len)
+    monkeypatch.setattr(epub_builder, "get_book_overhead", lambda: 0)
+    monkeypatch.setattr(images, "get_image_size", lambda blob_name, url: IMAGE_SIZES[blob_name])
+
+
+@pytest.mark.parametrize(
+    "articles, max_size, expected",
+    [
+        ([], 3000, []),
+        ([("a", 1000), ("b", 1000), ("c", 1000)], 3000, [["a", "b", "c"]]),
+        ([("a", 1000), ("b", 1000), ("c", 1000)], 2000, [["a", "b"], ["c"]]),
+        ([("a", 1000), ("b", 1000), ("c", 1000)], 1000, [["a"], ["b"], ["c"]]),
+        # The order is kept, even when a later article would fit in an earlier book
+        ([("a", 1000), ("b", 1100), ("c", 900)], 2000, [["a"], ["b", "c"]]),
+        # An article that doesn't fit in a book on its own gets a book of its own
+        ([("a", 1000), ("b", 5000), ("c", 1000)], 2000, [["a"], ["b"], ["c"]]),
+        ([("a", 5000)], 2000, [["a"]]),
+        # Images count towards the size of the article
+        ([("a", 1000, ["photo"]), ("b", 1000)], 4000, [["a"], ["b"]]),
+        ([("a", 1000, ["photo"]), ("b", 1000)], 5000, [["a", "b"]]),
+        # An image that's shared by several articles of the same book is only counted once
+        ([("a", 1000, ["logo"]), ("b", 1000, ["logo"]), ("c", 1000, ["logo"])], 4000, [["a", "b", "c"]]),
+        ([("a", 1000, ["logo", "photo"]), ("b", 1000, ["photo"])], 6000, [["a", "b"]]),
+        # ... but it's counted again in the next book, which has its own copy
+        ([("a", 1000, ["logo"]), ("b", 1000, ["logo"]), ("c", 1000, ["logo"])], 3000, [["a", "b"], ["c"]]),
+        ([("a", 1000, ["logo"]), ("b", 1500, ["logo"])], 2000, [["a"], ["b"]]),
+    ],
+)
+def test_pack_articles(articles, max_size, expected):
+    books = epub_builder.pack_articles([FakeArticle(*article) for article in articles], max_size)
+
+    assert [[article.name for article in book] for book in books] == expected
+
+
+def test_article_content_survives_pickling():
+    article = epub_builder.EPUBArticle(
+        Article(title="Title", link="https://example.com/post", published="2026-10-17T10:30:00+00:00")
+    )
+    article.set_content({"content": '<p>Text</p><img src="/a.png" width="600" height="400"/>'})
+
+    # As done by the worker processes that extract articles
+    article = pickle.loads(pickle.dumps(article))
+    article.set_images({"https://example.com/a.png": "abc.png"}, {})
+
+    assert article.get_content() == '<p>Text</p><img src="../images/img-abc.png" width="600" height="400"/>'
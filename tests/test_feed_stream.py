@@ -0,0 +1,97 @@
+from io import BytesIO
+
+import pytest
+from requests import Response
+from urllib3 import HTTPResponse
+
+from r2k import feed_stream
+
+FEED_URL = "https://example.com/blog/feed.xml"
+
+RSS = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel>
+<title>Example</title>
+<ttl>60</ttl>
+<skipHours><hour>1</hour><hour>2</hour></skipHours>
+<item><title>C</title><link>https://example.com/c</link><guid>c</guid></item>
+<item><title>B</title><link>/b</link><guid>b</guid></item>
+<item><title>A</title><link>a.html</link><guid>a</guid></item>
+</channel></rss>
+"""
+
+ATOM = b"""<?xml version="1.0"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<title>Example</title>
+<entry><title>C</title><link rel="alternate" href="/c"/></entry>
+<entry xml:base="https://other.example.com/posts/">
+<title>B</title><link rel="self" href="b.xml"/><link href="b"/>
+</entry>
+<entry><title>A</title><id>a</id><link href="a"/></entry>
+</feed>
+"""
+
+# Not well-formed (an unescaped ampersand), so it's only parsed by feedparser
+BROKEN_RSS = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel>
+<item><title>C &amp; D</title><link>/c</link><guid>c</guid></item>
+<item><title>B & A</title><link>/b</link><guid>b</guid></item>
+</channel></rss>
+"""
+
+
+def make_response(body: bytes) -> Response:
+    response = Response()
+    response.raw = HTTPResponse(body=BytesIO(body), preload_content=False)
+    response.url = FEED_URL
+    response.status_code = 200
+    return response
+
+
+@pytest.mark.parametrize(
+    "body, stop_key, expected_links",
+    [
+        (RSS, None, ["https://example.com/c", "https://example.com/b", "https://example.com/blog/a.html"]),
+        # The entry it stops at is included, but nothing after it
+        (RSS, "c", ["https://example.com/c"]),
+        (RSS, "b", ["https://example.com/c", "https://example.com/b"]),
+        (ATOM, None, ["https://example.com/c", "https://other.example.com/posts/b", "https://example.com/blog/a"]),
+        (ATOM, "https://other.example.com/posts/b", ["https://example.com/c", "https://other.example.com/posts/b"]),
+        # It stops before it reaches the broken entry
+        (BROKEN_RSS, "c", ["https://example.com/c"]),
+        # Otherwise the fallback parses the whole feed, no matter where it should've stopped
+        (BROKEN_RSS, "b", ["https://example.com/c", "https://example.com/b"]),
+    ],
+)
+def test_parse_until(body, stop_key, expected_links):
+    def stop_at(entry):
+        return stop_key is not None and stop_key in (entry.get("id"), entry.get("link"))
+
+    result = feed_stream.parse_until(make_response(body), stop_at)
+
+    assert [entry["link"] for entry in result.entries] == expected_links
+
+
+def test_parse_until_hints():
+    result = feed_stream.parse_until(make_response(RSS), lambda entry: True)
+
+    assert result.feed["ttl"] == "60"
+    assert result.feed["skip_hours"] == [1, 2]
+
+
+def test_parse_until_fallback_keeps_entries():
+    result = feed_stream.parse_until(make_response(BROKEN_RSS), lambda entry: False)
+
+    assert result.bozo
+    assert [entry["title"] for entry in result.entries] == ["C & D", "B & A"]
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        (RSS, [1, 2]),
+        (b"<rss><channel><skipHours>\n<hour> 23 </hour>\n</skipHours></channel></rss>", [23]),
+        (ATOM, []),
+    ],
+)
+def test_get_skip_hours(body, expected):
+    assert feed_stream.get_skip_hours(body) == expected
@@ -0,0 +1,144 @@
+import pytest
+
+from r2k import host_health as host_health_module
+from r2k.config import config
+from r2k.host_health import HostHealth
+
+HOST = "example.com"
+URL = "https://example.com/image.png"
+MINUTE = 60
+HOUR = 60 * MINUTE
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(host_health_module.time, "time", clock.time)
+    return clock
+
+
+@pytest.fixture
+def health(tmp_path, monkeypatch, clock):
+    monkeypatch.setattr(config, "host_failure_threshold", 3)
+    monkeypatch.setattr(config, "host_cooldown_minutes", 30)
+    monkeypatch.setattr(config, "negative_cache_ttl_hours", 24)
+    return HostHealth(str(tmp_path / "host_health.json"))
+
+
+def replay(health, clock, events):
+    """Replay failures ("fail"), successes ("ok") and the passing of time (a number of minutes)"""
+    for event in events:
+        if event == "fail":
+            health.record_failure(HOST)
+        elif event == "ok":
+            health.record_success(HOST)
+        else:
+            clock.now += event * MINUTE
+
+
+@pytest.mark.parametrize(
+    "events, is_open",
+    [
+        ([], False),
+        (["fail", "fail"], False),
+        # Opened by the threshold
+        (["fail", "fail", "fail"], True),
+        (["fail", "fail", "fail", "fail"], True),
+        # Only consecutive failures count
+        (["fail", "fail", "ok", "fail"], False),
+        (["fail", "fail", "ok", "fail", "fail", "fail"], True),
+        # ... no matter how far apart they are
+        (["fail", 60, "fail", 60, "fail"], True),
+        # Open for the cool-down, and closed after it
+        (["fail", "fail", "fail", 29], True),
+        (["fail", "fail", "fail", 31], False),
+        # A single failure after the cool-down opens it again, and a success closes it
+        (["fail", "fail", "fail", 31, "fail"], True),
+        (["fail", "fail", "fail", 31, "ok"], False),
+        (["fail", "fail", "fail", 31, "ok", "fail"], False),
+    ],
+)
+def test_circuit(health, clock, events, is_open):
+    replay(health, clock, events)
+
+    assert health.is_circuit_open(HOST) == is_open
+
+
+def test_circuit_is_per_host(health, clock):
+    replay(health, clock, ["fail", "fail", "fail"])
+
+    assert not health.is_circuit_open("other.example.com")
+
+
+def test_disabled(health, clock):
+    health.enabled = False
+    replay(health, clock, ["fail", "fail", "fail"])
+    health.add_failed_url(URL, "404")
+
+    assert not health.is_circuit_open(HOST)
+    assert health.get_failed_url(URL) is None
+
+
+@pytest.mark.parametrize(
+    "elapsed_hours, is_cached",
+    [
+        (0, True),
+        (23, True),
+        (25, False),
+    ],
+)
+def test_failed_url_expiry(health, clock, elapsed_hours, is_cached):
+    health.add_failed_url(URL, "tracking pixel (43 bytes)", skipped=True)
+    clock.now += elapsed_hours * HOUR
+
+    entry = health.get_failed_url(URL)
+
+    if is_cached:
+        assert entry["reason"] == "tracking pixel (43 bytes)"
+        assert entry["skipped"]
+    else:
+        assert entry is None
+
+
+@pytest.mark.parametrize(
+    "elapsed_hours, is_open, is_cached",
+    [
+        (0, True, True),
+        (1, False, True),
+        (25, False, False),
+    ],
+)
+def test_save_and_load(tmp_path, health, clock, elapsed_hours, is_open, is_cached):
+    replay(health, clock, ["fail", "fail", "fail"])
+    health.add_failed_url(URL, "404")
+    clock.now += elapsed_hours * HOUR
+    health.save()
+
+    loaded = HostHealth(str(tmp_path / "host_health.json"))
+
+    assert loaded.is_circuit_open(HOST) == is_open
+    assert (loaded.get_failed_url(URL) is not None) == is_cached
+
+
+def test_save_forgets_old_failures(tmp_path, health, clock):
+    # A host that failed once in a while, a long time ago, doesn't have its circuit opened by its next failure
+    replay(health, clock, ["fail", "fail", 25 * 60])
+    health.save()
+    loaded = HostHealth(str(tmp_path / "host_health.json"))
+    replay(loaded, clock, ["fail"])
+
+    assert not loaded.is_circuit_open(HOST)
+
+
+def test_nothing_to_save(tmp_path, health):
+    health.save()
+
+    assert not (tmp_path / "host_health.json").exists()
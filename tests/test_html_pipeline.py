@@ -0,0 +1,31 @@
+import pytest
+
+from r2k.ebook import html_pipeline
+
+
+@pytest.mark.parametrize(
+    "html, image_paths, expected",
+    [
+        ('<p>A<img src="r2k-image:0"/>B</p>', {0: "../images/a.png"}, '<p>A<img src="../images/a.png"/>B</p>'),
+        # Images without a path are removed, but the text around them is kept
+        ('<p>A<img src="r2k-image:0"/>B</p>', {0: None}, "<p>AB</p>"),
+        ('<p>A<img src="r2k-image:0"/>B</p>', {}, "<p>AB</p>"),
+        # The other attributes are kept, and images without a placeholder aren't touched
+        (
+            '<img alt="a > b" src="r2k-image:1"/><img src="data:image/png;base64,AA=="/>',
+            {1: "../images/b&c.png"},
+            '<img alt="a &gt; b" src="../images/b&amp;c.png"/><img src="data:image/png;base64,AA=="/>',
+        ),
+        (
+            '<img src="r2k-image:0"/><img src="r2k-image:1"/><img src="r2k-image:0"/>',
+            {0: "a.png", 1: None},
+            '<img src="a.png"/><img src="a.png"/>',
+        ),
+    ],
+)
+def test_set_image_paths(html, image_paths, expected):
+    root = html_pipeline.parse(html)
+
+    html_pipeline.set_image_paths(root, image_paths)
+
+    assert html_pipeline.serialize(root) == expected
@@ -0,0 +1,74 @@
+import struct
+from io import BytesIO
+
+import pytest
+
+from r2k.ebook import image_processing
+
+
+def png(width, height):
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", width, height) + b"\x08\x06"
+
+
+def gif(width, height):
+    return b"GIF89a" + struct.pack("<HH", width, height) + b"\x00" * 3
+
+
+def bmp(width, height, header_size=40):
+    if header_size == 12:
+        return b"BM" + b"\x00" * 12 + struct.pack("<IHH", header_size, width, height)
+    return b"BM" + b"\x00" * 12 + struct.pack("<Iii", header_size, width, height)
+
+
+def webp(chunk, payload):
+    return b"RIFF" + b"\x00" * 4 + b"WEBP" + chunk + b"\x00" * 4 + payload
+
+
+def jpeg(width, height, segments=b""):
+    start_of_frame = b"\xff\xc0" + struct.pack(">HBHH", 17, 8, height, width) + b"\x03"
+    return b"\xff\xd8" + segments + start_of_frame
+
+
+# An APP0 (JFIF) segment and a DHT segment, which come before the start of frame
+JPEG_SEGMENTS = (
+    b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9 + b"\xff\xc4" + struct.pack(">H", 4) + b"\x00" * 2
+)
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        (png(640, 480), (640, 480)),
+        (gif(1, 1), (1, 1)),
+        (bmp(300, 200), (300, 200)),
+        # Bottom-up bitmaps have a negative height
+        (bmp(300, -200), (300, 200)),
+        (bmp(300, 200, header_size=12), (300, 200)),
+        # Lossy (with the 2 scale bits set), lossless and extended WebP
+        (webp(b"VP8 ", b"\x00" * 6 + struct.pack("<HH", 0xC000 | 800, 600)), (800, 600)),
+        (webp(b"VP8L", b"\x2f" + struct.pack("<I", (800 - 1) | (600 - 1) << 14)), (800, 600)),
+        (webp(b"VP8X", b"\x00" * 4 + (800 - 1).to_bytes(3, "little") + (600 - 1).to_bytes(3, "little")), (800, 600)),
+        (jpeg(1024, 768), (1024, 768)),
+        (jpeg(1024, 768, JPEG_SEGMENTS), (1024, 768)),
+        (jpeg(1024, 768, b"\xff\xff"), (1024, 768)),
+        # Truncated before the dimensions
+        (png(640, 480)[:20], None),
+        (gif(1, 1)[:8], None),
+        (jpeg(1024, 768, JPEG_SEGMENTS)[:20], None),
+        # Formats without dimensions in their header, or no image at all
+        (b"<svg xmlns='http://www.w3.org/2000/svg' width='10' height='10'/>", None),
+        (b"<html><body>Not found</body></html>", None),
+        (b"", None),
+    ],
+)
+def test_get_dimensions(data, expected):
+    assert image_processing.get_dimensions(data) == expected
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "GIF", "BMP", "WEBP", "JPEG"])
+def test_get_dimensions_of_real_images(image_format):
+    Image = pytest.importorskip("PIL.Image")
+    output = BytesIO()
+    Image.new("RGB", (123, 45)).save(output, image_format)
+
+    assert image_processing.get_dimensions(output.getvalue()[:512]) == (123, 45)
@@ -0,0 +1,137 @@
+import os
+import struct
+
+import pytest
+from requests import Response
+
+from r2k import http_client
+from r2k.config import config
+from r2k.constants import DEFAULT_IMAGE_DENY_PATTERNS
+from r2k.ebook import images
+from r2k.ebook.image_store import ImageStore
+
+
+def png_head(width, height, size=http_client.PROBE_SIZE):
+    """The first bytes of a PNG image (padded to `size`)"""
+    header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", width, height)
+    return header + b"\x00" * (size - len(header))
+
+
+def make_response(content_length=None):
+    response = Response()
+    response.url = "https://example.com/image.png"
+    if content_length is not None:
+        response.headers["Content-Length"] = str(content_length)
+    return response
+
+
+@pytest.fixture(autouse=True)
+def image_config(monkeypatch):
+    monkeypatch.setattr(config, "image_min_size", 32)
+    monkeypatch.setattr(config, "image_deny_patterns", DEFAULT_IMAGE_DENY_PATTERNS)
+
+
+@pytest.mark.parametrize(
+    "content_length, head, skipped",
+    [
+        (50_000, png_head(640, 480), False),
+        (None, png_head(640, 480), False),
+        # The dimensions are too small, no matter how large the image is
+        (50_000, png_head(16, 16), True),
+        (50_000, png_head(1, 1), True),
+        # Wide or tall images are fine, as long as one of the dimensions is large enough
+        (50_000, png_head(600, 10), False),
+        (50_000, png_head(32, 32), False),
+        # Tracking pixels, by Content-Length, or by the whole image fitting in the head
+        (43, png_head(640, 480), True),
+        (None, png_head(640, 480, size=100), True),
+        (None, png_head(640, 480, size=200), False),
+        (None, b"\x00" * http_client.PROBE_SIZE, False),
+        # Unknown dimensions aren't skipped
+        (50_000, b"<svg xmlns='http://www.w3.org/2000/svg'/>" + b" " * 500, False),
+    ],
+)
+def test_probe_image(content_length, head, skipped):
+    response = make_response(content_length)
+    if skipped:
+        with pytest.raises(http_client.SkippedDownload):
+            images.probe_image(response, head)
+    else:
+        images.probe_image(response, head)
+
+
+def test_probe_image_min_size(monkeypatch):
+    monkeypatch.setattr(config, "image_min_size", 700)
+
+    with pytest.raises(http_client.SkippedDownload, match="too small"):
+        images.probe_image(make_response(50_000), png_head(640, 480))
+
+
+@pytest.mark.parametrize(
+    "url, denied",
+    [
+        ("https://example.com/image.png", False),
+        ("https://feeds.feedburner.com/~ff/example?i=abc", True),
+        ("https://feeds.feedburner.com/~r/example/~4/abc", True),
+        ("https://feeds.feedburner.com/example/image.png", False),
+        ("https://pixel.wp.com/g.gif?blog=1", True),
+        ("https://i0.wp.com/example.com/image.png", False),
+        ("https://stats.wordpress.com/b.gif", True),
+        ("https://ad.doubleclick.net/ddm/ad.gif", True),
+        # Only subdomains match `*.`
+        ("https://doubleclick.net/image.png", False),
+        ("https://www.google-analytics.com/collect?v=1", True),
+        ("https://www.facebook.com/tr?id=1&ev=PageView", True),
+        ("https://www.facebook.com/images/logo.png", False),
+    ],
+)
+def test_is_denied(url, denied):
+    assert images.is_denied(url) == denied
+
+
+@pytest.mark.parametrize(
+    "patterns, url, denied",
+    [
+        ("", "https://pixel.wp.com/g.gif", False),
+        ("cdn.example.com", "https://cdn.example.com/a.png", True),
+        (" cdn.example.com , ads.example.com ", "https://ads.example.com/a.png", True),
+        ("example.com/ads/*", "https://example.com/ads/a.png", True),
+        ("example.com/ads/*", "https://example.com/images/a.png", False),
+    ],
+)
+def test_is_denied_custom_patterns(monkeypatch, patterns, url, denied):
+    monkeypatch.setattr(config, "image_deny_patterns", patterns)
+
+    assert images.is_denied(url) == denied
+
+
+def test_evicted_image_is_downloaded_again(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path / "store"))
+    monkeypatch.setattr(images, "image_store", store)
+    blob_name = store.put("https://example.com/old.png", b"old", "png")
+    os.remove(store.get_blob_path(blob_name))
+    monkeypatch.setattr(images, "get_image", lambda url: store.put(url, b"new", "png"))
+    images_path = tmp_path / "book"
+    images_path.mkdir()
+
+    assert images.get_image_size(blob_name, "https://example.com/old.png") == 3
+    images.add_image_to_book(blob_name, "https://example.com/old.png", str(images_path))
+
+    assert (images_path / images.get_book_image_name(blob_name)).read_bytes() == b"new"
+
+
+def test_evicted_image_is_dropped_if_it_cannot_be_downloaded(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path / "store"))
+    monkeypatch.setattr(images, "image_store", store)
+
+    def fail(url):
+        raise http_client.DownloadError(url, "404")
+
+    monkeypatch.setattr(images, "get_image", fail)
+    images_path = tmp_path / "book"
+    images_path.mkdir()
+
+    assert images.get_image_size("missing.png", "https://example.com/missing.png") == 0
+    images.add_image_to_book("missing.png", "https://example.com/missing.png", str(images_path))
+
+    assert not list(images_path.iterdir())
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from r2k.ebook import mercury_container
+
+
+@pytest.fixture
+def leases_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(mercury_container, "DEFAULT_MERCURY_LEASES_DIR", str(tmp_path / "leases"))
+    return tmp_path / "leases"
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+def test_no_leases(leases_dir):
+    assert not mercury_container.is_leased()
+
+
+def test_acquire_and_release(leases_dir):
+    mercury_container.acquire_lease()
+    assert mercury_container.is_leased()
+
+    mercury_container.release_lease()
+    assert not mercury_container.is_leased()
+    # Releasing twice is fine
+    mercury_container.release_lease()
+
+
+def test_leases_of_dead_processes_are_removed(leases_dir):
+    leases_dir.mkdir()
+    (leases_dir / str(dead_pid())).touch()
+
+    assert not mercury_container.is_leased()
+    assert not os.listdir(leases_dir)
+
+
+def test_stop_if_idle_keeps_leased_containers(leases_dir, tmp_path, monkeypatch):
+    stamp_path = tmp_path / "mercury.last_used"
+    stamp_path.touch()
+    os.utime(stamp_path, (0, 0))
+    monkeypatch.setattr(mercury_container, "DEFAULT_MERCURY_STAMP_PATH", str(stamp_path))
+    mercury_container.acquire_lease()
+
+    # Docker isn't reached, as the containers aren't stopped
+    assert mercury_container.stop_if_idle() == 0
+    assert stamp_path.exists()
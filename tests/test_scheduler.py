@@ -0,0 +1,154 @@
+import arrow
+import feedparser
+import pytest
+
+from r2k import feeds, scheduler
+
+NOW = arrow.get("2026-10-17T10:30:00+00:00")
+HOUR = 60 * 60
+
+
+def make_feed(monkeypatch, gap_minutes=None, hints=None, headers=None, status=200):
+    """Create a feed with 5 entries published `gap_minutes` apart (or none at all), without downloading anything"""
+    entries = []
+    if gap_minutes:
+        entries = [{"published": str(NOW.shift(minutes=-gap_minutes * i))} for i in range(5)]
+    result = feedparser.FeedParserDict(
+        feed=feedparser.FeedParserDict(hints or {}), entries=entries, headers=headers or {}, status=status
+    )
+    monkeypatch.setattr(feeds, "fetch_feed", lambda *args, **kwargs: result)
+    return feeds.Feed("https://example.com/feed", "Example")
+
+
+@pytest.mark.parametrize(
+    "gap_minutes, hints, headers, local_feed, new_articles_count, expected_interval",
+    [
+        # Twice per publishing interval
+        (60, {}, {}, {}, 1, HOUR / 2),
+        (12 * 60, {}, {}, {}, 1, 6 * HOUR),
+        # Clamped to the min/max poll intervals (15 minutes and a day)
+        (10, {}, {}, {}, 1, 15 * 60),
+        (7 * 24 * 60, {}, {}, {}, 1, 24 * HOUR),
+        # Nothing new, so the previous interval is stretched
+        (60, {}, {}, {"poll_interval": HOUR}, 0, 1.5 * HOUR),
+        (60, {}, {}, {"poll_interval": 20 * HOUR}, 0, 24 * HOUR),
+        # Something new, so the previous interval is ignored
+        (60, {}, {}, {"poll_interval": 20 * HOUR}, 2, HOUR / 2),
+        # Not enough entries to tell how often the feed publishes
+        (None, {}, {}, {}, 0, 15 * 60),
+        (None, {}, {}, {"publish_interval": 4 * HOUR}, 1, 2 * HOUR),
+        # The feed's and the server's hints are minimums
+        (60, {"ttl": "120"}, {}, {}, 1, 2 * HOUR),
+        (60, {"ttl": "10"}, {}, {}, 1, HOUR / 2),
+        (60, {"sy_updateperiod": "daily", "sy_updatefrequency": "4"}, {}, {}, 1, 6 * HOUR),
+        (60, {"sy_updateperiod": "hourly", "sy_updatefrequency": "0"}, {}, {}, 1, HOUR),
+        (60, {}, {"Cache-Control": "max-age=7200"}, {}, 1, 2 * HOUR),
+    ],
+)
+def test_schedule_next_check(
+    monkeypatch, gap_minutes, hints, headers, local_feed, new_articles_count, expected_interval
+):
+    monkeypatch.setattr(scheduler, "now", lambda: NOW)
+    feed = make_feed(monkeypatch, gap_minutes, hints, headers)
+
+    scheduler.schedule_next_check(local_feed, feed, new_articles_count)
+
+    assert local_feed["poll_interval"] == expected_interval
+    assert local_feed["next_check"] == NOW.shift(seconds=expected_interval)
+
+
+def test_schedule_next_check_skip_hours(monkeypatch):
+    monkeypatch.setattr(scheduler, "now", lambda: NOW)
+    feed = make_feed(monkeypatch, 60, hints={"skip_hours": [10, 11]})
+    local_feed = {}
+
+    scheduler.schedule_next_check(local_feed, feed, 1)
+
+    assert local_feed["next_check"] == arrow.get("2026-10-17T12:00:00+00:00")
+
+
+def test_schedule_next_check_keeps_hints_when_not_modified(monkeypatch):
+    monkeypatch.setattr(scheduler, "now", lambda: NOW)
+    local_feed = {}
+    scheduler.schedule_next_check(local_feed, make_feed(monkeypatch, 60, hints={"ttl": "120", "skip_hours": [13]}), 1)
+
+    # A 304 has neither entries nor hints
+    scheduler.schedule_next_check(local_feed, make_feed(monkeypatch, status=304), 0)
+
+    assert local_feed["hinted_interval"] == 2 * HOUR
+    assert local_feed["skip_hours"] == [13]
+    assert local_feed["poll_interval"] == 3 * HOUR
+    assert local_feed["next_check"] == arrow.get("2026-10-17T14:00:00+00:00")
+
+
+def test_schedule_next_check_forgets_removed_hints(monkeypatch):
+    monkeypatch.setattr(scheduler, "now", lambda: NOW)
+    local_feed = {"hinted_interval": 2 * HOUR, "skip_hours": [12]}
+
+    scheduler.schedule_next_check(local_feed, make_feed(monkeypatch, 60), 1)
+
+    assert "hinted_interval" not in local_feed
+    assert "skip_hours" not in local_feed
+    assert local_feed["poll_interval"] == HOUR / 2
+
+
+@pytest.mark.parametrize("full_parse, expected_publish_interval", [(True, 60 * 60), (False, 4 * HOUR)])
+def test_schedule_next_check_publish_interval(monkeypatch, full_parse, expected_publish_interval):
+    monkeypatch.setattr(scheduler, "now", lambda: NOW)
+    local_feed = {"publish_interval": 4 * HOUR}
+
+    # A streamed feed only has the few entries up to the first read one, so they aren't measured
+    scheduler.schedule_next_check(local_feed, make_feed(monkeypatch, 60), 1, full_parse=full_parse)
+
+    assert local_feed["publish_interval"] == expected_publish_interval
+
+
+@pytest.mark.parametrize(
+    "hints, expected",
+    [
+        ({}, None),
+        ({"ttl": "60"}, HOUR),
+        ({"ttl": "soon"}, None),
+        ({"sy_updateperiod": "daily"}, 24 * HOUR),
+        ({"sy_updateperiod": " Weekly ", "sy_updatefrequency": "7"}, 24 * HOUR),
+        # The largest hint wins
+        ({"ttl": "60", "sy_updateperiod": "daily", "sy_updatefrequency": "2"}, 12 * HOUR),
+    ],
+)
+def test_get_hinted_interval(hints, expected):
+    assert scheduler.get_hinted_interval(hints) == expected
+
+
+@pytest.mark.parametrize(
+    "next_check, hours, expected",
+    [
+        ("2026-10-17T10:30:00", [], "2026-10-17T10:30:00"),
+        ("2026-10-17T10:30:00", [9, 12], "2026-10-17T10:30:00"),
+        ("2026-10-17T10:30:00", [10], "2026-10-17T11:00:00"),
+        ("2026-10-17T10:30:00", [10, 11, 12], "2026-10-17T13:00:00"),
+        ("2026-10-17T23:15:00", [23, 0], "2026-10-18T01:00:00"),
+        # A feed that asks to skip every hour is checked anyway
+        ("2026-10-17T10:30:00", list(range(24)), "2026-10-17T10:30:00"),
+    ],
+)
+def test_skip_hours(next_check, hours, expected):
+    assert scheduler.skip_hours(arrow.get(next_check), hours) == arrow.get(expected)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, None),
+        ({"Cache-Control": "max-age=600"}, 600),
+        ({"cache-control": "public, max-age = 60"}, 60),
+        ({"Cache-Control": "no-cache, max-age=600"}, None),
+        ({"Cache-Control": "no-store"}, None),
+        # max-age takes precedence over Expires
+        ({"Cache-Control": "max-age=600", "Expires": "Sat, 17 Oct 2026 12:00:00 GMT"}, 600),
+        ({"Expires": "Sat, 17 Oct 2026 11:00:00 GMT", "Date": "Sat, 17 Oct 2026 10:00:00 GMT"}, HOUR),
+        ({"Expires": "Sat, 17 Oct 2026 09:00:00 GMT", "Date": "Sat, 17 Oct 2026 10:00:00 GMT"}, 0),
+        ({"Expires": "0", "Date": "Sat, 17 Oct 2026 10:00:00 GMT"}, None),
+    ],
+)
+def test_get_cache_interval(headers, expected):
+    assert scheduler.get_cache_interval(headers) == expected